@@ -0,0 +1,587 @@
+import asyncio
+import json
+import math
+import os
+import pwd
+import re
+import socket
+import struct
+import threading
+import traceback
+from urllib.parse import parse_qs, urlsplit
+
+from submitter import ADMIN_USERS, SubmissionError
+from utils import log
+from utils import metrics
+from utils.snapshot import event_id, parse_event_id
+
+
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 415: 'Unsupported Media Type',
+           500: 'Internal Server Error'}
+
+# bytes of an upload that are read and written at once
+UPLOAD_CHUNK_SIZE = 1024 ** 2
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+def to_json(obj):
+    """
+    serializes an object to json, nan and inf (e.g. of missing telemetry) become null
+    :param obj: object consisting of dicts, lists, tuples, strings and numbers
+    :return: json string
+    """
+    def sanitize(value):
+        if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+            return None
+        if isinstance(value, dict):
+            return {str(key): sanitize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [sanitize(item) for item in value]
+        return value
+
+    return json.dumps(sanitize(obj), default=str)
+
+
+def peer_user(writer):
+    """
+    identifies the local user on the other end of a unix socket connection by its credentials
+    :param writer: asyncio.StreamWriter of the connection
+    :return: user name, None if the connection is not a unix socket or the uid has no user
+    """
+    sock = writer.get_extra_info('socket')
+    if sock is None or sock.family != socket.AF_UNIX or not hasattr(socket, 'SO_PEERCRED'):
+        return None
+
+    # struct ucred of linux: pid, uid, gid
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return None
+
+
+class Request(object):
+
+    def __init__(self, method, target, headers, reader):
+        """
+        parsed http request, the body is only read on demand
+        :param method: request method, e.g. GET
+        :param target: request target including the query string
+        :param headers: dict with lower case header names
+        :param reader: asyncio.StreamReader positioned at the start of the body
+        """
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path.rstrip('/') or '/'
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.reader = reader
+        self.body = b''
+        self.params = {}
+
+        # local user on the other end of the connection, None over tcp
+        self.user = None
+
+    @property
+    def content_length(self):
+        try:
+            return int(self.headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HTTPError(400, 'invalid content-length')
+
+    @property
+    def content_type(self):
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    async def read_body(self):
+        if self.content_length:
+            self.body = await self.reader.readexactly(self.content_length)
+        return self.body
+
+    async def stream_body(self, file_h, max_bytes):
+        """
+        writes the body to a file chunk by chunk
+        :param file_h: file opened for binary writing
+        :param max_bytes: maximum accepted size of the body
+        :return: number of bytes written
+        """
+        remaining = self.content_length
+        if remaining > max_bytes:
+            raise HTTPError(413, 'upload exceeds the limit of {} bytes'.format(max_bytes))
+
+        while remaining:
+            chunk = await self.reader.read(min(remaining, UPLOAD_CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(chunk, remaining)
+            file_h.write(chunk)
+            remaining -= len(chunk)
+        return self.content_length
+
+    def int_query(self, name, default):
+        try:
+            return int(self.query.get(name, default))
+        except ValueError:
+            raise HTTPError(400, "query parameter '{}' has to be an integer".format(name))
+
+    def json(self):
+        try:
+            return json.loads(self.body.decode('utf-8')) if self.body else {}
+        except ValueError:
+            raise HTTPError(400, 'request body is not valid json')
+
+
+class APIServer(object):
+
+    def __init__(self, dopq, host='127.0.0.1', port=8642, socket_path='', max_upload=10 * 1024 ** 3,
+                 actions_tcp=False):
+        """
+        http/json api of the queue, served by an asyncio event loop in a background thread. read requests are
+        answered from the published snapshot of the queue, so they are cheap regardless of the number of clients
+        :param dopq: instance of DopQ
+        :param host: address to listen on (only used without socket_path)
+        :param port: port to listen on (only used without socket_path)
+        :param socket_path: path of a unix socket to listen on instead of host and port
+        :param max_upload: maximum size of a submitted build context in bytes
+        :param actions_tcp: accept submissions and other actions over tcp, where the caller can not be identified.
+                            on the unix socket users may only submit and cancel their own jobs, the other actions
+                            are reserved for admins
+        """
+        self.dopq = dopq
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.max_upload = max_upload
+        self.actions_tcp = actions_tcp
+        self.logger = log.get_module_log(__name__)
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self._started = threading.Event()
+
+        # queues of the connected event streams
+        self.subscribers = set()
+
+        # (method, path pattern, handler), handlers of GET requests must not block. coroutines read the request body
+        # themselves and return None if they have written the response already
+        self.routes = [('GET', r'/events', self.stream_events),
+                       ('POST', r'/jobs', self.post_job),
+                       ('GET', r'/jobs/(?P<job_id>[0-9a-f]+)', self.get_job),
+                       ('GET', r'/status', self.get_status),
+                       ('GET', r'/metrics', self.get_metrics),
+                       ('GET', r'/queue', self.get_queue),
+                       ('GET', r'/running', self.get_running),
+                       ('GET', r'/history', self.get_history),
+                       ('GET', r'/users', self.get_users),
+                       ('GET', r'/recommendations', self.get_recommendations),
+                       ('POST', r'/pause', self.post_pause),
+                       ('POST', r'/resume', self.post_resume),
+                       ('POST', r'/reload', self.post_reload),
+                       ('POST', r'/jobs/(?P<job_id>[0-9a-f]+)/cancel', self.post_cancel),
+                       ('POST', r'/gpus/(?P<minor>\d+)/enable', self.post_enable_gpu)]
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    @property
+    def address(self):
+        return self.socket_path if self.socket_path else '{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        self.dopq.snapshots.listeners.append(self.on_publish)
+        self.thread = threading.Thread(target=self.run, name='DoPQ-API')
+        self.thread.daemon = True
+        self.thread.start()
+        self._started.wait(5)
+
+    def stop(self):
+        if self.on_publish in self.dopq.snapshots.listeners:
+            self.dopq.snapshots.listeners.remove(self.on_publish)
+        if self.loop is not None and self.running:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            if self.socket_path:
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+                self.server = self.loop.run_until_complete(asyncio.start_unix_server(self.handle,
+                                                                                     path=self.socket_path))
+            else:
+                self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        except Exception:
+            self.logger.error('could not start the api on {}: {}'.format(self.address, traceback.format_exc()))
+            self._started.set()
+            return
+
+        self.logger.info('api listening on {}'.format(self.address))
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+
+            # end the open event streams
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    async def read_request(self, reader):
+        """
+        reads and parses a http/1.1 request
+        :param reader: asyncio.StreamReader
+        :return: Request, None if the connection was closed
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, 'malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        return Request(method.upper(), target, headers, reader)
+
+    async def write_response(self, writer, status, payload):
+        # text responses are given as (content type, text)
+        if isinstance(payload, tuple):
+            content_type, body = payload[0], payload[1].encode('utf-8')
+        else:
+            content_type, body = 'application/json', to_json(payload).encode('utf-8')
+        head = ('HTTP/1.1 {} {}\r\n'
+                'Content-Type: {}\r\n'
+                'Content-Length: {}\r\n'
+                'Connection: close\r\n\r\n').format(status, REASONS.get(status, ''), content_type, len(body))
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    def route(self, request):
+        """
+        finds the handler of a request
+        :param request: Request
+        :return: handler
+        :raises HTTPError: if no handler matches
+        """
+        path_matches = False
+        for method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, request.path)
+            if match is None:
+                continue
+            path_matches = True
+            if method == request.method:
+                request.params = match.groupdict()
+                return handler
+        if path_matches:
+            raise HTTPError(405, 'method {} not allowed for {}'.format(request.method, request.path))
+        raise HTTPError(404, 'unknown path {}'.format(request.path))
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                request = await self.read_request(reader)
+                if request is None:
+                    return
+                handler = self.route(request)
+
+                # every action has to be authorized, see authorize()
+                if request.method != 'GET':
+                    request.user = peer_user(writer)
+                    if request.user is None and not self.actions_tcp:
+                        raise HTTPError(403, 'actions are only accepted on the unix socket of the api, where the user '
+                                             'can be identified')
+
+                if asyncio.iscoroutinefunction(handler):
+                    response = await handler(request, writer)
+                    if response is None:
+                        return
+                    status, payload = response
+
+                # actions may access docker, they are run outside of the event loop
+                elif request.method == 'GET':
+                    status, payload = handler(request)
+                else:
+                    await request.read_body()
+                    status, payload = await self.loop.run_in_executor(None, handler, request)
+
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except HTTPError as e:
+                status, payload = e.status, {'error': str(e)}
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                status, payload = 500, {'error': 'internal error'}
+
+            await self.write_response(writer, status, payload)
+
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # client went away or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    def on_publish(self, snapshot, diff):
+        """
+        called by the snapshot publisher (from its thread) for every new snapshot
+        """
+        if diff is None or self.loop is None or not self.running:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.broadcast, diff)
+        except RuntimeError:
+            # loop has been closed in the meantime
+            pass
+
+    def broadcast(self, diff):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(diff)
+            except asyncio.QueueFull:
+                # slow client, it will notice the gap and receive a full snapshot instead
+                pass
+
+    @staticmethod
+    def write_event(writer, event, payload):
+        writer.write('event: {}\nid: {}\ndata: {}\n\n'.format(event, event_id(payload['run'], payload['seq']),
+                                                             to_json(payload)).encode('utf-8'))
+
+    async def stream_events(self, request, writer):
+        """
+        server-sent events: an initial 'snapshot' followed by a 'diff' for every published snapshot. clients resume
+        with ?since=<event id> or the Last-Event-ID header and only receive the diffs they missed, if still available.
+        the event id contains the run of the queue, clients of an earlier run receive a full snapshot
+        """
+        since = request.query.get('since', request.headers.get('last-event-id'))
+        try:
+            since = parse_event_id(since) if since is not None else None
+        except ValueError:
+            raise HTTPError(400, "query parameter 'since' has to be an event id '<run>-<seq>'")
+
+        queue = asyncio.Queue(maxsize=64)
+        self.subscribers.add(queue)
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\n'
+                         b'Connection: close\r\n\r\n')
+
+            diffs = self.dopq.snapshots.diffs_since(since[1], since[0]) if since is not None else None
+            if diffs is None:
+                snapshot = self.dopq.snapshot
+                self.write_event(writer, 'snapshot', snapshot._asdict())
+                last_seq = snapshot.seq
+            else:
+                for diff in diffs:
+                    self.write_event(writer, 'diff', diff)
+                last_seq = diffs[-1]['seq'] if diffs else since[1]
+            await writer.drain()
+
+            while True:
+                diff = await queue.get()
+                if diff['seq'] <= last_seq:
+                    continue
+
+                # diffs have been dropped, start over with the latest snapshot
+                if diff['prev'] != last_seq:
+                    snapshot = self.dopq.snapshot
+                    self.write_event(writer, 'snapshot', snapshot._asdict())
+                    last_seq = snapshot.seq
+                else:
+                    self.write_event(writer, 'diff', diff)
+                    last_seq = diff['seq']
+                await writer.drain()
+        finally:
+            self.subscribers.discard(queue)
+
+    async def post_job(self, request, writer):
+        """
+        submits a job, either a zipped build context (content type application/zip, the container_config.json is read
+        from it) or a json object with the 'config' and an existing 'image'. the job id is returned right away, the
+        image is built in the background
+        """
+
+        # the executor_name of the config is chosen by the caller, so it has to match the user on the other end
+        user = request.user
+        submitter = self.dopq.submitter
+        job_id = submitter.new_job_id()
+
+        if request.content_type in ('application/zip', 'application/octet-stream'):
+            path = submitter.context_path(job_id)
+            try:
+                with open(path, 'wb') as file_h:
+                    await request.stream_body(file_h, self.max_upload)
+            except BaseException:
+                os.remove(path)
+                raise
+            submit_fn, args = submitter.submit_context, (job_id, None, user)
+
+        elif request.content_type == 'application/json':
+            await request.read_body()
+            submission = request.json()
+            if not isinstance(submission, dict) or 'config' not in submission or 'image' not in submission:
+                raise HTTPError(400, "json submissions need the container 'config' and an existing 'image'")
+            submit_fn, args = submitter.submit_image, (job_id, submission['config'], submission['image'], user)
+
+        else:
+            raise HTTPError(415, 'submit a zipped build context (application/zip) or an image (application/json)')
+
+        # validation may access docker
+        try:
+            state = await self.loop.run_in_executor(None, submit_fn, *args)
+        except SubmissionError as e:
+            raise HTTPError(400, str(e))
+        return 202, state
+
+    def get_job(self, request):
+        """
+        state of a job, from submission until it has finished
+        """
+        job_id = request.params['job_id']
+        snapshot = self.dopq.snapshot
+        for field, status in (('running', 'running'), ('enqueued', 'enqueued'), ('history', 'finished')):
+            for info in getattr(snapshot, field):
+                if info['job_id'] == job_id:
+                    return 200, {'job_id': job_id, 'status': status, 'info': info,
+                                 'log_file': self.dopq.log_file(job_id)}
+
+        state = self.dopq.submitter.state(job_id)
+        if state is None:
+            raise HTTPError(404, 'unknown job {}'.format(job_id))
+        return 200, state
+
+    # read endpoints
+
+    def get_status(self, request):
+        snapshot = self.dopq.snapshot
+        return 200, {'seq': snapshot.seq, 'time': snapshot.time, 'status': snapshot.status,
+                     'paused': self.dopq.paused, 'n_enqueued': snapshot.n_enqueued, 'n_history': snapshot.n_history,
+                     'logfile': os.path.abspath(self.dopq.logfile)}
+
+    def get_metrics(self, request):
+        """
+        metrics of the queue in the OpenMetrics text format, for prometheus
+        """
+        return 200, (metrics.CONTENT_TYPE, metrics.REGISTRY.render())
+
+    async def get_queue(self, request, writer):
+        """
+        range of the enqueued containers, e.g. /queue?offset=40&count=20, all containers of the snapshot by default.
+        pages beyond the snapshot may access docker and are read outside of the event loop
+        """
+        snapshot = self.dopq.snapshot
+        if 'offset' not in request.query and 'count' not in request.query:
+            return 200, {'seq': snapshot.seq, 'total': snapshot.n_enqueued, 'containers': snapshot.enqueued}
+
+        offset = request.int_query('offset', 0)
+        count = request.int_query('count', 20)
+        if offset < 0 or count < 1:
+            raise HTTPError(400, 'offset has to be >= 0 and count >= 1')
+
+        if offset + count <= len(snapshot.enqueued):
+            containers = snapshot.enqueued[offset:offset + count]
+        else:
+            containers = await self.loop.run_in_executor(None, self.dopq.enqueued_page, offset, count)
+
+        return 200, {'seq': snapshot.seq, 'offset': offset, 'count': count, 'total': snapshot.n_enqueued,
+                     'containers': containers}
+
+    def get_running(self, request):
+        snapshot = self.dopq.snapshot
+        return 200, {'seq': snapshot.seq, 'containers': snapshot.running}
+
+    async def get_history(self, request, writer):
+        """
+        range of the history, e.g. /history?offset=40&count=20. pages beyond the snapshot may access docker and are
+        read outside of the event loop
+        """
+        offset = request.int_query('offset', 0)
+        count = request.int_query('count', 20)
+        if offset < 0 or count < 1:
+            raise HTTPError(400, 'offset has to be >= 0 and count >= 1')
+
+        snapshot = self.dopq.snapshot
+
+        # the most recent containers are part of the snapshot
+        if offset + count <= len(snapshot.history):
+            containers = snapshot.history[offset:offset + count]
+        else:
+            containers = await self.loop.run_in_executor(None, self.dopq.history_page, offset, count)
+
+        return 200, {'seq': snapshot.seq, 'offset': offset, 'count': count, 'total': snapshot.n_history,
+                     'containers': containers}
+
+    def get_users(self, request):
+        snapshot = self.dopq.snapshot
+        return 200, {'seq': snapshot.seq, 'users': snapshot.users}
+
+    def get_recommendations(self, request):
+        recommendations = [dict(recommendation, user=user, name=name)
+                           for (user, name), recommendation in self.dopq.recommendations.items()]
+        return 200, {'recommendations': recommendations}
+
+    # actions
+
+    @staticmethod
+    def authorize(request, owner=None):
+        """
+        checks that the caller may run an action. callers over tcp (only accepted with actions_tcp) are not checked
+        :param request: Request
+        :param owner: user who owns the object of the action, None for actions that only admins may run
+        :return: None
+        :raises HTTPError: if the caller is neither the owner nor an admin
+        """
+        if request.user is None or request.user in ADMIN_USERS or request.user == owner:
+            return
+        raise HTTPError(403, "user '{}' is not allowed to {} {}".format(request.user, request.method, request.path))
+
+    def post_pause(self, request):
+        self.authorize(request)
+        self.dopq.pause()
+        return 200, {'paused': True}
+
+    def post_resume(self, request):
+        self.authorize(request)
+        self.dopq.resume()
+        return 200, {'paused': False}
+
+    def post_reload(self, request):
+        self.authorize(request)
+        self.dopq.reload_config(lambda msg: self.logger.info(msg))
+        return 200, {'reloaded': True}
+
+    def post_cancel(self, request):
+        container = self.dopq.find_job(request.params['job_id'])
+        if container is not None:
+            self.authorize(request, owner=container.user)
+        result = self.dopq.cancel(request.params['job_id']) if container is not None else None
+        if result is None:
+            raise HTTPError(404, 'no enqueued or running job with id {}'.format(request.params['job_id']))
+        return 200, {'job_id': request.params['job_id'], 'result': result}
+
+    def post_enable_gpu(self, request):
+        self.authorize(request)
+        enabled = self.dopq.enable_gpu(int(request.params['minor']))
+        return 200, {'minor': int(request.params['minor']), 'enabled': enabled}
@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+from docker.errors import APIError, NotFound
+
+from utils import log
+
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class ArtifactCollector(object):
+
+    def __init__(self, output_dir, chunk_size=2 * 1024 ** 2, max_attempts=3, retry_delay=60):
+        """
+        copies the declared output paths (see ContainerConfig.output_paths) out of finished containers. the tar
+        streams of docker are written chunk by chunk, optionally gzip compressed, to a directory per job in the output
+        directory of the user, together with a manifest of sizes and sha256 checksums
+        :param output_dir: directory where the artifacts are stored (in a subdirectory per user)
+        :param chunk_size: number of bytes read from docker at once
+        :param max_attempts: number of attempts for a container of which no path could be collected
+        :param retry_delay: seconds between two attempts
+        """
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.logger = log.get_module_log(__name__)
+        self.jobs = queue.Queue()
+        self.attempts = {}
+        self.timers = []
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-Artifacts')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        for timer in self.timers:
+            timer.cancel()
+        self.jobs.put(None)
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def submit(self, container):
+        """
+        schedules the collection of the artifacts of a finished container
+        :param container: Container object with declared output paths
+        :return: None
+        """
+        self.jobs.put(container)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            container = self.jobs.get()
+            if container is None:
+                continue
+            try:
+                manifest_path = self.collect(container)
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                manifest_path = None
+
+            if manifest_path is None:
+                self.retry(container)
+            else:
+                self.attempts.pop(container.job_id, None)
+
+    def retry(self, container):
+        """
+        schedules another attempt to collect the artifacts of a container, until max_attempts is reached. containers
+        whose artifacts are still missing are also submitted again when the queue restarts
+        :param container: Container object
+        :return: None
+        """
+        attempts = self.attempts.get(container.job_id, 0) + 1
+        if attempts >= self.max_attempts:
+            self.attempts.pop(container.job_id, None)
+            self.logger.error('\tgave up collecting the artifacts of {} after {} attempts'.format(container, attempts))
+            return
+
+        self.attempts[container.job_id] = attempts
+        timer = threading.Timer(self.retry_delay, self.submit, args=(container,))
+        timer.daemon = True
+        timer.start()
+        self.timers = [timer_i for timer_i in self.timers if timer_i.is_alive()] + [timer]
+
+    def job_dir(self, container):
+        """
+        :return: directory where the artifacts of a container are stored
+        """
+        return os.path.join(self.output_dir, container.user, '{}_{}'.format(container.name, container.job_id))
+
+    def store(self, container, path, file_path, compress):
+        """
+        streams a path of the container as tar archive to a file
+        :param container: Container object
+        :param path: file or folder inside the container
+        :param file_path: path of the tar file
+        :param compress: gzip compress the tar file
+        :return: manifest entry of the artifact
+        """
+        stream, stat = container.get_archive(path, chunk_size=self.chunk_size)
+
+        size = 0
+        checksum = hashlib.sha256()
+        open_fn = gzip.open if compress else open
+        with open_fn(file_path, 'wb') as file_h:
+            for chunk in stream:
+                file_h.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+
+        return {'path': path,
+                'file': os.path.basename(file_path),
+                'size': size,
+                'stored_size': os.path.getsize(file_path),
+                'sha256': checksum.hexdigest(),
+                'stat': stat}
+
+    def collect(self, container):
+        """
+        collects all output paths of a container and writes the manifest
+        :param container: Container object
+        :return: path of the manifest, None if not a single path could be collected
+        """
+        job_dir = self.job_dir(container)
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir)
+
+        compress = container.config.compress_outputs
+        entries = []
+        for index, path in enumerate(container.config.output_paths):
+
+            # the index keeps the file names unique if several paths have the same base name
+            base_name = os.path.basename(path.rstrip('/')) or 'root'
+            file_name = '{}_{}.tar{}'.format(index, base_name, '.gz' if compress else '')
+
+            try:
+                entries.append(self.store(container, path, os.path.join(job_dir, file_name), compress))
+            except (APIError, NotFound, IOError) as e:
+                self.logger.warning('\tcould not collect {} from {}: {}'.format(path, container, e))
+                entries.append({'path': path, 'error': str(e)})
+
+        manifest = {'job_id': container.job_id,
+                    'container_id': container.container_id,
+                    'collected_at': time.time(),
+                    'compressed': bool(compress),
+                    'artifacts': entries}
+
+        manifest_path = os.path.join(job_dir, MANIFEST_FILE)
+        with open(manifest_path + '.tmp', 'w') as file_h:
+            json.dump(manifest, file_h, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+        # the manifest records the errors, but the collection is only complete if something was collected
+        collected = [entry for entry in entries if 'error' not in entry]
+        if entries and not collected:
+            self.logger.warning('\tcould not collect any artifact of {}'.format(container))
+            return None
+
+        container.artifacts = manifest_path
+        self.logger.info('\tcollected {} of {} artifact(s) of {}'.format(len(collected), len(entries), container))
+        return manifest_path
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+client.py
+
+Runs the interface in its own process, as a client of the api of a running queue. The state of the queue is kept up
+to date by the event stream of the api, so any number of clients can watch the queue at the same time.
+"""
+
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import zipfile
+from urllib.parse import urlencode
+
+from utils import log
+from utils.snapshot import Snapshot, apply_diff, event_id
+
+
+LOG = log.get_module_log(__name__)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class APIError(Exception):
+    pass
+
+
+class RemoteQueue(object):
+
+    def __init__(self, address='127.0.0.1:8642', timeout=10, retry_interval=2):
+        """
+        stand-in for DopQ that is backed by the api of a queue running in another process
+        :param address: 'host:port' of the api, or the path of its unix socket
+        :param timeout: timeout of requests in seconds
+        :param retry_interval: seconds between attempts to reconnect the event stream
+        """
+        self.address = address
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._snapshot = None
+        self._received = threading.Event()
+        self._stop_event = threading.Event()
+        self._response = None
+        self.thread = None
+
+        self.logfile = self.request('GET', '/status')['logfile']
+
+    def connection(self, timeout=None):
+        if ':' in self.address and not self.address.startswith('/'):
+            host, port = self.address.rsplit(':', 1)
+            return http.client.HTTPConnection(host, int(port), timeout=timeout)
+        return UnixHTTPConnection(self.address, timeout=timeout)
+
+    def request(self, method, path, query=None, body=None, file_h=None):
+        """
+        sends a request to the api
+        :param method: 'GET' or 'POST'
+        :param path: path of the endpoint
+        :param query: dict with query parameters
+        :param body: object that is sent as json
+        :param file_h: zip file (opened for binary reading) that is streamed as body instead
+        :return: decoded json response
+        :raises APIError: if the api responds with an error
+        """
+        if query:
+            path += '?' + urlencode(query)
+        headers, data = {}, None
+        if file_h is not None:
+            headers = {'Content-Type': 'application/zip', 'Content-Length': str(os.fstat(file_h.fileno()).st_size)}
+            data = file_h
+        elif body is not None:
+            headers = {'Content-Type': 'application/json'}
+            data = json.dumps(body).encode('utf-8')
+
+        connection = self.connection(self.timeout)
+        try:
+            try:
+                connection.request(method, path, body=data, headers=headers)
+            except (BrokenPipeError, ConnectionResetError):
+                # the api rejected an upload before it was sent completely, its response tells why
+                pass
+            response = connection.getresponse()
+            payload = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+        if response.status >= 400:
+            raise APIError(payload.get('error', response.reason))
+        return payload
+
+    @property
+    def snapshot(self):
+        """
+        latest state of the queue as received from the event stream
+        :return: snapshot.Snapshot
+        """
+        if self._snapshot is None:
+            self._received.wait(self.timeout)
+        return self._snapshot
+
+    @property
+    def status(self):
+        return self.snapshot.status['queue status'] if self.snapshot is not None else 'disconnected'
+
+    def history_page(self, offset, count):
+        return self.request('GET', '/history', {'offset': offset, 'count': count})['containers']
+
+    def enqueued_page(self, offset, count):
+        return self.request('GET', '/queue', {'offset': offset, 'count': count})['containers']
+
+    def pause(self):
+        self.request('POST', '/pause')
+
+    def resume(self):
+        self.request('POST', '/resume')
+
+    def cancel(self, job_id):
+        try:
+            return self.request('POST', '/jobs/{}/cancel'.format(job_id))['result']
+        except APIError:
+            return None
+
+    def enable_gpu(self, minor):
+        return self.request('POST', '/gpus/{}/enable'.format(minor))['enabled']
+
+    def submit_context(self, path, config_dict=None):
+        """
+        submits a build context
+        :param path: zip file or directory with the Dockerfile and the container_config.json
+        :param config_dict: container config that replaces the container_config.json of a directory
+        :return: dict with the state of the submission, including its 'job_id'
+        """
+        if os.path.isfile(path):
+            if config_dict is not None:
+                raise APIError('the config of a zipped build context has to be part of the zip file')
+            with open(path, 'rb') as file_h:
+                return self.request('POST', '/jobs', file_h=file_h)
+
+        # zip the directory on the fly
+        with tempfile.TemporaryFile() as file_h:
+            with zipfile.ZipFile(file_h, 'w', zipfile.ZIP_DEFLATED) as zip_h:
+                for root, _, filenames in os.walk(path):
+                    for filename in filenames:
+                        file_path = os.path.join(root, filename)
+                        arcname = os.path.relpath(file_path, path)
+                        if config_dict is not None and arcname == 'container_config.json':
+                            continue
+                        zip_h.write(file_path, arcname)
+                if config_dict is not None:
+                    zip_h.writestr('container_config.json', json.dumps(config_dict))
+            file_h.seek(0)
+            return self.request('POST', '/jobs', file_h=file_h)
+
+    def submit_image(self, config_dict, image):
+        """
+        submits a job that runs an existing image
+        :param config_dict: container config
+        :param image: name or id of the image
+        :return: dict with the state of the submission, including its 'job_id'
+        """
+        return self.request('POST', '/jobs', body={'config': config_dict, 'image': image})
+
+    def job(self, job_id):
+        return self.request('GET', '/jobs/{}'.format(job_id))
+
+    def log_file(self, job_id):
+        # the log files are read directly, so the client has to run on the host of the queue
+        try:
+            return self.job(job_id).get('log_file')
+        except APIError:
+            return None
+
+    def reload_config(self, report_fn=None):
+        if report_fn is not None:
+            report_fn('reloading config...')
+        self.request('POST', '/reload')
+        if report_fn is not None:
+            report_fn('reloading config: done')
+
+    def start(self):
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-Client')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        ends the subscription, the queue itself keeps running
+        :return: None
+        """
+        self._stop_event.set()
+        if self._response is not None:
+            self._response.close()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.subscribe()
+            except Exception:
+                if not self._stop_event.is_set():
+                    LOG.error('lost connection to the queue: {}'.format(traceback.format_exc()))
+            self._stop_event.wait(self.retry_interval)
+
+    def subscribe(self):
+        """
+        reads the event stream of the api until it is closed. after a reconnect only the missed diffs are requested
+        :return: None
+        """
+        query = {'since': event_id(self._snapshot.run, self._snapshot.seq)} if self._snapshot is not None else None
+        path = '/events' + ('?' + urlencode(query) if query else '')
+
+        connection = self.connection()
+        try:
+            connection.request('GET', path)
+            self._response = connection.getresponse()
+            if self._response.status != 200:
+                raise APIError(self._response.read().decode('utf-8'))
+
+            event, data = None, []
+            while not self._stop_event.is_set():
+                line = self._response.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8').rstrip('\n')
+
+                # a blank line dispatches the event
+                if not line:
+                    if event is not None:
+                        self.handle_event(event, json.loads('\n'.join(data)))
+                    event, data = None, []
+                elif line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+        finally:
+            self._response = None
+            connection.close()
+
+    def handle_event(self, event, payload):
+        if event == 'snapshot':
+            self._snapshot = Snapshot(**payload)
+        elif event == 'diff':
+            if self._snapshot is None or (payload['run'], payload['prev']) != (self._snapshot.run, self._snapshot.seq):
+                raise APIError('received diff {} without its predecessor'.format(payload['seq']))
+            self._snapshot = apply_diff(self._snapshot, payload)
+        self._received.set()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from utils import interface
+
+    parser = argparse.ArgumentParser(description="interface of a running docker priority queue")
+    parser.add_argument('-a', '--address', type=str, dest='address', default='127.0.0.1:8642',
+                        help="'host:port' of the queue api or the path of its unix socket")
+    parser.add_argument('-l', '--logfile', type=str, dest='logfile', metavar='filename', default='dopq_client.log')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('watch', help='show the interface (default)')
+    submit_parser = subparsers.add_parser('submit', help='submit a job to the queue')
+    submit_parser.add_argument('context', type=str, nargs='?', default=None,
+                               help='zip file or directory with the Dockerfile (and the container_config.json)')
+    submit_parser.add_argument('-i', '--image', type=str, dest='image', default=None,
+                               help='run an existing image instead of building one')
+    submit_parser.add_argument('-c', '--config', type=str, dest='config', metavar='filename', default=None,
+                               help='container_config.json, required with --image')
+    submit_parser.add_argument('-w', '--wait', action='store_true', help='wait until the job has been enqueued')
+
+    args = parser.parse_args()
+    log.init_log(args.logfile)
+
+    remote = RemoteQueue(args.address)
+
+    if args.command == 'submit':
+        config_dict = None
+        if args.config is not None:
+            with open(args.config, 'r') as file_h:
+                config_dict = json.load(file_h)
+
+        try:
+            if args.image is not None:
+                if config_dict is None:
+                    parser.error('--config is required with --image')
+                state = remote.submit_image(config_dict, args.image)
+            elif args.context is not None:
+                state = remote.submit_context(args.context, config_dict)
+            else:
+                parser.error('either a build context or --image is required')
+
+            print('submitted job {}'.format(state['job_id']))
+            while args.wait and state['status'] in ('submitted', 'building'):
+                time.sleep(1)
+                state = remote.job(state['job_id'])
+            print('status: {}{}'.format(state['status'], ' ({})'.format(state['error']) if state.get('error') else ''))
+        except APIError as e:
+            raise SystemExit('submission failed: {}'.format(e))
+
+    else:
+        remote.start()
+        try:
+            interface.run_interface(remote)
+        finally:
+            remote.stop()
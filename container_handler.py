@@ -1,8 +1,6 @@
 import docker
-import multiprocessing as mp
-import logging
-import os
-import time
+
+from log_collector import LogCollector
 
 
 class CHException(Exception):
@@ -21,7 +19,7 @@ class ContainerHandler(object):
         self.paths = config['paths']
         self.mounts = self.config.pop('mounts', None)
         self.logging_interval = self.config.pop('logging_interval', 1)
-        self.processes = []
+        self.log_collector = LogCollector(self.paths['log'], **config.get('logs', {}))
         self.containers = []
 
     @property
@@ -66,7 +64,7 @@ class ContainerHandler(object):
         :param user: user whom the container belongs to
         :param gpu_minors: gpu minor(s) that will be made visible to the container
         :param command: command that will be run inside the container (default=None)
-        :return: logging process, docker container
+        :return: future of the log follower, docker container
         """
         try:
             # append user dir to outdir
@@ -77,65 +75,20 @@ class ContainerHandler(object):
                                                       environment=["NVIDIA_VISIBLE_DEVICES="+str(gpu_minors)],
                                                       **self.config)
 
-            # log start time and start container
-            start_time = int(time.time())
+            # start container
             container.start()
             self.containers.append(container)
 
-            # start process that gets container logs and writes them to a logfile
-            p = mp.Process(target=self.monitor_container_logs, args=(container, user, image, start_time))
-            p.start()
-            self.processes.append(p)
+            # follow the container logs and write them to a logfile
+            future = self.log_collector.follow_id(container.id, container.id[:12], user, image)
 
-            return p, container
+            return future, container
 
         except Exception as e:
 
             # just so it's clear that the Exception came from this class
             raise CHException(e)
 
-    def monitor_container_logs(self, container, user, image, start_time):
-        """
-        method that fetches container logs and writes them to a logfile, runs as long as container is running
-        :param container: container for which to write logs
-        :param user: user whom the container belongs to
-        :param image: image from which the container is created
-        :param start_time: time at which the container was started
-        :return: None
-        """
-
-        # initialize logging for the container
-        logfile = os.path.join(self.paths['log'], user)
-        if not os.path.isdir(logfile): os.makedirs(logfile)
-        logfile = os.path.join(logfile, image + '.log')
-        logger_name = user + '_' + image
-        logger = logging.getLogger(logger_name)
-        logger.setLevel(logging.DEBUG)
-        logger.addHandler(logging.FileHandler(logfile))
-
-        # update container
-        container.reload()
-
-        # periodically write container logs to logfile
-        last_check = start_time
-        while container.status == 'running':
-
-            # wait set time before getting logs
-            time.sleep(self.logging_interval)
-
-            # get logs and update chekpoint time
-            new_logs = container.logs(since=last_check)
-            last_check = int(time.time())
-
-            # write logs and update container
-            logger.info(new_logs)
-            container.reload()
-
-        # write remaining logs, when container has finished
-        else:
-            new_logs = container.logs(since=last_check)
-            logger.info(new_logs)
-
 # some testing
 if __name__ == '__main__':
     import dop_q
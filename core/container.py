@@ -9,47 +9,81 @@ Provides a wrapper for container objects
 
 # from docker.models.containers import Container as DockerContainer
 # from core.containerconfig import ContainerConfig
+import functools
 import os
 import time
+import uuid
 
 from datetime import datetime
 from dateutil import parser
 
+import numpy as np
 import psutil
 
+from core.containerconfig import ContainerConfig
+from core.statecache import STATE_CACHE, JOB_LABEL
 from utils.gpu import get_gpus_status, get_gpu_infos
 from utils import log
-from utils.cpu import CPU
+from utils.docker_client import get_client
+from utils.logarchive import ARCHIVE_SUFFIX, LogArchive, job_log_path, split_timestamp, tail_file
+from utils.telemetry import SAMPLER
 import traceback
 
 import docker
-from docker.errors import APIError
+from docker.errors import APIError, NotFound
 
 LOG = log.get_module_log(__name__)
 
 
+def changes_state(method):
+    """
+    Decorator for actions on the docker container, the cached state of the container and of the queue is inspected
+    again on next access.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._last_reload = 0
+        STATE_CACHE.invalidate()
+        return result
+
+    return wrapper
+
+
 class Container:
     """
     Wrapper for docker container objects
     """
 
-    def __init__(self, config, image_id, log_dir=None, mounts=None):
+    # seconds for which the inspected state of the docker container is reused
+    CACHE_TTL = 1.0
+
+    def __init__(self, config, image_id, log_dir=None, mounts=None, job_id=None):
         """
         Creates a new container instance.
 
         :param config: Provides a run configuration for the docker container.
         :param container_obj: The underlying docker container instance.
+        :param job_id: Id of the job, e.g. if it has been handed out on submission. A new one is created if None.
         """
 
         self.config = config
+        self.job_id = job_id if job_id is not None else uuid.uuid4().hex[:12]
         self.container_id = None
         self.image_id = image_id
         self.last_log_update = int(time.time())
         self.last_log_file_update = int(time.time())
         self.log_dir = log_dir if log_dir is not None else ""
-        self._stats = None
+        self.artifacts = None
+        self.cancelled = False
+        self.removed = False
+        self.usage = None
         self._gpu_minors = None
+        self._container_obj = None
+        self._last_reload = 0
         self.created_at = datetime.fromtimestamp(time.time()).strftime("%a, %d.%b %H:%M")
+        self.enqueued_at = time.time()
         try:
             iter(mounts)
         except TypeError:
@@ -58,17 +92,69 @@ class Container:
             self.mounts = mounts
         self.mounts = self.create_mounts()
 
+    @classmethod
+    def from_record(cls, record, log_dir=None):
+        """
+        Creates a container from a job record as sent by the provider.
+
+        :param record: Dictionary with the container config ('config'), the image id ('image_id'), the mount
+                       strings ('mounts') and optionally the job id ('job_id').
+        :param log_dir: Directory where the logs of the container are collected.
+        :return: Container instance, None if the config is not valid
+        """
+        config = ContainerConfig.from_dict(record['config'])
+        if config is None:
+            return None
+        return cls(config, record['image_id'], log_dir=log_dir, mounts=record.get('mounts'), job_id=record.get('job_id'))
+
+    def __getstate__(self):
+        # docker objects hold the connection of the client and can not be pickled
+        state = self.__dict__.copy()
+        state['_container_obj'] = None
+        state.pop('_stats', None)
+        return state
+
+    def __setstate__(self, state):
+        # containers pickled by older versions lack the cache members
+        state.setdefault('_container_obj', None)
+        state.setdefault('_last_reload', 0)
+        state.setdefault('job_id', uuid.uuid4().hex[:12])
+        state.setdefault('artifacts', None)
+        state.setdefault('cancelled', False)
+        state.setdefault('removed', False)
+        state.setdefault('usage', None)
+        state.setdefault('enqueued_at', None)
+        self.__dict__.update(state)
+
     @property
     def container_obj(self):
         if self.container_id is None:
             return None
-        client = docker.from_env()
-        return client.containers.get(self.container_id)
+        if self._container_obj is None:
+            self._container_obj = get_client().containers.get(self.container_id)
+            self._last_reload = time.time()
+        return self._container_obj
 
     @property
     def image(self):
-        client = docker.from_env()
-        return client.images.get(self.image_id)
+        return get_client().images.get(self.image_id)
+
+    @property
+    def attrs(self):
+        """
+        inspected attributes of the docker container, taken from the shared state cache when possible
+        :return: attribute dictionary as returned by docker inspect
+        """
+        attrs = STATE_CACHE.attrs(self.container_id)
+        if attrs is None:
+            # containers created before the job label was introduced are not in the cache
+            self.reload()
+
+            # last state that was inspected before the container has been removed
+            if self.removed:
+                return self._container_obj.attrs if self._container_obj is not None else {}
+            attrs = self.container_obj.attrs
+        return attrs
 
     @property
     def start_time(self):
@@ -76,8 +162,7 @@ class Container:
         wrapper for getting the creation time of the container object
         :return: creation date and time as unicode
         """
-        self.reload()
-        state_val = self.container_obj.attrs.get('State')
+        state_val = self.attrs.get('State')
         if state_val is not None:
             start_val = state_val.get('StartedAt')
             if start_val is not None:
@@ -86,6 +171,16 @@ class Container:
         # fall back
         return datetime.utcnow()
 
+    @property
+    def exit_code(self):
+        """
+        wrapper for getting the exit code of the container object
+        :return: exit code, None if the container has not been created or has been removed before it was inspected
+        """
+        if self.removed:
+            return None
+        return (self.attrs.get('State') or {}).get('ExitCode')
+
     @property
     def finish_time(self):
         """
@@ -93,8 +188,7 @@ class Container:
         :return: creation date and time as unicode
         """
 
-        self.reload()
-        state_val = self.container_obj.attrs.get('State')
+        state_val = self.attrs.get('State')
         if state_val is not None:
             start_val = state_val.get('FinishedAt')
             if start_val is not None:
@@ -177,13 +271,19 @@ class Container:
     @property
     def status(self):
         """
-        The status of the container. For example, ``running``, or ``exited``.
+        The status of the container. For example, ``running``, or ``exited``. ``removed`` if the docker container has
+        been removed by someone else.
         """
         if self.container_id is None:
             return 'not created'
-        else:
+
+        status = STATE_CACHE.status(self.container_id)
+        if status is None:
             self.reload()
-            return self.container_obj.status
+            if self.removed:
+                return 'removed'
+            status = self.container_obj.status
+        return status
 
     def attach(self, **kwargs):
         """
@@ -247,6 +347,7 @@ class Container:
         return self.container_obj.exec_run(cmd, stdout, stderr, stdin, tty, privileged, user, detach, stream,
                                            socket, environment)
 
+    @changes_state
     def start(self, **kwargs):
         """
         Start this container. Similar to the ``docker start`` command, but
@@ -298,15 +399,14 @@ class Container:
                 raise e
 
             # start it
-            self._stats = self.container_obj.stats(decode=True, stream=True)
             return self.container_obj.start(**kwargs)
 
         else:
 
             LOG.warning("You should not call start to unpause a paused container!")
-            self._stats = self.container_obj.stats(decode=True, stream=True)
             return self.container_obj.unpause(**kwargs)
 
+    @changes_state
     def restart(self, **kwargs):
         """
         Restart this container. Similar to the ``docker restart`` command.
@@ -317,6 +417,7 @@ class Container:
         """
         return self.container_obj.restart(**kwargs)
 
+    @changes_state
     def pause(self):
         """
         Pauses all processes within this container.
@@ -327,6 +428,7 @@ class Container:
         """
         return self.container_obj.pause()
 
+    @changes_state
     def unpause(self):
         """
         Unpause all processes within the container.
@@ -337,6 +439,7 @@ class Container:
         """
         return self.container_obj.unpause()
 
+    @changes_state
     def stop(self):
         """
         Stops a container. Similar to the ``docker stop`` command.
@@ -347,6 +450,7 @@ class Container:
         """
         return self.container_obj.stop()
 
+    @changes_state
     def kill(self, signal=None):
         """
         Kill or send a signal to the container.
@@ -360,13 +464,15 @@ class Container:
         """
         return self.container_obj.kill(signal)
 
-    def get_archive(self, path):
+    def get_archive(self, path, chunk_size=2097152):
         """
         Retrieve a file or folder from the container in the form of a tar
         archive.
 
         Args:
             path (str): Path to the file or folder to retrieve
+            chunk_size (int): The number of bytes returned by each iteration
+                of the generator.
 
         Returns:
             (tuple): First element is a raw tar data stream. Second element is
@@ -376,7 +482,7 @@ class Container:
             :py:class:`docker.errors.APIError`
                 If the server returns an error.
         """
-        return self.container_obj.get_archive(path)
+        return self.container_obj.get_archive(path, chunk_size=chunk_size)
 
     def put_archive(self, path, data):
         """
@@ -396,6 +502,7 @@ class Container:
         """
         return self.container_obj.put_archive(path, data)
 
+    @changes_state
     def remove(self, **kwargs):
         """
         Remove this container. Similar to the ``docker rm`` command.
@@ -413,24 +520,37 @@ class Container:
         """
         return self.container_obj.remove(**kwargs)
 
-    def reload(self):
+    def reload(self, force=False):
+        """
+        Updates the cached state of the docker container, if it is older than CACHE_TTL. A container that does not
+        exist anymore is marked as removed, other errors keep the previous state.
+
+        :param force: Update regardless of the age of the cached state.
+        :return: None
+        """
+        if self.removed or (not force and time.time() - self._last_reload < self.CACHE_TTL):
+            return
         try:
             self.container_obj.reload()
+            self._last_reload = time.time()
+        except NotFound:
+            self.removed = True
+            LOG.warning('docker container of {} ({}) has been removed'.format(self.name, self.container_id))
         except Exception:
-            pass
+            LOG.error('could not inspect the docker container of {}: {}'.format(self.name, traceback.format_exc()))
+
+    def refresh(self):
+        """
+        Updates the cached state of the docker container immediately.
+        """
+        self.reload(force=True)
 
     @property
     def stats(self):
         """
-        wrapper that return the next item of the stats stream that is created in init
+        wrapper that returns a single (non-streaming) stats sample of the container, prefer the telemetry sampler
         """
-        if self._stats is None or not iter(self._stats) is iter(self._stats):
-            self._stats = self.container_obj.stats(decode=True, stream=True)
-
-        return next(self._stats)
-
-    def stop_stats_stream(self):
-        self._stats = None
+        return self.container_obj.stats(decode=True, stream=False)
 
     def top(self, **kwargs):
         """
@@ -503,15 +623,38 @@ class Container:
         """
         return self.container_obj.logs(**kwargs)
 
+    @property
+    def log_file(self):
+        """
+        Path of the log file written by the log collector, None if no log dir is set.
+        """
+        if not self.log_dir:
+            return None
+        return job_log_path(self.log_dir, self.user, self.name, self.job_id)
+
     def recent_logs(self, stdout=True, stderr=True, lines=3):
         """
-        Returns the most recent logs (given number of lines).
+        Returns the most recent logs (given number of lines). The collected log file (or its archive once the
+        container has finished) is used if it exists, since it does not require a request to the docker daemon.
 
         :param stdout: Whether to show standart output (flag)
         :param stderr: Whether to show standard error output (flag)
         :param lines: Number of lines to show.
         :return: Recent log bytes.
         """
+
+        # the collected logs contain both streams
+        log_file = self.log_file
+        if log_file is not None and stdout and stderr:
+            recent = None
+            if os.path.isfile(log_file + ARCHIVE_SUFFIX):
+                recent = LogArchive(log_file + ARCHIVE_SUFFIX).tail(lines)
+            elif os.path.isfile(log_file):
+                recent = tail_file(log_file, lines)
+
+            if recent is not None:
+                return b''.join(split_timestamp(line)[1] + b'\n' for line in recent)
+
         return self.logs(stdout=stdout, stderr=stderr, tail=lines)
 
     def export(self):
@@ -561,7 +704,7 @@ class Container:
             return 0
 
         # add to log
-        LOG.info("Container '{}' status: ".format(self.name(), new_logs))
+        LOG.info("Container '{}' status: {}".format(self.name, new_logs.decode('utf-8', errors='replace')))
 
         # return the number of new bytes
         return len(new_logs)
@@ -578,7 +721,7 @@ class Container:
         if file_path is None:
 
             # build file path
-            file_path = os.path.join(self.log_dir, "{}_{}.log".format(self.name(), self.created_at))
+            file_path = os.path.join(self.log_dir, "{}_{}.log".format(self.name, self.created_at))
 
         # get new logs
         new_logs = self.logs(stdout=True, stderr=True, since=self.last_log_file_update)
@@ -591,7 +734,7 @@ class Container:
             return 0
 
         # open in append mode and add
-        with open(file_path, 'a+') as file_h:
+        with open(file_path, 'ab') as file_h:
             file_h.write(new_logs)
 
         # return the number of new bytes
@@ -605,33 +748,37 @@ class Container:
         :return: String with container info.
         """
 
-        self.reload()
-
         # build base info
-        if self.container_obj is None:
+        status = self.status
+        if self.container_id is None:
             base_info = {'name': self.name, 'executor': self.executor, 'run_time': '',
                          'docker name': '', 'created': '', 'status': 'not built'}
+        elif status == 'removed' and self._container_obj is None:
+            base_info = {'name': self.name, 'executor': self.executor, 'run_time': '',
+                         'docker name': '', 'created': '', 'status': status}
         else:
             base_info = {'name': self.name, 'executor': self.executor, 'run_time': self.run_time,
-                         'docker name': self.docker_name, 'created': self.created_at, 'status': self.status}
+                         'docker name': self.docker_name, 'created': self.created_at, 'status': status}
 
         # also show runtime info?
         if runtime_stats:
 
-            # get stats
-            stats_dict = self.stats
+            # get the latest sample of the telemetry sampler, sample directly if the sampler is not running
+            if SAMPLER.running:
+                sample = SAMPLER.latest(self.job_id)
+            else:
+                sample = SAMPLER.sample_container(self)
 
-            # TODO: Extract cpu usage percentage (which seems to be a bit tricky..)
-            # cpu_stats = stats_dict['cpu_stats']
-            cpu = CPU(interval=0.1)
-            cpu_usage_percentage = cpu.cpu_percent() # changed this because psutil.cpu_percentage with interval is blocking
-            cpu_usage_percentage = '{}%'.format(cpu_usage_percentage)
+            cpu_usage_percentage, mem_usage = None, None
+            if sample is not None:
 
-            # calc memory usage
-            mem_stats = stats_dict['memory_stats']
-            mem_usage = mem_stats.get('usage')
-            if mem_usage is not None:
-                mem_usage = '{}%'.format(round(mem_usage * 100.0 / mem_stats['limit'],1))
+                # cpu usage of the container itself (100% = one core)
+                if not np.isnan(sample['cpu']):
+                    cpu_usage_percentage = '{}%'.format(sample['cpu'])
+
+                # calc memory usage
+                if not np.isnan(sample['memory']) and not np.isnan(sample['memory_limit']):
+                    mem_usage = '{}%'.format(round(sample['memory'] * 100.0 / sample['memory_limit'], 1))
 
             # add base runtime info
             base_info.update({'cpu': cpu_usage_percentage, 'memory': mem_usage})
@@ -639,8 +786,8 @@ class Container:
             # add gpu info, if required
             if self.use_gpu:
                 gpu_info = get_gpu_infos(self.gpu_minors)
-                base_info['gpu'] = [{'id': gpu_dt['id'], 'usage': round(gpu_dt['memoryUsed'] * 100.0 / gpu_dt['memoryTotal'], 1)}
-                                    for gpu_dt in list(gpu_info.values())]
+                base_info['gpu'] = [{'id': minor, 'usage': round(gpu_dt['memoryUsed'] * 100.0 / gpu_dt['memoryTotal'], 1)}
+                                    for minor, gpu_dt in list(gpu_info.items())]
 
         return base_info
 
@@ -671,6 +818,10 @@ class Container:
             # split mount string in source and target
             mount = mount.split(':')
 
+            # results of jobs with declared output paths are collected from the container instead
+            if mount[1] == '/outdir' and self.config.output_paths:
+                continue
+
             # append user folder to source if target is outdir
             if mount[1] == '/outdir':
                 mount[0] = os.path.join(mount[0], self.executor)
@@ -693,11 +844,14 @@ class Container:
         :return: docker container
         """
 
-        client = docker.from_env()
+        client = get_client()
         create_conf = self.config.docker_params(image=self.image, detach=True, mounts=self.mounts,
-                                           environment=["NVIDIA_VISIBLE_DEVICES=" + str(','.join(self.gpu_minors))])
+                                           environment=["NVIDIA_VISIBLE_DEVICES=" + str(','.join(self.gpu_minors))],
+                                           labels={JOB_LABEL: self.job_id})
         container = client.containers.create(**create_conf)
         self.container_id = container.id
+        self._container_obj = container
+        self._last_reload = time.time()
 
 if __name__ == '__main__':
     from .containerconfig import ContainerConfig
@@ -7,7 +7,11 @@ Provides a configuration wrapper for container objects.
 """
 
 import json
+import math
+
+from utils.accounting import memory_bytes
 from utils.gpu import get_system_gpus
+from utils.inventory import INVENTORY
 from utils import log
 
 
@@ -16,7 +20,8 @@ LOG = log.get_module_log(__name__)
 
 class ContainerConfig:
 
-    def __init__(self, name, executor_name, num_gpus, num_slots, required_memory, build_flag=True, run_params=None):
+    def __init__(self, name, executor_name, num_gpus, num_slots, required_memory, build_flag=True, run_params=None,
+                 output_paths=None, compress_outputs=False):
         self.name = name
         self.executor_name = executor_name
         self.required_memory = required_memory
@@ -24,6 +29,14 @@ class ContainerConfig:
         self.num_slots = num_slots
         self.build_flag = build_flag
         self.run_params = run_params if run_params is not None else dict()
+        self.output_paths = output_paths if output_paths is not None else list()
+        self.compress_outputs = compress_outputs
+
+    def __setstate__(self, state):
+        # configs pickled by older versions lack the artifact settings
+        state.setdefault('output_paths', list())
+        state.setdefault('compress_outputs', False)
+        self.__dict__.update(state)
 
     @staticmethod
     def from_dict(config_dict):
@@ -40,6 +53,8 @@ class ContainerConfig:
         num_slots = config_dict.get('num_slots', 1)
         build_flag = config_dict.get('build_flag', True)
         run_params = config_dict.get('run_params')
+        output_paths = config_dict.get('output_paths') or list()
+        compress_outputs = config_dict.get('compress_outputs', False)
 
         # check name and executor
         for param_i, param_val_i in [('container name', name),
@@ -54,6 +69,14 @@ class ContainerConfig:
                 LOG.error("'{}' has to be at least 3 characters long!".format(param_i))
                 return None
 
+        # output paths are collected from the container after it has finished
+        if isinstance(output_paths, str):
+            output_paths = [output_paths]
+        for path_i in output_paths:
+            if not isinstance(path_i, str) or not path_i.startswith('/'):
+                LOG.error("output path '{}' has to be an absolute path inside the container!".format(path_i))
+                return None
+
         # check if we have enough system GPUs to run this container
         num_sys_gpus = len(get_system_gpus())
         if num_gpus > num_sys_gpus:
@@ -61,9 +84,20 @@ class ContainerConfig:
                       "(requested={}, available={}!".format(num_gpus, num_sys_gpus))
             return None
 
+        # the memory limit is not enforced against the host, but such a job will most likely be killed
+        required_bytes = memory_bytes(required_memory)
+        if math.isnan(required_bytes):
+            LOG.error("required memory '{}' has to be a size (e.g. '32g', '512m' or '1.5GiB'), numbers without unit "
+                      "are GB!".format(required_memory))
+            return None
+        if required_bytes > INVENTORY.memory:
+            LOG.warning("The requested memory exceeds the memory of this system "
+                        "(requested={}, available={:.1f}g)".format(required_memory, INVENTORY.memory / 1024.0 ** 3))
+
         # create instance
         return ContainerConfig(name=name, executor_name=executor_name, required_memory=required_memory,
-                               num_gpus=num_gpus, num_slots=num_slots, build_flag=build_flag, run_params=run_params)
+                               num_gpus=num_gpus, num_slots=num_slots, build_flag=build_flag, run_params=run_params,
+                               output_paths=output_paths, compress_outputs=compress_outputs)
 
     @classmethod
     def from_string(cls, json_str):
@@ -91,12 +125,15 @@ class ContainerConfig:
         :return: ContainerConfig instance.
         """
 
-        return {'executor_name': self.executor_name,
+        return {'name': self.name,
+                'executor_name': self.executor_name,
                 'required_memory': self.required_memory,
                 'num_gpus': self.num_gpus,
                 'num_slots': self.num_slots,
                 'build_flag': self.build_flag,
-                'run_params': self.run_params}
+                'run_params': self.run_params,
+                'output_paths': self.output_paths,
+                'compress_outputs': self.compress_outputs}
 
     def save(self, file_path):
         """
@@ -113,7 +150,7 @@ class ContainerConfig:
         with open(file_path, 'w') as file_h:
             json.dump(config_dict, file_h)
 
-    def docker_params(self, image, detach, mounts, environment=None):
+    def docker_params(self, image, detach, mounts, environment=None, labels=None):
         """
         Build docker params from config and given parameters. Will perform a merge operation, if overlap exists.
 
@@ -125,6 +162,7 @@ class ContainerConfig:
         :param detach: Whether to run in detached mode (instant return)
         :param mounts: Mount configuration.
         :param environment: Environment variables.
+        :param labels: Dictionary with labels for the container.
         :return: Dictionary which can be passed as kwargs to client.containers.run
         """
 
@@ -134,11 +172,8 @@ class ContainerConfig:
 
         docker_params = self.run_params.copy()
 
-        # fix mem limit
-        mem_limit = str(self.required_memory)
-        if not mem_limit.lower().endswith('g'):
-            LOG.warning("Memory limit should also be in GB (with 'g' suffix)!")
-            mem_limit = "{}g".format(mem_limit)
+        # in bytes, docker does not understand every unit of the config (e.g. GiB or fractions)
+        mem_limit = memory_bytes(self.required_memory)
 
         # add default build parameters
         build_params = {'mem_limit': mem_limit,
@@ -159,5 +194,12 @@ class ContainerConfig:
         else:
             docker_params['environment'] = environment
 
+        # add or update labels
+        if labels is not None:
+            user_labels = docker_params.get('labels') or {}
+            if isinstance(user_labels, list):
+                user_labels = {label: '' for label in user_labels}
+            docker_params['labels'] = dict(user_labels, **labels)
+
         # return params
         return docker_params
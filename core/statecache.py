@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+statecache.py
+
+Provides a cache for the state of all docker containers created by the queue
+"""
+
+import threading
+import time
+
+from docker.errors import NotFound
+
+from utils import log
+from utils.docker_client import get_client
+
+
+LOG = log.get_module_log(__name__)
+
+# label that is attached to every docker container created by the queue, its value is the job id
+JOB_LABEL = 'dopq.job'
+
+
+class ContainerStateCache(object):
+    """
+    Refreshes the state of all queue managed containers with a single list call. Containers are only inspected
+    individually when their status changes (e.g. when they start or exit), since the list endpoint does not provide
+    start and finish times.
+    """
+
+    def __init__(self, ttl=1.0):
+        """
+        :param ttl: Seconds for which a refresh is reused.
+        """
+        self.ttl = ttl
+        self._status = {}
+        self._attrs = {}
+        self._last_refresh = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """
+        Updates the states of all containers carrying the job label, if the cache is older than the ttl.
+
+        :param force: Refresh regardless of the age of the cache.
+        :return: None
+        """
+
+        with self._lock:
+            if not force and time.time() - self._last_refresh < self.ttl:
+                return
+
+            client = get_client()
+            listed = client.api.containers(all=True, filters={'label': JOB_LABEL})
+            status = {container['Id']: container['State'] for container in listed}
+
+            # inspect containers that are new or whose status has changed
+            attrs = {}
+            for container_id, container_status in status.items():
+                cached = self._attrs.get(container_id)
+                if cached is not None and self._status.get(container_id) == container_status:
+                    attrs[container_id] = cached
+                    continue
+                try:
+                    attrs[container_id] = client.api.inspect_container(container_id)
+                except NotFound:
+                    continue
+
+            self._status = status
+            self._attrs = attrs
+            self._last_refresh = time.time()
+
+    def status(self, container_id):
+        """
+        :param container_id: Id of the docker container.
+        :return: Status of the container (e.g. running or exited), None if the container is not in the cache
+        """
+        self.refresh()
+        return self._status.get(container_id)
+
+    def attrs(self, container_id):
+        """
+        :param container_id: Id of the docker container.
+        :return: Inspected attributes of the container, None if the container is not in the cache
+        """
+        self.refresh()
+        return self._attrs.get(container_id)
+
+    def invalidate(self):
+        """
+        Forces a refresh on the next access.
+        """
+        self._last_refresh = 0
+
+
+STATE_CACHE = ContainerStateCache()
@@ -19,22 +19,63 @@ History:
 import configparser
 import datetime
 import os
+import signal
 import threading
 import time
 import traceback
 
 import dill
-import docker
 import numpy as np
 from docker.errors import APIError
-from pathos.helpers import mp
 
+import api
+import artifact_collector as ac
 import gpu_handler as gh
 import helper_process as hp
+import image_collector as ic
+import log_collector as lc
 import provider
+import submitter
+from core.container import Container
+from providerfuncs import schedule
+from utils import accounting
 from utils import interface
+from utils import ipc
 from utils import log
-from utils.gpu import GPU
+from utils.docker_client import get_client
+from utils.gpu import GPU, GPU_SAMPLER, create_backend, get_drained_gpus
+from utils.gpuhealth import GPUHealth
+from utils.inventory import INVENTORY
+from utils.metrics import REGISTRY
+from utils.snapshot import SnapshotPublisher
+from utils.telemetry import SAMPLER
+
+
+# metrics of the queue, served on /metrics of the api
+QUEUE_LENGTH = REGISTRY.gauge('dopq_queue_length', 'enqueued jobs per user', ['user'])
+OLDEST_WAIT = REGISTRY.gauge('dopq_queue_oldest_wait_seconds', 'time the longest waiting job has been enqueued',
+                             unit='seconds')
+PAUSED = REGISTRY.gauge('dopq_queue_paused', '1 if the queue does not start new jobs')
+WAIT_TIME = REGISTRY.histogram('dopq_wait_seconds', 'time between receiving and starting a job', ['user'],
+                               unit='seconds', buckets=(60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, 259200))
+BUILD_TIME = REGISTRY.histogram('dopq_build_seconds', 'duration of the image builds', ['source'], unit='seconds',
+                                buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+FETCH_BYTES = REGISTRY.counter('dopq_fetch_bytes', 'size of the submissions copied from the network share',
+                               unit='bytes')
+FETCH_TIME = REGISTRY.histogram('dopq_fetch_seconds', 'duration of the copies from the network share',
+                                unit='seconds', buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+STARTS = REGISTRY.counter('dopq_container_starts', 'started containers', ['user'])
+FAILURES = REGISTRY.counter('dopq_container_failures', 'containers that could not be started (reason start) or '
+                                                       'exited with an error (reason exit)', ['user', 'reason'])
+CYCLE_TIME = REGISTRY.histogram('dopq_scheduler_cycle_seconds', 'duration of a scheduler cycle without sleeping',
+                                unit='seconds')
+LAST_CYCLE = REGISTRY.gauge('dopq_scheduler_last_cycle_timestamp_seconds', 'start of the latest scheduler cycle',
+                            unit='seconds')
+GPUS = REGISTRY.gauge('dopq_gpus', 'gpus of the system by state (total, allocated, drained)', ['state'])
+GPU_ALLOCATED = REGISTRY.gauge('dopq_gpu_allocated', '1 if the gpu is assigned to a running job', ['minor'])
+GPU_UTILIZATION = REGISTRY.gauge('dopq_gpu_utilization_percent', 'utilization of the gpu', ['minor'],
+                                 unit='percent')
+GPU_MEMORY = REGISTRY.gauge('dopq_gpu_memory_used_bytes', 'used memory of the gpu', ['minor'], unit='bytes')
 
 
 class DopQ(hp.HelperProcess):
@@ -50,7 +91,7 @@ class DopQ(hp.HelperProcess):
 
         # init member variables
         self.starttime = None
-        self.client = docker.from_env()
+        self.client = get_client()
         self.debug = debug
         self.configfile = configfile
         self.logfile = logfile
@@ -62,12 +103,20 @@ class DopQ(hp.HelperProcess):
         self.container_list = []
         self.running_containers = []
         self.history = []
+        self.paused = False
+        self.list_lock = threading.Lock()
         self.mapping = self.restore('all')
 
         # init helper processes and classes
-        self.queue = mp.Queue()
+        GPU_SAMPLER.set_backend(create_backend(self.config['gpu']['backend'], self.config['gpu']['fixture']))
+        INVENTORY.refresh()
+        GPU_SAMPLER.health = GPUHealth(self.paths['history'], ecc_errors=self.config['gpu']['ecc_errors'],
+                                       query_failures=self.config['gpu']['query_failures'],
+                                       job_failures=self.config['gpu']['job_failures'])
+        self.channel = ipc.JobChannel()
         self.gpu_handler = gh.GPUHandler()
-        self.provider = provider.Provider(self.config, self.queue)
+        self.provider = provider.Provider(self.config, self.channel)
+        self.image_collector = ic.ImageCollector(self.config['images'], self.job_images)
 
         # build all non-existent directories, except the network container share
         keys = list(self.paths.keys())
@@ -76,11 +125,44 @@ class DopQ(hp.HelperProcess):
                 if not os.path.isdir(self.paths[key]):
                     os.makedirs(self.paths[key])
 
+        # follows the logs of all running containers
+        self.log_collector = lc.LogCollector(self.paths['log'], **self.config['logs'])
+
+        # copies the declared output paths out of finished containers
+        self.artifact_collector = ac.ArtifactCollector(self.paths['output'])
+
+        # publishes the state of the queue for the interface
+        self.snapshots = SnapshotPublisher(self.build_snapshot, self.config['queue']['snapshot_interval'])
+        self._history_info = {}
+        self._history_lock = threading.Lock()
+
+        # builds the jobs submitted via the api
+        self.submitter = submitter.Submitter(self.config, self.channel)
+
+        # local http api to monitor and control the queue without the interface
+        self.api_server = api.APIServer(self, host=self.config['api']['host'], port=self.config['api']['port'],
+                                        socket_path=self.config['api']['socket'],
+                                        max_upload=ic.parse_size(self.config['api']['max_upload']),
+                                        actions_tcp=self.config['api']['actions_tcp'])
+
         # initialize process variable and termination flag
         super(DopQ, self).__init__()
 
         # initialize interface as a thread (so that members of the queue are accessible by the interface)
         self.thread = threading.Thread(target=self.run_queue)
+        self._cycle_start = time.time()
+
+        # gauges that are computed on demand
+        QUEUE_LENGTH.set_function(lambda: {(stats['user'],): stats['containers enqueued']
+                                           for stats in self.snapshot.users})
+        OLDEST_WAIT.set_function(self.oldest_wait)
+        PAUSED.set_function(lambda: int(self.paused))
+        GPUS.set_function(self.gpu_states)
+        GPU_ALLOCATED.set_function(lambda: {(minor,): int(minor in self.allocated_gpus) for minor in INVENTORY.gpus})
+        GPU_UTILIZATION.set_function(lambda: {(minor,): gpu_i['load'] * 100.0
+                                              for minor, gpu_i in self.sampled_gpus.items()})
+        GPU_MEMORY.set_function(lambda: {(minor,): gpu_i['memoryUsed'] * 1024 ** 2
+                                         for minor, gpu_i in self.sampled_gpus.items()})
 
     @property
     def mapping(self):
@@ -119,16 +201,199 @@ class DopQ(hp.HelperProcess):
 
         return uptime, starttime
 
+    @property
+    def recommendations(self):
+        """
+        right-sizing recommendations per user and job name, based on the resources used by the finished jobs
+        :return: dict as returned by accounting.recommendations
+        """
+        return accounting.recommendations(self.history, **self.config['accounting'])
+
     @property
     def status(self):
 
         if self.starttime is None:
             return 'not started'
-        elif self.thread.isAlive():
+        elif self.thread.is_alive():
             return 'running'
         else:
             return 'terminated'
 
+    @property
+    def snapshot(self):
+        """
+        latest published state of the queue, viewers should only render from it
+        :return: snapshot.Snapshot
+        """
+        return self.snapshots.snapshot
+
+    def build_snapshot(self):
+        """
+        gathers the state of the queue for a snapshot. the information of finished containers does not change anymore
+        and is cached, so the work per snapshot only depends on the number of running containers
+        :return: dict with the fields of snapshot.Snapshot
+        """
+        n_containers = self.config['queue']['snapshot_length']
+
+        # queue and provider status
+        queue_status = 'paused' if self.paused and self.status == 'running' else self.status
+        status = {'queue status': queue_status, 'queue uptime': '', 'queue starttime': '',
+                  'provider status': '', 'provider uptime': '', 'provider starttime': ''}
+        if status['queue status'] in ('running', 'paused'):
+            status['queue uptime'], status['queue starttime'] = self.uptime
+            status['provider status'] = self.provider.status
+            if status['provider status'] == 'running':
+                status['provider uptime'], status['provider starttime'] = self.provider.uptime
+
+        running = []
+        for container in list(self.running_containers):
+            info = container.container_stats()
+            info['job_id'] = container.job_id
+            running.append(info)
+
+        history = self.history_page(0, n_containers)
+
+        enqueued = self.enqueued_page(0, n_containers)
+
+        return {'status': status,
+                'running': running,
+                'enqueued': enqueued,
+                'history': history,
+                'n_enqueued': len(self.container_list),
+                'n_history': len(self.history),
+                'users': self.users_stats}
+
+    def history_page(self, offset, count):
+        """
+        information of a range of finished containers. it does not change anymore and is cached. called from the
+        snapshot publisher, the interface and the api at the same time
+        :param offset: index of the first container (0 is the most recently finished one)
+        :param count: number of containers
+        :return: list of history_info() dicts including the 'job_id'
+        """
+        page = []
+        for container in self.history[offset:offset + count]:
+            with self._history_lock:
+                info = self._history_info.get(container.job_id)
+
+            # history_info() may access docker, the lock is not held meanwhile
+            if info is None:
+                info = container.history_info()
+                info['job_id'] = container.job_id
+                with self._history_lock:
+                    info = self._history_info.setdefault(container.job_id, info)
+            page.append(info)
+
+        # forget containers that dropped out of the history
+        with self._history_lock:
+            if len(self._history_info) > len(self.history):
+                job_ids = set(container.job_id for container in self.history)
+                self._history_info = {job_id: info for job_id, info in self._history_info.items()
+                                      if job_id in job_ids}
+
+        return page
+
+    def enqueued_page(self, offset, count):
+        """
+        information of a range of enqueued containers
+        :param offset: index of the first container (0 is the next container to run)
+        :param count: number of containers
+        :return: list of history_info() dicts including the 'job_id'
+        """
+        page = []
+        for container in self.container_list[offset:offset + count]:
+            info = container.history_info()
+            info['job_id'] = container.job_id
+            page.append(info)
+        return page
+
+    def oldest_wait(self):
+        """
+        :return: seconds the longest waiting enqueued job has been waiting, 0 if the queue is empty
+        """
+        enqueued_at = [container.enqueued_at for container in list(self.container_list)
+                       if container.enqueued_at is not None]
+        return time.time() - min(enqueued_at) if enqueued_at else 0
+
+    def log_file(self, job_id):
+        """
+        :param job_id: job id of a running or finished container
+        :return: path of the collected log file of the container, None if the job is unknown or has no log dir
+        """
+        for container in list(self.running_containers) + list(self.history):
+            if container.job_id == job_id:
+                return container.log_file
+        return None
+
+    @property
+    def allocated_gpus(self):
+        """
+        :return: set of the gpu minors assigned to running jobs
+        """
+        minors = set()
+        for container in list(self.running_containers):
+            if container.use_gpu and container.gpu_minors is not None:
+                minors.update(int(minor) for minor in container.gpu_minors if str(minor).isdigit())
+        return minors
+
+    @property
+    def sampled_gpus(self):
+        """
+        :return: dict mapping the gpu minors to the latest sample of the gpu sampler (without querying the gpus)
+        """
+        return {int(gpu_i.get('minor', gpu_i['id'])): gpu_i for gpu_i in GPU_SAMPLER.snapshot or []}
+
+    def gpu_states(self):
+        return {('total',): len(INVENTORY.gpus), ('allocated',): len(self.allocated_gpus),
+                ('drained',): len(get_drained_gpus())}
+
+    def pause(self):
+        """
+        stops starting new containers, running containers are not affected
+        :return: None
+        """
+        self.paused = True
+        self.logger.info('queue paused')
+
+    def resume(self):
+        self.paused = False
+        self.logger.info('queue resumed')
+        self.channel.wake()
+
+    def find_job(self, job_id):
+        """
+        :param job_id: job id of the container
+        :return: enqueued or running container with the job id, None if there is none
+        """
+        with self.list_lock:
+            containers = list(self.container_list)
+        for container in containers + list(self.running_containers):
+            if container.job_id == job_id:
+                return container
+        return None
+
+    def cancel(self, job_id):
+        """
+        removes an enqueued job from the queue or stops a running one
+        :param job_id: job id of the container
+        :return: 'removed' or 'stopped', None if no enqueued or running job has the id
+        """
+        with self.list_lock:
+            for container in self.container_list:
+                if container.job_id == job_id:
+                    self.container_list.remove(container)
+                    self.logger.info('\tremoved {} from the queue'.format(container))
+                    return 'removed'
+
+        for container in list(self.running_containers):
+            if container.job_id == job_id:
+                container.cancelled = True
+                container.stop()
+                self.logger.info('\tstopped {}'.format(container))
+                return 'stopped'
+
+        return None
+
     @property
     def user_list(self):
         return self.config['fetcher']['executors']
@@ -166,6 +431,15 @@ class DopQ(hp.HelperProcess):
 
         return num_containers
 
+    def job_images(self):
+        """
+        collects the image ids of all containers managed by the queue, used by the image collector
+        :return: dict with lists of image ids for 'queued', 'running' and 'finished' containers
+        """
+        return {'queued': [container.image_id for container in list(self.container_list)],
+                'running': [container.image_id for container in list(self.running_containers)],
+                'finished': [container.image_id for container in list(self.history)]}
+
     def restore(self, key):
         """
         restores history, container_list, running_containers, or all three
@@ -214,8 +488,6 @@ class DopQ(hp.HelperProcess):
             """
             file_name, member = assignment_tuple
             full_path = os.path.join(path, file_name)
-            for container in member:
-                container.stop_stats_stream()
             with open(full_path, 'wb') as f:
                 dill.dump(member, f)
 
@@ -233,20 +505,66 @@ class DopQ(hp.HelperProcess):
         update_list = []
 
         # add new images that are obtained from the builder process
-        while not self.queue.empty():
-            update_list.append(self.queue.get())
-        self.container_list += update_list
+        for record in self.channel.get_many():
+            self.observe_record(record)
+            container = Container.from_record(record, log_dir=self.paths['log'])
+            if container is not None:
+                update_list.append(container)
 
         # sort priority queue:
-        self.container_list = sorted(self.container_list, key=self.sort_fn)
+        with self.list_lock:
+            self.container_list = sorted(self.container_list + update_list, key=self.sort_fn)
+
+        # let the provider know where new containers will end up, so it can build the next ones first
+        penalties = {user: self.calc_penalty(user) for user in self.user_list}
+        queued_penalties = [self.split_and_calc_penalty(container) for container in self.container_list]
+        schedule.write_queue_state(self.paths['history'], penalties, queued_penalties)
+
+    @staticmethod
+    def observe_record(record):
+        """
+        records the build and fetch metrics that the provider and the submitter measured for a job
+        :param record: job record
+        :return: None
+        """
+        metrics = record.get('metrics') or {}
+        if metrics.get('build_seconds') is not None:
+            BUILD_TIME.observe(metrics['build_seconds'], source=metrics.get('source', 'share'))
+        if metrics.get('fetch_seconds') is not None:
+            FETCH_TIME.observe(metrics['fetch_seconds'])
+            FETCH_BYTES.inc(metrics.get('fetch_bytes', 0))
 
     def update_running_containers(self):
-        for container in self.running_containers:
-            if container.status == 'exited':
-                container.stop_stats_stream()
+        for container in list(self.running_containers):
+            # containers removed by someone else are finished as well, their gpus are free again
+            if container.status in ('exited', 'removed'):
+
+                # keep what the job actually used in the history
+                container.usage = accounting.job_usage(SAMPLER.aggregate(container.job_id))
+                SAMPLER.release(container.job_id)
+
+                # repeated failures of different jobs on the same gpu hint at a faulty device
+                exit_code = container.exit_code
+                counts = not container.cancelled and exit_code is not None
+                if counts and container.use_gpu and container.gpu_minors is not None:
+                    GPU_SAMPLER.health.record_job(container.gpu_minors, exit_code, job=(container.user, container.name))
+                if exit_code:
+                    FAILURES.inc(user=container.user, reason='exit')
+
+                if container.config.output_paths:
+                    self.artifact_collector.submit(container)
+                self.image_collector.touch(container.image_id)
                 self.history.insert(0, container)
                 self.running_containers.remove(container)
 
+    def enable_gpu(self, minor):
+        """
+        puts a gpu that was drained by the health monitor back into service
+        :param minor: minor of the gpu
+        :return: True if the gpu was drained
+        """
+        return GPU_SAMPLER.health.enable(minor)
+
     def get_user_oh(self, user_name):
         user_oh = [int(self.get_user(el) == user_name.lower()) for el in self.history]
         return np.array(user_oh)
@@ -278,8 +596,20 @@ class DopQ(hp.HelperProcess):
         for user in docker_users:
             print("Penalty for {}: {}".format(user, round(self.calc_penalty(user), 4)))
 
-    def sleep(self):
-        time.sleep(self.config['queue']['sleep'])
+    def sleep(self, throttle=False):
+        """
+        waits between two cycles of the queue
+        :param throttle: always wait the full time, e.g. after a container has been started
+        :return: None
+        """
+        CYCLE_TIME.observe(time.time() - self._cycle_start)
+
+        if throttle:
+            # keep the pace of container starts, regardless of new jobs
+            time.sleep(self.config['queue']['sleep'])
+        else:
+            # wake up early if the provider sends new containers
+            self.channel.wait(self.config['queue']['sleep'])
 
     @staticmethod
     def write_default_config(configfile):
@@ -297,12 +627,23 @@ class DopQ(hp.HelperProcess):
         config.set('paths', 'log.dir', '/media/local/output_container/logging/')
         config.set('paths', 'history.dir', './')
         config.set('paths', 'failed.dir', '/media/local/output_container/failed/')
+        config.set('paths', 'output.dir', '/media/local/output_container/')
 
         config.add_section('queue')
         config.set('queue', 'max.history', '100')
         config.set('queue', 'verbose', 'yes')
         config.set('queue', 'sleep.interval', '60')
         config.set('queue', 'max.gpu.assignment', '1')
+        config.set('queue', 'snapshot.interval', '1')
+        config.set('queue', 'snapshot.length', '50')
+
+        config.add_section('api')
+        config.set('api', 'enabled', 'yes')
+        config.set('api', 'host', '127.0.0.1')
+        config.set('api', 'port', '8642')
+        config.set('api', 'socket', '')
+        config.set('api', 'max.upload', '10g')
+        config.set('api', 'actions.tcp', 'no')
 
         config.add_section('docker')
         config.set('docker', 'mount.volumes', '/media/data/expImages:/imgdir,/media/local/output_container:/outdir')
@@ -311,16 +652,50 @@ class DopQ(hp.HelperProcess):
         config.set('docker', 'mem.limit', '32g')
         config.set('docker', 'logging.interval', '10')
 
+        config.add_section('logs')
+        config.set('logs', 'max.bytes', '50m')
+        config.set('logs', 'backup.count', '5')
+        config.set('logs', 'archive', 'yes')
+
+        config.add_section('accounting')
+        config.set('accounting', 'memory.headroom', '1.25')
+        config.set('accounting', 'min.jobs', '1')
+
+        config.add_section('images')
+        config.set('images', 'disk.budget', '200g')
+        config.set('images', 'collect.interval', '600')
+
+        config.add_section('gpu')
+        config.set('gpu', 'sample.interval', '2')
+        config.set('gpu', 'backend', 'gputil')
+        config.set('gpu', 'fixture', '')
+        config.set('gpu', 'ecc.errors', '1')
+        config.set('gpu', 'query.failures', '3')
+        config.set('gpu', 'job.failures', '3')
+
+        config.add_section('telemetry')
+        config.set('telemetry', 'sample.interval', '2')
+        config.set('telemetry', 'history.length', '1800')
+        config.set('telemetry', 'backend', 'cgroup')
+        config.set('telemetry', 'cgroup.root', '/sys/fs/cgroup')
+        config.set('telemetry', 'workers', '8')
+
         config.add_section('fetcher')
         config.set('fetcher', 'valid.executors', 'anees,ilja,ferry,markus')
         config.set('fetcher', 'min.space', '0.05')
         config.set('fetcher', 'remove.invalid.containers', 'yes')
         config.set('fetcher', 'sleep.interval', '60')
+        config.set('fetcher', 'retry.backoff', '60')
+        config.set('fetcher', 'max.attempts', '5')
 
         config.add_section('builder')
         config.set('builder', 'sleep.interval', '60')
         config.set('builder', 'load.suffix', 'tar')
         config.set('builder', 'build.suffix', 'zip')
+        config.set('builder', 'lookahead', '0')
+        config.set('builder', 'prepull.count', '3')
+        config.set('builder', 'prepull.interval', '86400')
+        config.set('builder', 'mirror.dir', '')
 
         # store config
         with open(configfile, 'w') as conf:
@@ -333,6 +708,10 @@ class DopQ(hp.HelperProcess):
         config = configparser.ConfigParser()
         config.read(configfile)
 
+        # artifacts are stored next to the results written to /outdir by default
+        mounts = config.get('docker', 'mount.volumes').split(',')
+        outdir = [mount.split(':')[0] for mount in mounts if mount.endswith(':/outdir')]
+
         # parse settings into dicts
         parsed_config = {
             'paths': {'local_containers': config.get('paths', 'container.dir'),
@@ -340,9 +719,10 @@ class DopQ(hp.HelperProcess):
                       'unzip': config.get('paths', 'unzip.dir'),
                       'log': config.get('paths', 'log.dir'),
                       'history': config.get('paths', 'history.dir'),
-                      'failed': config.get('paths', 'failed.dir')},
+                      'failed': config.get('paths', 'failed.dir'),
+                      'output': config.get('paths', 'output.dir', fallback=outdir[0] if outdir else './output')},
 
-            'docker': {'mounts': config.get('docker', 'mount.volumes').split(','),
+            'docker': {'mounts': mounts,
                        'auto_remove': config.getboolean('docker', 'remove'),
                        'mem_limit': config.get('docker', 'mem.limit'),
                        'network_mode': config.get('docker', 'network.mode'),
@@ -351,14 +731,52 @@ class DopQ(hp.HelperProcess):
             'queue': {'max_history': config.getint('queue', 'max.history'),
                       'verbose': config.getboolean('queue', 'verbose'),
                       'sleep': config.getint('queue', 'sleep.interval'),
-                      'max_gpus': config.getint('queue', 'max.gpu.assignment')},
+                      'max_gpus': config.getint('queue', 'max.gpu.assignment'),
+                      'snapshot_interval': config.getfloat('queue', 'snapshot.interval', fallback=1),
+                      'snapshot_length': config.getint('queue', 'snapshot.length', fallback=50)},
+
+            'api': {'enabled': config.getboolean('api', 'enabled', fallback=True),
+                    'host': config.get('api', 'host', fallback='127.0.0.1'),
+                    'port': config.getint('api', 'port', fallback=8642),
+                    'socket': config.get('api', 'socket', fallback=''),
+                    'max_upload': config.get('api', 'max.upload', fallback='10g'),
+                    'actions_tcp': config.getboolean('api', 'actions.tcp', fallback=False)},
+
+            'logs': {'max_bytes': config.get('logs', 'max.bytes', fallback='50m'),
+                     'backup_count': config.getint('logs', 'backup.count', fallback=5),
+                     'archive': config.getboolean('logs', 'archive', fallback=True)},
+
+            'accounting': {'headroom': config.getfloat('accounting', 'memory.headroom', fallback=1.25),
+                           'min_jobs': config.getint('accounting', 'min.jobs', fallback=1)},
+
+            'images': {'disk_budget': config.get('images', 'disk.budget', fallback='0'),
+                       'interval': config.getint('images', 'collect.interval', fallback=600)},
+
+            'gpu': {'interval': config.getfloat('gpu', 'sample.interval', fallback=2),
+                    'backend': config.get('gpu', 'backend', fallback='gputil'),
+                    'fixture': config.get('gpu', 'fixture', fallback=''),
+                    'ecc_errors': config.getint('gpu', 'ecc.errors', fallback=1),
+                    'query_failures': config.getint('gpu', 'query.failures', fallback=3),
+                    'job_failures': config.getint('gpu', 'job.failures', fallback=3)},
+
+            'telemetry': {'interval': config.getfloat('telemetry', 'sample.interval', fallback=2),
+                          'capacity': config.getint('telemetry', 'history.length', fallback=1800),
+                          'backend': config.get('telemetry', 'backend', fallback='cgroup'),
+                          'cgroup_root': config.get('telemetry', 'cgroup.root', fallback='/sys/fs/cgroup'),
+                          'workers': config.getint('telemetry', 'workers', fallback=8)},
 
             'builder': {'sleep': config.getint('builder', 'sleep.interval'),
                         'load': config.get('builder', 'load.suffix').split(','),
-                        'build': config.get('builder', 'build.suffix').split(',')},
+                        'build': config.get('builder', 'build.suffix').split(','),
+                        'lookahead': config.getint('builder', 'lookahead', fallback=0),
+                        'prepull_count': config.getint('builder', 'prepull.count', fallback=0),
+                        'prepull_interval': config.getint('builder', 'prepull.interval', fallback=86400),
+                        'mirror_dir': config.get('builder', 'mirror.dir', fallback='')},
 
             'fetcher': {'remove_invalid': config.getboolean('fetcher', 'remove.invalid.containers'),
                         'sleep': config.getint('fetcher', 'sleep.interval'),
+                        'retry_backoff': config.getint('fetcher', 'retry.backoff', fallback=60),
+                        'max_attempts': config.getint('fetcher', 'max.attempts', fallback=5),
                         'min_space': config.getfloat('fetcher', 'min.space'),
                         'executors': config.get('fetcher', 'valid.executors').split(',')}}
 
@@ -382,6 +800,25 @@ class DopQ(hp.HelperProcess):
         self.provider.fetcher_conf = self.config['fetcher']
         self.provider.builder_conf = self.config['builder']
         self.provider.docker_conf = self.config['docker']
+        self.image_collector.config = self.config['images']
+        self.artifact_collector.output_dir = self.paths['output']
+        self.submitter.paths = self.config['paths']
+        self.submitter.fetcher_conf = self.config['fetcher']
+        self.submitter.docker_conf = self.config['docker']
+        self.api_server.max_upload = ic.parse_size(self.config['api']['max_upload'])
+        self.api_server.actions_tcp = self.config['api']['actions_tcp']
+        GPU_SAMPLER.interval = self.config['gpu']['interval']
+        GPU_SAMPLER.health.ecc_errors = self.config['gpu']['ecc_errors']
+        GPU_SAMPLER.health.query_failures = self.config['gpu']['query_failures']
+        GPU_SAMPLER.health.job_failures = self.config['gpu']['job_failures']
+        if self.config['gpu']['backend'] != GPU_SAMPLER.backend.name:
+            GPU_SAMPLER.set_backend(create_backend(self.config['gpu']['backend'], self.config['gpu']['fixture']))
+        SAMPLER.interval = self.config['telemetry']['interval']
+        SAMPLER.backend = self.config['telemetry']['backend']
+        self.snapshots.interval = self.config['queue']['snapshot_interval']
+
+        # the hardware may have changed (e.g. a replaced gpu)
+        INVENTORY.refresh()
 
         # loading done
         report_fn('reloading config: {:.1f} %'.format(100))
@@ -390,15 +827,46 @@ class DopQ(hp.HelperProcess):
         self.term_flag.value = 1
         GPU.stop_hardware_monitor()
         self.provider.stop()
+        self.image_collector.stop()
+        self.log_collector.stop()
+        self.artifact_collector.stop()
+        self.snapshots.stop()
+        self.api_server.stop()
+        self.submitter.stop()
+        SAMPLER.stop()
         if self.status == 'running':
             self.thread.join()
 
+        # the provider, the submitter and the queue thread are done with the channel
+        self.channel.close()
+
     def start(self):
 
+        # enumerate the hardware again on SIGHUP
+        signal.signal(signal.SIGHUP, lambda signum, frame: INVENTORY.refresh())
+
         try:
             self.starttime = time.time()
             self.thread.start()
             self.provider.start()
+            self.image_collector.start()
+            GPU_SAMPLER.start(interval=self.config['gpu']['interval'])
+
+            # resume the logs of containers that are still running from before the restart
+            for container in self.running_containers:
+                self.log_collector.follow(container)
+
+            # collect the artifacts of jobs that finished while the queue was down
+            self.artifact_collector.start()
+            for container in self.history:
+                if container.config.output_paths and container.artifacts is None:
+                    self.artifact_collector.submit(container)
+
+            SAMPLER.start(lambda: self.running_containers, **self.config['telemetry'])
+            self.snapshots.start()
+            if self.config['api']['enabled']:
+                self.submitter.start()
+                self.api_server.start()
             interface.run_interface(self)
         finally:
             self.stop()
@@ -418,27 +886,34 @@ class DopQ(hp.HelperProcess):
                 if self.term_flag.value:
                     raise RuntimeError('\tqueue is shutting down')
 
+                self._cycle_start = time.time()
+                LAST_CYCLE.set(self._cycle_start)
+
                 # update container list
                 self.update_container_list()
 
                 # clean up running containers
                 self.update_running_containers()
 
-                # check if there are containers in the queue
-                if len(self.container_list) == 0:
+                # check if there are containers in the queue and the queue is not paused
+                if len(self.container_list) == 0 or self.paused:
                     self.sleep()
                     continue
 
                 # TODO implement slot system
 
                 # get next container
-                container = self.container_list.pop(0)
+                with self.list_lock:
+                    if len(self.container_list) == 0:
+                        continue
+                    container = self.container_list.pop(0)
                 gpu = container.use_gpu
 
                 # keep cycling if container requires gpu but none are available
                 free_minors = self.gpu_handler.free_minors
                 if len(free_minors) == 0 and gpu:
-                    self.container_list.insert(0, container)
+                    with self.list_lock:
+                        self.container_list.insert(0, container)
                     self.sleep()
                     continue
 
@@ -449,19 +924,26 @@ class DopQ(hp.HelperProcess):
                 except IOError as e:
 
                     # put container back in the queue if not enough gpus are available
-                    self.container_list.insert(0, container)
+                    with self.list_lock:
+                        self.container_list.insert(0, container)
                     continue
 
                 except APIError:
+                    FAILURES.inc(user=container.user, reason='start')
                     continue
 
                 else:
+                    STARTS.inc(user=container.user)
+                    if container.enqueued_at is not None:
+                        WAIT_TIME.observe(time.time() - container.enqueued_at, user=container.user)
 
-                    # add to running containers and write log message
+                    # add to running containers, follow its logs and write log message
+                    self.image_collector.touch(container.image_id)
                     self.running_containers.append(container)
+                    self.log_collector.follow(container)
                     self.logger.info('\tsuccessfully ran a container from {}'.format(container))
 
-                    self.sleep()
+                    self.sleep(throttle=True)
 
         except Exception as e:
             self.logger.error(traceback.format_exc())
@@ -1,6 +1,5 @@
-import re
-import os
-import docker
+from utils.docker_client import get_client
+from utils.gpu import get_drained_gpus, get_system_gpus
 
 
 class GPUHandler(object):
@@ -10,24 +9,25 @@ class GPUHandler(object):
         small class for handling gpu minor monitoring
         :param client: docker client as obtained by docker.from_env()
         """
-        self.client = docker.from_env()
-        self.minors = self.get_gpu_minors()
+        self.client = get_client()
         self._assigned_minors = []
         self._free_minors = []
 
+    @property
+    def minors(self):
+        """
+        GPU minors of the system, taken from the hardware inventory
+        :return: GPU minors available on the system
+        """
+        return get_system_gpus()
+
     @staticmethod
     def get_gpu_minors():
         """
         Returns the GPU minors available on the system
         :return: GPU minors available on the system
         """
-        minors = []
-        for dev in os.listdir("/dev"):
-            match_dt = re.search(r'nvidia(\d+)', dev)
-            if match_dt is not None:
-                minor = int(match_dt.group(1))
-                minors.append(minor)
-        return minors
+        return get_system_gpus()
 
     @property
     def assigned_minors(self):
@@ -53,7 +53,8 @@ class GPUHandler(object):
          :return: None
          """
 
-        # get assigned gpus
+        # get system and assigned gpus
+        minors = self.minors
         assigned_gpus = []
 
         # look in each running container
@@ -65,7 +66,7 @@ class GPUHandler(object):
                         if el.startswith('NVIDIA_VISIBLE_DEVICES'):
                             minor_str = el.split('=')[1]
                             if minor_str.lower() == 'all':
-                                for gpu_minor in self.minors:
+                                for gpu_minor in minors:
                                     assigned_gpus.append(gpu_minor)
                             # elif minor_str.lower() == 'none':
                             #     # here no minors will be used
@@ -76,16 +77,17 @@ class GPUHandler(object):
                                 minor_list = minor_str.split(",")
                                 for gpu_minor in minor_list:
                                     gpu_minor = int(gpu_minor)
-                                    if gpu_minor in self.minors:
+                                    if gpu_minor in minors:
                                         assigned_gpus.append(gpu_minor)
 
+        drained_gpus = get_drained_gpus()
         free_gpus = []
 
-        # remove all assigned
-        for gpu_minor in self.minors:
+        # remove all assigned and drained
+        for gpu_minor in minors:
 
-            # only add unassigend ones
-            if gpu_minor not in assigned_gpus:
+            # only add unassigend and healthy ones
+            if gpu_minor not in assigned_gpus and gpu_minor not in drained_gpus:
                 free_gpus.append(gpu_minor)
 
         self._assigned_minors = assigned_gpus
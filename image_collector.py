@@ -0,0 +1,161 @@
+import threading
+import time
+import traceback
+
+from docker.errors import APIError
+
+from core.statecache import JOB_LABEL
+from utils import log
+from utils.docker_client import get_client
+
+
+def parse_size(size):
+    """
+    converts a size string with unit suffix (as used for mem.limit in the config.ini) to bytes
+    :param size: size string, e.g. '200g', '512m', '1.5GiB' or '1024'
+    :return: size in bytes
+    :raises ValueError: if the size can not be parsed
+    """
+    size = str(size).strip().lower().rstrip('b')
+
+    # binary prefixes (e.g. GiB) mean the same as the plain units
+    if size.endswith('i'):
+        size = size[:-1]
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class ImageCollector(object):
+
+    def __init__(self, config, job_images):
+        """
+        garbage collector for the images built by the queue. images of queued and running jobs (and the images they
+        are built from) are always kept, the other images built by the queue (carrying the job label) and the images of
+        finished jobs are evicted least recently used first as soon as the disk usage of docker exceeds the budget
+        :param config: dict with the 'images' settings as created by parse_config() in dop_q.py
+        :param job_images: function returning a dict with the image ids of 'queued', 'running' and 'finished' jobs,
+                           finished image ids have to be ordered from most to least recently finished
+        """
+        self.client = get_client()
+        self.config = config
+        self.job_images = job_images
+        self.last_used = {}
+        self.reclaimed = 0
+        self.logger = log.get_module_log(__name__)
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-ImageCollector')
+        self.thread.daemon = True
+
+    def touch(self, image_id):
+        """
+        records the use of an image, called when a container of the image starts or finishes
+        :param image_id: id of the image
+        :return: None
+        """
+        self.last_used[image_id] = time.time()
+
+    @property
+    def budget(self):
+        return parse_size(self.config['disk_budget'])
+
+    def keep_set(self, images, job_images):
+        """
+        collects all image ids that must not be removed: images of queued and running jobs, their parents (which
+        form the build cache of these images) and images that are still used by a docker container
+        :param images: list of image dicts as returned by the docker system df endpoint
+        :param job_images: dict as returned by self.job_images
+        :return: set of image ids
+        """
+        parents = {image['Id']: image.get('ParentId') for image in images}
+
+        keep = set()
+        for image_id in job_images['queued'] + job_images['running']:
+
+            # follow the parent chain up to the base image
+            while image_id and image_id not in keep:
+                keep.add(image_id)
+                image_id = parents.get(image_id)
+
+        keep.update(image['Id'] for image in images if image.get('Containers', 0) > 0)
+
+        return keep
+
+    def collect(self):
+        """
+        prunes dangling layers and evicts unused images of the queue until the disk usage is back within the budget
+        :return: number of reclaimed bytes
+        """
+
+        job_images = self.job_images()
+
+        # images that are in use are refreshed in the lru bookkeeping
+        now = time.time()
+        for image_id in job_images['queued'] + job_images['running']:
+            self.last_used[image_id] = now
+
+        # dangling layers are never needed again
+        reclaimed = self.client.images.prune(filters={'dangling': True}).get('SpaceReclaimed') or 0
+
+        disk_usage = self.client.df()
+        usage = disk_usage.get('LayersSize') or 0
+        images = disk_usage.get('Images') or []
+
+        # a budget of 0 only prunes dangling layers
+        if 0 < self.budget < usage:
+
+            keep = self.keep_set(images, job_images)
+            sizes = {}
+            for image in images:
+                shared = image.get('SharedSize', -1)
+                sizes[image['Id']] = image['Size'] - shared if shared > 0 else image['Size']
+
+            # images built by the queue, also those of jobs that dropped out of the history, and images of finished
+            # jobs that were built before the label was introduced
+            candidates = set(job_images['finished'])
+            candidates.update(image['Id'] for image in images if JOB_LABEL in (image.get('Labels') or {}))
+
+            # least recently used first, ties are broken by the last time a job using the image finished
+            order = {image_id: index for index, image_id in enumerate(reversed(job_images['finished']))}
+            candidates = sorted(candidates, key=lambda i: (self.last_used.get(i, 0), order.get(i, -1)))
+
+            for image_id in candidates:
+
+                if usage <= self.budget:
+                    break
+                if image_id in keep or image_id not in sizes:
+                    continue
+
+                try:
+                    self.client.images.remove(image_id)
+                except APIError as e:
+                    self.logger.warning('\tcould not remove image {}: {}'.format(image_id, e))
+                    continue
+
+                self.last_used.pop(image_id, None)
+                usage -= sizes[image_id]
+                reclaimed += sizes[image_id]
+
+        if reclaimed:
+            self.logger.info('\timage collector reclaimed {:.1f}MB'.format(reclaimed / 1024 / 1024))
+        self.reclaimed += reclaimed
+
+        return reclaimed
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.collect()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+            self._stop_event.wait(self.config['interval'])
+
+    def start(self):
+        self._stop_event.clear()
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
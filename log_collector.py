@@ -0,0 +1,300 @@
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from datetime import datetime
+
+from docker.errors import NotFound
+
+from image_collector import parse_size
+from utils import log
+from utils.docker_client import get_client
+from utils.logarchive import archive_log, job_log_path, parse_timestamp
+
+
+POSITIONS_FILE = 'log_positions.json'
+
+
+class RotatingFile(object):
+
+    def __init__(self, path, max_bytes, backup_count):
+        """
+        append-only file that is rotated to path.1, path.2, ... when it grows beyond max_bytes
+        :param path: path of the log file
+        :param max_bytes: size at which the file is rotated, 0 disables rotation
+        :param backup_count: number of rotated files to keep
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file_h = open(path, 'ab')
+
+    def write(self, data):
+        if self.max_bytes and self.file_h.tell() + len(data) > self.max_bytes and self.file_h.tell() > 0:
+            self.rotate()
+        self.file_h.write(data)
+
+    def rotate(self):
+        self.file_h.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, index)
+            if os.path.isfile(source):
+                os.replace(source, '{}.{}'.format(self.path, index + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.file_h = open(self.path, 'ab')
+
+    def flush(self):
+        self.file_h.flush()
+
+    def close(self):
+        self.file_h.close()
+
+
+class LogCollector(object):
+
+    def __init__(self, log_dir, max_bytes='50m', backup_count=5, archive=True, retry_delay=5):
+        """
+        follows the logs of all running containers (one thread each) and writes them to size rotated files per job,
+        the timestamp of the last written line of every job is persisted, so that logs are resumed without gaps or
+        duplicates after a restart of the queue
+        :param log_dir: directory where the log files are written to (in a subdirectory per user)
+        :param max_bytes: size at which a log file is rotated (e.g. '50m')
+        :param backup_count: number of rotated files to keep per job
+        :param archive: compress the logs of a job into a block archive (see utils.logarchive) once it has finished
+        :param retry_delay: seconds to wait before a log stream that ended while its container runs is resumed
+        """
+        self.log_dir = log_dir
+        self.max_bytes = parse_size(max_bytes)
+        self.backup_count = backup_count
+        self.archive = archive
+        self.retry_delay = retry_delay
+        self.logger = log.get_module_log(__name__)
+        self.positions = self.load_positions()
+        self.streams = {}
+        self.threads = {}
+        self.finished_callbacks = []
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._stopping = False
+        self._stop_event = threading.Event()
+
+    @property
+    def positions_file(self):
+        return os.path.join(self.log_dir, POSITIONS_FILE)
+
+    def load_positions(self):
+        try:
+            with open(self.positions_file, 'r') as file_h:
+                return json.load(file_h)
+        except (IOError, ValueError):
+            return {}
+
+    def save_positions(self, force=False):
+        """
+        persists the last timestamp of every job, at most once per second unless forced
+        :param force: save regardless of the time of the last save
+        :return: None
+        """
+        with self._lock:
+            if not force and time.time() - self._last_save < 1:
+                return
+            positions = dict(self.positions)
+            self._last_save = time.time()
+
+        tmp_path = self.positions_file + '.tmp'
+        with open(tmp_path, 'w') as file_h:
+            json.dump(positions, file_h)
+        os.replace(tmp_path, self.positions_file)
+
+    def log_path(self, user, name, job_id):
+        """
+        :return: path of the log file of a job
+        """
+        return job_log_path(self.log_dir, user, name, job_id)
+
+    def follow(self, container):
+        """
+        starts following the logs of a container, does nothing if the container is already followed
+        :param container: Container object
+        :return: future of the follower or None
+        """
+        return self.follow_id(container.container_id, container.job_id, container.user, container.name)
+
+    def follow_id(self, container_id, job_id, user, name):
+        """
+        starts following the logs of a docker container
+        :param container_id: id of the docker container
+        :param job_id: id under which the position of the logs is stored
+        :param user: user whom the container belongs to
+        :param name: name of the job
+        :return: future of the follower or None if the container is already followed
+        """
+        future = Future()
+        with self._lock:
+            if container_id is None or job_id in self.streams or self._stopping:
+                return None
+            self.streams[job_id] = None
+
+            # a follower blocks on its stream for the lifetime of the container, so every container gets its own
+            # thread instead of waiting for a slot in a pool
+            thread = threading.Thread(target=self._run_follower,
+                                      args=(future, container_id, job_id, self.log_path(user, name, job_id)),
+                                      name='DoPQ-Logs-{}'.format(job_id))
+            thread.daemon = True
+            self.threads[job_id] = thread
+        thread.start()
+        return future
+
+    @staticmethod
+    def container_running(container_id):
+        """
+        :param container_id: id of the docker container
+        :return: True if the container is running or its state can not be inspected (e.g. while docker restarts)
+        """
+        try:
+            return get_client().api.inspect_container(container_id)['State']['Running']
+        except NotFound:
+            return False
+        except Exception:
+            return True
+
+    def _run_follower(self, future, container_id, job_id, path):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._follow(container_id, job_id, path))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self.threads.pop(job_id, None)
+
+    def _follow(self, container_id, job_id, path):
+        """
+        streams the logs of a container until it exits. the stream also ends when the connection to docker is lost
+        (e.g. the daemon restarts), the logs of a container that is still running are then resumed from the last
+        written line
+        """
+        log_file = RotatingFile(path, self.max_bytes, self.backup_count)
+        try:
+            last = self.positions.get(job_id)
+            last_ns = parse_timestamp(last) if last else None
+            pending = b''
+
+            while True:
+
+                # do not open new streams once the collector is stopping
+                if self._stopping:
+                    return
+
+                # since has only second granularity, lines up to the last written one are skipped below
+                since = datetime.utcfromtimestamp(last_ns // 10 ** 9) if last_ns else None
+                pending = b''
+                try:
+                    stream = get_client().api.logs(container_id, stream=True, follow=True, timestamps=True,
+                                                   since=since)
+                    with self._lock:
+                        self.streams[job_id] = stream
+                        stopping = self._stopping
+
+                    # stop() may have collected the streams before this one was stored
+                    if stopping:
+                        stream.close()
+                        return
+
+                    for chunk in stream:
+                        pending += chunk
+                        lines = pending.split(b'\n')
+                        pending = lines.pop()
+
+                        for line in lines:
+                            timestamp, _, text = line.partition(b' ')
+                            timestamp = timestamp.decode('ascii', errors='replace')
+                            try:
+                                line_ns = parse_timestamp(timestamp)
+                            except ValueError:
+                                line_ns = None
+                            if line_ns is not None and last_ns is not None and line_ns <= last_ns:
+                                continue
+
+                            log_file.write(line + b'\n')
+                            if line_ns is not None:
+                                last_ns = line_ns
+                                self.positions[job_id] = timestamp
+
+                        log_file.flush()
+                        self.save_positions()
+
+                except NotFound:
+                    break
+                except Exception:
+                    if self._stopping:
+                        return
+                    self.logger.error(traceback.format_exc())
+
+                with self._lock:
+                    self.streams[job_id] = None
+                if self._stopping or not self.container_running(container_id):
+                    break
+
+                # an incomplete last line is sent again with the resumed stream
+                self.logger.warning('log stream of job {} ended while its container is running, resuming it in {}s'
+                                    .format(job_id, self.retry_delay))
+                self._stop_event.wait(self.retry_delay)
+
+            if pending:
+                log_file.write(pending + b'\n')
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
+        finally:
+            log_file.close()
+            with self._lock:
+                self.streams.pop(job_id, None)
+                stopped = self._stopping
+
+                # the position is only needed to resume the logs of a still running container
+                if not stopped:
+                    self.positions.pop(job_id, None)
+            self.save_positions(force=True)
+
+        if stopped:
+            return
+
+        if self.archive:
+            try:
+                path = archive_log(path)
+            except (IOError, OSError):
+                self.logger.error(traceback.format_exc())
+
+        for callback in self.finished_callbacks:
+            try:
+                callback(job_id, path)
+            except Exception:
+                self.logger.error(traceback.format_exc())
+
+    def stop(self):
+        """
+        closes all log streams and waits for the followers to finish
+        :return: None
+        """
+        with self._lock:
+            self._stopping = True
+            self._stop_event.set()
+            streams = [stream for stream in self.streams.values() if stream is not None]
+            threads = list(self.threads.values())
+        for stream in streams:
+            if hasattr(stream, 'close'):
+                stream.close()
+        for thread in threads:
+            thread.join()
+        self.save_positions(force=True)
@@ -1,8 +1,7 @@
 import docker, docker.errors
 import os
 import helper_process as hp
-from providerfuncs import parse, fetch, build
-from core.container import Container
+from providerfuncs import parse, fetch, build, schedule, prepull, state
 import zipfile
 from utils import log
 import time
@@ -11,7 +10,7 @@ import traceback
 
 class Provider(hp.HelperProcess):
 
-    def __init__(self, config, queue):
+    def __init__(self, config, channel):
 
         super(Provider, self).__init__()
 
@@ -21,12 +20,25 @@ class Provider(hp.HelperProcess):
         self.builder_conf = config['builder']
         self.docker_conf = config['docker']
 
-        self.queue = queue
+        self.channel = channel
         self.logger = log.get_module_log(__name__)
+        self.base_images = prepull.BaseImageCache(self.paths['history'], self.builder_conf['mirror_dir'])
+        self.submissions = state.SubmissionStates(backoff=self.fetcher_conf['retry_backoff'],
+                                                  max_attempts=self.fetcher_conf['max_attempts'])
 
     def sleep(self):
         time.sleep(self.fetcher_conf['sleep'])
 
+    def new_submissions(self, known_files):
+        """
+        :param known_files: set of the file names that have been in the share before
+        :return: True if files have been added to the share since
+        """
+        try:
+            return bool(set(os.listdir(self.paths['network_containers'])) - known_files)
+        except OSError:
+            return False
+
     def provide(self):
 
         while 1:
@@ -39,13 +51,31 @@ class Provider(hp.HelperProcess):
                 if 'invalid' in network_files:
                     network_files.remove('invalid')
 
+                # forget about submissions which have been removed from the share
+                self.submissions.prune([os.path.join(self.paths['network_containers'], filename)
+                                        for filename in network_files])
+
+                # parse all configs first, so that submissions can be ordered before anything is built
+                submissions = []
+                base_images = {}
                 for filename in network_files:
 
                     filename = os.path.join(self.paths['network_containers'], filename)
 
-                    # get config from json
+                    # skip submissions which are backing off after a failed attempt
+                    if not self.submissions.ready(filename):
+                        continue
+
+                    # reuse the parsing results of submissions that have been examined before
+                    submission_state = self.submissions.get(filename)
+                    if submission_state is not None and submission_state['config'] is not None:
+                        submissions.append((filename, submission_state['config']))
+                        base_images[filename] = submission_state['base_images']
+                        continue
+
+                    # get config from json and base images from the Dockerfile
                     try:
-                        container_config = parse.parse_zipped_config(filename)
+                        container_config, base_images[filename] = parse.parse_zipped_submission(filename)
                     except (RuntimeError, zipfile.BadZipfile):
                         fetch.handle_invalid_container(filename, self.fetcher_conf['remove_invalid'], json_error=True)
                         self.logger.error(traceback.format_exc())
@@ -54,19 +84,49 @@ class Provider(hp.HelperProcess):
                         fetch.handle_invalid_container(filename, self.fetcher_conf['remove_invalid'], json_error=True)
                         continue
 
+                    self.submissions.remember(filename, container_config, base_images[filename])
+                    submissions.append((filename, container_config))
+
+                # build in the order in which the containers are expected to run
+                penalties, queued_penalties = schedule.read_queue_state(self.paths['history'])
+                ordered = schedule.order_submissions(submissions, penalties, queued_penalties)
+
+                n_built = 0
+                for position, filename, container_config in ordered:
+
+                    # defer jobs which are too far back in the queue, they are reconsidered in the next cycle
+                    if 0 < self.builder_conf['lookahead'] <= position:
+                        self.logger.debug('\tdeferring build of {} (predicted queue position {})'.format(filename,
+                                                                                                          position))
+                        continue
+
                     # check for valid executor
                     if container_config.executor_name in self.fetcher_conf['executors']:
+                        submission_base_images = base_images[filename]
+
                         # move file to local drive
                         try:
+                            fetch_bytes, fetch_start = os.path.getsize(filename), time.time()
                             filename = fetch.fetch(filename, self.paths['local_containers'])
+                            fetch_seconds = time.time() - fetch_start
+                        except fetch.InsufficientSpaceError:
+                            # not the fault of the submission, it is fetched once space has been freed
+                            self.logger.warning('\tdeferring fetch of {}, the local drive is full'.format(filename))
+                            continue
                         except IOError:
                             self.logger.error(traceback.format_exc())
+
+                            # back off, quarantine the submission if it keeps failing
+                            if self.submissions.failed(filename):
+                                fetch.handle_invalid_container(filename, quarantine=True)
+                                self.submissions.forget(filename)
                             continue
                     else:
                         fetch.handle_invalid_container(filename, self.fetcher_conf['remove_invalid'])
                         continue
 
                     # generate docker image
+                    build_start = time.time()
                     try:
                         if container_config.build_flag:
                             image = build.build_image(filename, unzip_dir=self.paths['unzip'], tag=container_config.name)
@@ -84,8 +144,26 @@ class Provider(hp.HelperProcess):
                     # except docker.errors.APIError as e:
                     #     continue
 
-                    queue_container = Container(container_config, image.id, mounts=self.docker_conf['mounts'])
-                    self.queue.put(queue_container)
+                    # only count submissions that made it into the queue, failed fetches are retried
+                    self.base_images.record(submission_base_images)
+
+                    # send a plain job record, the queue creates the Container from it
+                    record = {'config': container_config.to_dict(), 'image_id': image.id,
+                              'mounts': self.docker_conf['mounts'],
+                              'metrics': {'source': 'share', 'build_seconds': time.time() - build_start,
+                                          'fetch_seconds': fetch_seconds, 'fetch_bytes': fetch_bytes}}
+
+                    # sent right away, a built job (e.g. the head of the queue) must not wait for the next build
+                    self.channel.put(record)
+                    n_built += 1
+
+                # use idle cycles to keep the most popular base images warm
+                if n_built == 0 and self.builder_conf['prepull_count'] > 0:
+                    self.base_images.mirror_dir = self.builder_conf['mirror_dir']
+                    known_files = set(network_files)
+                    self.base_images.refresh_in_background(
+                        self.builder_conf['prepull_count'], self.builder_conf['prepull_interval'],
+                        should_stop=lambda: self.term_flag.value or self.new_submissions(known_files))
 
                 # leave the loop if terminate flag is set
                 if self.term_flag.value:
@@ -104,13 +182,12 @@ class Provider(hp.HelperProcess):
 
     def stop(self):
         self.term_flag.value = 1
-        self.queue.close()
         if self.status == 'running':
             self.process.join(timeout=None)
 
 
 def test_provider():
-    from pathos.helpers import mp
+    from utils.ipc import JobChannel
     import shutil
 
     test_config = {
@@ -127,9 +204,15 @@ def test_provider():
                    'logging_interval': 30},
         'builder': {'sleep': 10,
                     'load': '.tar',
-                    'build': '.zip'},
+                    'build': '.zip',
+                    'lookahead': 0,
+                    'prepull_count': 0,
+                    'prepull_interval': 86400,
+                    'mirror_dir': ''},
         'fetcher': {'remove_invalid': False,
                     'sleep': 10,
+                    'retry_backoff': 60,
+                    'max_attempts': 5,
                     'min_space': 0.01,
                     'executors': 'ilja'}}
 
@@ -142,13 +225,13 @@ def test_provider():
         testfile = os.path.join(backup_dir, testfile)
         shutil.copy(testfile, test_config['paths']['network_containers'])
 
-    q = mp.Queue()
-    p = Provider(test_config, q)
+    channel = JobChannel()
+    p = Provider(test_config, channel)
     p.start()
     while p.status == 'running':
         try:
-            image = q.get()
-            print(image)
+            records = channel.get_many(timeout=None)
+            print(records)
         except BaseException:
             p.stop()
 
@@ -4,7 +4,9 @@ import os
 import time
 import docker.errors
 import docker
+from core.statecache import JOB_LABEL
 from utils import log
+from utils.docker_client import get_client
 
 LOG = log.get_module_log(__name__)
 
@@ -37,13 +39,14 @@ def unzip_docker_files(filename, target_dir):
         return os.path.join(target_dir, dockerfile)
 
 
-def build_image(filename, unzip_dir="", tag=None, logger=LOG):
+def build_image(filename, unzip_dir="", tag=None, logger=LOG, job_id=None):
     """
-    build docker image form zipfile
+    build docker image form zipfile, the image carries the job label so that the image collector can evict it
     :param filename: name of the zipfile
     :param unzip_dir: directory where files are extracted to temporarily
     :param tag: string which identifies the docker container to be build.
     :param logger: instance of logging
+    :param job_id: id of the job the image is built for, if already known
     :return: docker image
     """
 
@@ -67,8 +70,9 @@ def build_image(filename, unzip_dir="", tag=None, logger=LOG):
     else:
         filename = "".join(os.path.basename(filename).split('.')[:-1])
         try:
-            client = docker.from_env()
-            image = client.images.build(path=os.path.dirname(dockerfile), rm=True, tag=tag)
+            client = get_client()
+            image = client.images.build(path=os.path.dirname(dockerfile), rm=True, tag=tag,
+                                        labels={JOB_LABEL: job_id or ''})
         except (docker.errors.BuildError, docker.errors.APIError) as e:
             logger.error('\terror while building image {} (tag={}):\n\t\t{}'.format(filename, tag, e))
             clear_unzipped(unzip_dir, filename)
@@ -96,7 +100,7 @@ def load_image(filename, failed_dir="", rm_invalid=False, logger=LOG):
     with open(filename, 'r') as f:
         data = f.read()
     try:
-        client = docker.from_env()
+        client = get_client()
         output = next(client.images.load(data))
 
         if 'error' in list(output.keys()):
@@ -179,7 +183,7 @@ def create_container(image, config, mounts, logger=LOG):
     """
 
     mounts = create_mounts(mounts, config.executor_name)
-    client = docker.from_env()
+    client = get_client()
     try:
         create_conf = config.docker_params(image=image, detach=True, mounts=mounts, environment=["NVIDIA_VISIBLE_DEVICES=none"])
         container = client.containers.create(**create_conf)
@@ -1,3 +1,4 @@
+import errno
 import os
 import shutil
 import time
@@ -7,6 +8,13 @@ from utils import log
 LOG = log.get_module_log(__name__)
 
 
+class InsufficientSpaceError(IOError):
+    """
+    The local drive of the queue is full, the submission itself is fine and is fetched once space has been freed.
+    """
+    pass
+
+
 def get_free_space(path, logger=LOG):
     """
     helper function for examining free space on a drive
@@ -60,19 +68,23 @@ def move_container(filepath, target_dir, logger=LOG):
     return os.path.join(target_dir, os.path.basename(filepath))
 
 
-def handle_invalid_container(filename, rm_invalid=False, json_error=False, no_space=False, logger=LOG):
+def handle_invalid_container(filename, rm_invalid=False, json_error=False, no_space=False, quarantine=False,
+                             logger=LOG):
     """
     Will detect invalid containers and create a warning in log and if flag is set, also delete the correspnding
     containers.
     :param filename: name of the invalid file
     :param logger: instance of logging
     :param rm_invalid: remove invalid files if True
+    :param quarantine: the container failed repeatedly and is moved to the invalid dir
     :return:
     """
 
     source_dir = os.path.dirname(filename)
 
-    if no_space:
+    if quarantine:
+        logger.warning("\tThe following container failed repeatedly and has been quarantined:\n {}".format(filename))
+    elif no_space:
         logger.info("\tnot enough space to fetch container {}".format(filename))
     elif json_error:
         logger.warning("\tThe container_config.json could not be read for this container:\n {}".format(filename))
@@ -98,15 +110,26 @@ def fetch(filename, target_dir, logger=LOG, rm_invalid=True):
     :param target_dir: directory where files will be moved to
     :param logger: instance of logging
     :return: list of filenames that were moved
+    :raises InsufficientSpaceError: if the local drive is full, the file is left on the share
     """
 
     # check if enough space is present on hard drive
     free_space_abs, free_space_rel = get_free_space(target_dir)
     if free_space_abs < os.stat(filename).st_size:
-        handle_invalid_container(filename, logger, rm_invalid, no_space=True)
-        raise IOError("\tnot enough space to fetch container {}".format(filename))
-    else:
-        # move containers
-        filename = move_container(filename, target_dir, logger)
-        return filename
+        # the file is left on the share, so that the provider can retry once space has been freed
+        logger.info("\tnot enough space to fetch container {}".format(filename))
+        raise InsufficientSpaceError("not enough space to fetch container {}".format(filename))
+
+    # move containers
+    try:
+        return move_container(filename, target_dir, logger)
+    except OSError as e:
+        if e.errno != errno.ENOSPC:
+            raise
+
+        # the drive filled up while copying, drop the partial copy
+        target_path = os.path.join(target_dir, os.path.basename(filename))
+        if os.path.isfile(target_path) and os.path.isfile(filename):
+            os.remove(target_path)
+        raise InsufficientSpaceError("drive filled up while fetching container {}".format(filename))
 
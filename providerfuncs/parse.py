@@ -7,6 +7,7 @@ Provides a configuration wrapper for container objects.
 """
 
 import os
+import re
 import zipfile
 
 from core.containerconfig import ContainerConfig
@@ -65,3 +66,74 @@ def parse_zipped_config(zip_path, config_filename="container_config.json"):
 
         # load candidate
         return ContainerConfig.from_string(zip_h.read(candidates[0]))
+
+
+def parse_base_images(dockerfile):
+    """
+    Extracts the base images from the FROM instructions of a Dockerfile. References to earlier build stages, scratch
+    and images that depend on build arguments are skipped, since they can not be pulled ahead of the build.
+
+    :param dockerfile: Content of the Dockerfile as string.
+    :return: List of base image names (with tag, defaults to latest).
+    """
+
+    base_images = []
+    stages = set()
+    for line in dockerfile.splitlines():
+
+        # FROM [--platform=<platform>] <image> [AS <name>]
+        match_dt = re.match(r'^\s*FROM\s+(?:--\S+\s+)*(\S+)(?:\s+AS\s+(\S+))?', line, re.IGNORECASE)
+        if match_dt is None:
+            continue
+
+        image, stage = match_dt.group(1), match_dt.group(2)
+        if stage is not None:
+            stages.add(stage.lower())
+
+        if image.lower() in stages or image.lower() == 'scratch' or '$' in image:
+            continue
+
+        # add default tag
+        if '@' not in image and ':' not in image.split('/')[-1]:
+            image += ':latest'
+
+        if image not in base_images:
+            base_images.append(image)
+
+    return base_images
+
+
+def parse_zipped_submission(zip_path, config_filename="container_config.json", dockerfile_name="Dockerfile"):
+    """
+    Reads the container configuration and the base images of the Dockerfile from a zipped submission, opening the
+    zip file only once.
+
+    :param zip_path: Path to zip file.
+    :param config_filename: Name of the config file.
+    :param dockerfile_name: Name of the Dockerfile.
+    :return: Tuple of (ContainerConfig instance or None, list of base images)
+    """
+
+    with zipfile.ZipFile(zip_path) as zip_h:
+
+        names = zip_h.namelist()
+
+        # same lookup as in parse_zipped_config
+        if config_filename in names:
+            container_config = ContainerConfig.from_string(zip_h.read(config_filename))
+        else:
+            candidates = [name_i for name_i in names if name_i.endswith(config_filename)]
+            if len(candidates) != 1:
+                LOG.error("The required configuration file '{}' is not available or ambiguous (found={})! "
+                          "Please provide a single file with this name or place it to root folder."
+                          "".format(config_filename, len(candidates)))
+                return None, []
+            container_config = ContainerConfig.from_string(zip_h.read(candidates[0]))
+
+        # the Dockerfile is looked up the same way build.unzip_docker_files does
+        dockerfiles = [name_i for name_i in names if dockerfile_name in name_i]
+        if not dockerfiles:
+            return container_config, []
+
+        dockerfile = zip_h.read(dockerfiles[0]).decode('utf-8', errors='replace')
+        return container_config, parse_base_images(dockerfile)
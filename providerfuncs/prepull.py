@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+prepull.py
+
+Keeps the most popular base images of the submitted Dockerfiles warm, so that builds do not have to pull them.
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+
+import docker.errors
+
+from utils import log
+from utils.docker_client import get_client
+
+
+LOG = log.get_module_log(__name__)
+
+BASE_IMAGES_FILE = 'base_images.json'
+
+
+def mirror_filename(image):
+    """
+    Name of the tar file (as created by docker save) of an image in the local registry mirror directory.
+
+    :param image: Image name with tag, e.g. corresive/tfbase:latest
+    :return: File name, e.g. corresive_tfbase_latest.tar
+    """
+    return image.replace('/', '_').replace(':', '_').replace('@', '_') + '.tar'
+
+
+class BaseImageCache(object):
+
+    def __init__(self, state_dir, mirror_dir=''):
+        """
+        Popularity count of base images with background refresh.
+
+        :param state_dir: Directory where the popularity counts are stored.
+        :param mirror_dir: Directory with saved images (see mirror_filename) that is used instead of the registry.
+        """
+        self.file_path = os.path.join(state_dir, BASE_IMAGES_FILE)
+        self.mirror_dir = mirror_dir
+        self.images = self.load()
+
+        # the provider counts submissions while the refresh runs in its own thread
+        self._lock = threading.Lock()
+        self.thread = None
+
+    def load(self):
+        try:
+            with open(self.file_path, 'r') as file_h:
+                return json.load(file_h)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.file_path + '.tmp'
+            with open(tmp_path, 'w') as file_h:
+                json.dump(self.images, file_h)
+            os.replace(tmp_path, self.file_path)
+
+    def record(self, base_images):
+        """
+        Counts the base images of a submission.
+
+        :param base_images: List of base images as returned by parse.parse_base_images.
+        :return: None
+        """
+        if not base_images:
+            return
+
+        with self._lock:
+            for image in base_images:
+                entry = self.images.setdefault(image, {'count': 0, 'last_pull': 0})
+                entry['count'] += 1
+        self.save()
+
+    def top(self, n):
+        """
+        :param n: Number of images to return.
+        :return: The n most popular base images.
+        """
+        with self._lock:
+            ranked = sorted(self.images.items(), key=lambda item: item[1]['count'], reverse=True)
+        return [image for image, _ in ranked[:n]]
+
+    def pull(self, image, client=None):
+        """
+        Pulls an image, from the mirror directory if it contains the image, otherwise from the registry.
+
+        :param image: Image name with tag.
+        :param client: Docker API client.
+        :return: None
+        """
+
+        if client is None:
+            client = get_client()
+
+        mirror_path = os.path.join(self.mirror_dir, mirror_filename(image)) if self.mirror_dir else ''
+        if mirror_path and os.path.isfile(mirror_path):
+            with open(mirror_path, 'rb') as file_h:
+                client.images.load(file_h)
+            LOG.info('\tloaded base image {} from mirror'.format(image))
+        else:
+            repository, _, tag = image.rpartition(':') if '@' not in image else (image, '', None)
+            client.images.pull(repository, tag=tag)
+            LOG.info('\tpulled base image {}'.format(image))
+
+        with self._lock:
+            self.images[image]['last_pull'] = time.time()
+
+    @property
+    def refreshing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def refresh_in_background(self, n, max_age, should_stop=None):
+        """
+        Runs refresh in a thread, so that new submissions are not blocked by long pulls. Nothing is done while the
+        previous refresh is still running.
+
+        :return: None
+        """
+        if self.refreshing:
+            return
+        self.thread = threading.Thread(target=self._refresh, args=(n, max_age, should_stop), name='DoPQ-Prepull')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _refresh(self, n, max_age, should_stop):
+        try:
+            self.refresh(n, max_age, should_stop)
+        except Exception:
+            LOG.error(traceback.format_exc())
+
+    def refresh(self, n, max_age, should_stop=None):
+        """
+        Pulls the n most popular base images which have not been refreshed for max_age seconds.
+
+        :param n: Number of images to keep warm.
+        :param max_age: Seconds after which an image is refreshed again.
+        :param should_stop: Function returning True if the refresh should be interrupted (e.g. new submissions).
+        :return: Number of refreshed images.
+        """
+
+        client = get_client()
+        refreshed = 0
+        for image in self.top(n):
+
+            if should_stop is not None and should_stop():
+                break
+            if time.time() - self.images[image]['last_pull'] < max_age:
+                continue
+
+            try:
+                self.pull(image, client)
+            except (docker.errors.APIError, IOError) as e:
+                LOG.warning('\tcould not refresh base image {}: {}'.format(image, e))
+                # do not retry before the next refresh period
+                with self._lock:
+                    self.images[image]['last_pull'] = time.time()
+                continue
+
+            refreshed += 1
+
+        self.save()
+        return refreshed
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+schedule.py
+
+Predicts where incoming submissions will end up in the priority queue, so that the provider can build the images of
+jobs that are likely to run next first.
+"""
+
+import json
+import os
+
+from utils import log
+
+
+LOG = log.get_module_log(__name__)
+
+QUEUE_STATE_FILE = 'queue_state.json'
+
+
+def write_queue_state(state_dir, penalties, queued_penalties):
+    """
+    Publishes the information the provider needs for predicting queue positions. The file is replaced atomically, so
+    the provider never reads a half written state.
+
+    :param state_dir: Directory where the state file is stored (the history dir of the queue).
+    :param penalties: Dictionary mapping each user to their current penalty.
+    :param queued_penalties: List with the penalty of every container that is currently enqueued.
+    :return: None
+    """
+
+    state = {'penalties': penalties,
+             'queued': sorted(queued_penalties)}
+
+    file_path = os.path.join(state_dir, QUEUE_STATE_FILE)
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as file_h:
+        json.dump(state, file_h)
+    os.replace(tmp_path, file_path)
+
+
+def read_queue_state(state_dir):
+    """
+    Reads the queue state as written by write_queue_state.
+
+    :param state_dir: Directory where the state file is stored.
+    :return: Tuple of (penalties dict, sorted list of queued penalties), both empty if no state is available
+    """
+
+    file_path = os.path.join(state_dir, QUEUE_STATE_FILE)
+    try:
+        with open(file_path, 'r') as file_h:
+            state = json.load(file_h)
+    except (IOError, ValueError):
+        return {}, []
+
+    return state.get('penalties', {}), state.get('queued', [])
+
+
+def order_submissions(submissions, penalties, queued_penalties):
+    """
+    Sorts submissions the same way DopQ.sort_fn will sort the resulting containers and predicts the position each
+    container will take in DopQ.container_list.
+
+    A new container is sorted by (penalty of its user, creation time), so it will be placed behind every enqueued
+    container whose user has a lower or equal penalty, and behind all earlier submissions of users with a lower or
+    equal penalty.
+
+    :param submissions: List of (filename, ContainerConfig) tuples.
+    :param penalties: Dictionary mapping each user to their current penalty, unknown users get no penalty.
+    :param queued_penalties: Sorted list with the penalty of every enqueued container.
+    :return: List of (predicted position, filename, ContainerConfig) tuples, sorted by predicted position
+    """
+
+    def sort_fn(submission):
+        filename, container_config = submission
+        try:
+            arrival = os.path.getmtime(filename)
+        except OSError:
+            arrival = 0
+        return penalties.get(container_config.executor_name, 0), arrival
+
+    ordered = []
+    for index, submission in enumerate(sorted(submissions, key=sort_fn)):
+        penalty = penalties.get(submission[1].executor_name, 0)
+
+        # all enqueued containers with lower or equal penalty run first
+        position = sum(1 for queued in queued_penalties if queued <= penalty) + index
+        ordered.append((position, submission[0], submission[1]))
+
+    return ordered
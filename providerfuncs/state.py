@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+state.py
+
+Remembers submissions the provider has already examined, so that deferred and failing submissions are neither
+re-parsed nor retried every cycle.
+"""
+
+import os
+import time
+
+from utils import log
+
+
+LOG = log.get_module_log(__name__)
+
+
+class SubmissionStates(object):
+
+    def __init__(self, backoff=60, max_backoff=3600, max_attempts=5):
+        """
+        State table of submissions keyed by (path, size, mtime), so that a re-uploaded file starts with a clean state.
+
+        :param backoff: Seconds to wait before the first retry, doubled after every further failure.
+        :param max_backoff: Upper limit for the waiting time in seconds.
+        :param max_attempts: Number of failed attempts after which a submission is quarantined.
+        """
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.states = {}
+
+    @staticmethod
+    def key(filename):
+        stat = os.stat(filename)
+        return filename, stat.st_size, stat.st_mtime
+
+    def get(self, filename):
+        """
+        :param filename: Path of the submission.
+        :return: State dictionary of the submission, None if the submission is unknown or has been changed.
+        """
+        try:
+            return self.states.get(self.key(filename))
+        except OSError:
+            return None
+
+    def remember(self, filename, container_config, base_images):
+        """
+        Stores the parsing results of a submission.
+
+        :param filename: Path of the submission.
+        :param container_config: ContainerConfig instance parsed from the submission.
+        :param base_images: Base images parsed from the Dockerfile of the submission.
+        :return: State dictionary of the submission
+        """
+        state = {'config': container_config, 'base_images': base_images, 'attempts': 0, 'retry_at': 0}
+        self.states[self.key(filename)] = state
+        return state
+
+    def ready(self, filename):
+        """
+        :param filename: Path of the submission.
+        :return: False while the submission is backing off after a failure, otherwise True
+        """
+        state = self.get(filename)
+        return state is None or time.time() >= state['retry_at']
+
+    def failed(self, filename):
+        """
+        Registers a failed attempt and schedules the next retry with exponential backoff.
+
+        :param filename: Path of the submission.
+        :return: True if the submission has reached the maximum number of attempts and should be quarantined
+        """
+        state = self.get(filename)
+        if state is None:
+            state = self.remember(filename, None, [])
+
+        state['attempts'] += 1
+        delay = min(self.backoff * 2 ** (state['attempts'] - 1), self.max_backoff)
+        state['retry_at'] = time.time() + delay
+
+        if state['attempts'] >= self.max_attempts:
+            return True
+
+        LOG.info('\tattempt {} for {} failed, retrying in {}s'.format(state['attempts'], filename, delay))
+        return False
+
+    def forget(self, filename):
+        """
+        Removes all states of a submission (after it has been fetched or quarantined).
+
+        :param filename: Path of the submission.
+        :return: None
+        """
+        for key in [key for key in self.states if key[0] == filename]:
+            del self.states[key]
+
+    def prune(self, filenames):
+        """
+        Removes the states of all submissions which are not present anymore.
+
+        :param filenames: Paths of the submissions that are currently present.
+        :return: None
+        """
+        filenames = set(filenames)
+        for key in [key for key in self.states if key[0] not in filenames]:
+            del self.states[key]
@@ -4,5 +4,6 @@ pip --no-cache-dir install \
          pathos\
          psutil\
          gputil \
+         pynvml \
          python-dateutil\
          colorlog
\ No newline at end of file
@@ -0,0 +1,234 @@
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+import uuid
+import zipfile
+from collections import OrderedDict
+
+from docker.errors import DockerException, ImageNotFound
+
+from core.containerconfig import ContainerConfig
+from providerfuncs import build, parse
+from utils import log
+from utils.docker_client import get_client
+
+
+class SubmissionError(Exception):
+    pass
+
+
+# users that may submit jobs for every executor
+ADMIN_USERS = ('root',)
+
+
+class Submitter(object):
+
+    def __init__(self, config, channel, max_jobs=1000):
+        """
+        accepts jobs that are submitted directly to the queue (via the api) instead of the network share. submissions
+        are validated right away and get their job id immediately, the images are built one after another in a
+        background thread and then sent to the queue like the jobs of the provider
+        :param config: parsed config as created by parse_config() in dop_q.py
+        :param channel: JobChannel to the queue
+        :param max_jobs: number of submissions whose state is remembered
+        """
+        self.paths = config['paths']
+        self.fetcher_conf = config['fetcher']
+        self.docker_conf = config['docker']
+        self.channel = channel
+        self.max_jobs = max_jobs
+        self.logger = log.get_module_log(__name__)
+        self.states = OrderedDict()
+        self.jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-Submitter')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        """
+        stops accepting submissions, a build that is running is not waited for
+        :param timeout: seconds to wait for the thread to pick up the stop
+        :return: None
+        """
+        self._stop_event.set()
+        self.jobs.put(None)
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.logger.warning('abandoning the submission that is being built')
+
+    def context_path(self, job_id):
+        """
+        :return: path where the build context of a submission is stored until it is built
+        """
+        return os.path.join(self.paths['local_containers'], 'submit_{}.zip'.format(job_id))
+
+    @staticmethod
+    def new_job_id():
+        # same format as the job ids of Container
+        return uuid.uuid4().hex[:12]
+
+    def validate(self, config_dict, user=None):
+        """
+        :param config_dict: container config as dict
+        :param user: name of the local user who submits the job, None if the caller is not known
+        :return: ContainerConfig
+        :raises SubmissionError: if the config is not valid, the executor is not allowed to submit or the user may not
+                                 submit as the executor
+        """
+        container_config = ContainerConfig.from_dict(config_dict) if isinstance(config_dict, dict) else None
+        if container_config is None:
+            raise SubmissionError('container config is not valid (name, executor_name, num_gpus, required_memory and '
+                                  'output_paths are checked, see the queue log for details)')
+        if container_config.executor_name not in self.fetcher_conf['executors']:
+            raise SubmissionError("executor '{}' is not allowed to run containers".format(
+                container_config.executor_name))
+        if user is not None and user != container_config.executor_name and user not in ADMIN_USERS:
+            raise SubmissionError("user '{}' can not submit jobs of executor '{}'".format(
+                user, container_config.executor_name))
+        return container_config
+
+    def submit_context(self, job_id, config_dict=None, user=None):
+        """
+        submits a build context that has been stored at context_path(job_id)
+        :param job_id: job id as returned by new_job_id()
+        :param config_dict: container config, read from the container_config.json of the context if None
+        :param user: name of the local user who submits the job, see validate()
+        :return: dict with the state of the submission
+        :raises SubmissionError: if the context or its config is not valid
+        """
+        path = self.context_path(job_id)
+        try:
+            try:
+                if config_dict is None:
+                    container_config, _ = parse.parse_zipped_submission(path)
+                    if container_config is None:
+                        raise SubmissionError('container_config.json of the build context is missing or not valid')
+                    config_dict = container_config.to_dict()
+                with zipfile.ZipFile(path) as zip_h:
+                    if not [name_i for name_i in zip_h.namelist() if 'Dockerfile' in name_i]:
+                        raise SubmissionError('build context does not contain a Dockerfile')
+            except (zipfile.BadZipfile, ValueError) as e:
+                raise SubmissionError('build context is not a valid zip file: {}'.format(e))
+
+            container_config = self.validate(config_dict, user)
+            container_config.build_flag = True
+        except SubmissionError:
+            os.remove(path)
+            raise
+
+        return self.enqueue(job_id, container_config, context=path)
+
+    def submit_image(self, job_id, config_dict, image, user=None):
+        """
+        submits a job that runs an existing image
+        :param job_id: job id as returned by new_job_id()
+        :param config_dict: container config as dict
+        :param image: name or id of the image
+        :param user: name of the local user who submits the job, see validate()
+        :return: dict with the state of the submission
+        :raises SubmissionError: if the image does not exist or the config is not valid
+        """
+        container_config = self.validate(config_dict, user)
+        container_config.build_flag = False
+        try:
+            image_id = get_client().images.get(image).id
+        except ImageNotFound:
+            raise SubmissionError("image '{}' does not exist".format(image))
+        except DockerException as e:
+            raise SubmissionError("could not look up image '{}': {}".format(image, e))
+
+        return self.enqueue(job_id, container_config, image_id=image_id)
+
+    def enqueue(self, job_id, container_config, context=None, image_id=None):
+        state = {'job_id': job_id, 'name': container_config.name, 'executor': container_config.executor_name,
+                 'status': 'submitted', 'submitted': time.time(), 'error': None}
+        with self._lock:
+            self.states[job_id] = state
+            while len(self.states) > self.max_jobs:
+                self.states.popitem(last=False)
+
+        self.jobs.put((job_id, container_config, context, image_id))
+        self.logger.info('\treceived submission {} ({}) of {}'.format(job_id, container_config.name,
+                                                                      container_config.executor_name))
+        return dict(state)
+
+    def state(self, job_id):
+        """
+        :return: dict with the state of a submission, None if it is unknown
+        """
+        with self._lock:
+            state = self.states.get(job_id)
+            return dict(state) if state is not None else None
+
+    def set_state(self, job_id, status, error=None):
+        with self._lock:
+            if job_id in self.states:
+                self.states[job_id].update(status=status, error=error)
+
+    def run(self):
+        while not self._stop_event.is_set():
+
+            # submissions that arrive while another one is built are handled as one batch
+            jobs = [self.jobs.get()]
+            while True:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = []
+            for job in jobs:
+                if job is None or self._stop_event.is_set():
+                    continue
+                try:
+                    record = self.provide(*job)
+                except Exception:
+                    self.logger.error(traceback.format_exc())
+                    self.set_state(job[0], 'failed', 'internal error, see the queue log')
+                    continue
+                if record is not None:
+                    records.append(record)
+
+            # the channel is closed during shutdown
+            if self._stop_event.is_set():
+                break
+            self.channel.put_many(records)
+            for record in records:
+                self.set_state(record['job_id'], 'enqueued')
+
+    def provide(self, job_id, container_config, context, image_id):
+        """
+        builds the image of a submission if necessary
+        :return: job record for the queue, None if the build failed
+        """
+        metrics = {'source': 'api'}
+        if context is not None:
+            self.set_state(job_id, 'building')
+            build_start = time.time()
+
+            # separate unzip directory, the provider may build at the same time
+            unzip_dir = os.path.join(self.paths['unzip'], job_id, '')
+            try:
+                image = build.build_image(context, unzip_dir=unzip_dir, tag=container_config.name, logger=self.logger,
+                                          job_id=job_id)
+            except (DockerException, zipfile.BadZipfile, IOError) as e:
+                self.set_state(job_id, 'failed', str(e))
+                return None
+            finally:
+                shutil.rmtree(unzip_dir, ignore_errors=True)
+                if os.path.isfile(context):
+                    os.remove(context)
+            image_id = image.id
+            metrics['build_seconds'] = time.time() - build_start
+
+        # the job keeps the id it was submitted with
+        return {'job_id': job_id, 'config': container_config.to_dict(), 'image_id': image_id,
+                'mounts': self.docker_conf['mounts'], 'metrics': metrics}
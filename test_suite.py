@@ -5,6 +5,7 @@ import time
 import utils.interface
 import numpy as np
 from utils.cpu import CPU
+from utils.snapshot import SnapshotPublisher
 import threading
 import datetime
 
@@ -26,6 +27,7 @@ class DummyDoPQ(helper_process.HelperProcess):
                                DummyContainer('dummy', [1], 'Much Container! WOW!', 'exited')]
         self.paths = {'log': '.'}
         self.thread = threading.Thread(target=self.run_queue)
+        self.snapshots = SnapshotPublisher(self.build_snapshot, interval=1)
 
     @property
     def uptime(self):
@@ -55,11 +57,46 @@ class DummyDoPQ(helper_process.HelperProcess):
 
         if self.starttime is None:
             return 'not started'
-        elif self.thread.isAlive():
+        elif self.thread.is_alive():
             return 'running'
         else:
             return 'terminated'
 
+    @property
+    def snapshot(self):
+        return self.snapshots.snapshot
+
+    def build_snapshot(self):
+        status = {'queue status': self.status, 'queue uptime': '', 'queue starttime': '',
+                  'provider status': '', 'provider uptime': '', 'provider starttime': ''}
+        if status['queue status'] == 'running':
+            status['queue uptime'], status['queue starttime'] = self.uptime
+            status['provider status'] = self.provider.status
+
+        # the entries are identified by a job id when the snapshots are compared
+        def info(container, stats=False):
+            return dict(container.container_stats() if stats else container.history_info(), job_id=str(id(container)))
+
+        return {'status': status,
+                'running': [info(container, stats=True) for container in list(self.running_containers)],
+                'enqueued': [info(container) for container in list(self.container_list)],
+                'history': [info(container) for container in list(self.history)],
+                'n_enqueued': len(self.container_list),
+                'n_history': len(self.history),
+                'users': self.users_stats}
+
+    def history_page(self, offset, count):
+        return [dict(container.history_info(), job_id=str(id(container)))
+                for container in self.history[offset:offset + count]]
+
+    def enqueued_page(self, offset, count):
+        return [dict(container.history_info(), job_id=str(id(container)))
+                for container in self.container_list[offset:offset + count]]
+
+    def log_file(self, job_id):
+        # dummy containers do not write logs
+        return None
+
     def generate_container_list(self, n, status):
         containers = []
         for i in range(n):
@@ -104,8 +141,10 @@ class DummyDoPQ(helper_process.HelperProcess):
         try:
             self.starttime = time.time()
             self.thread.start()
+            self.snapshots.start()
             utils.interface.run_interface(self)
         finally:
+            self.snapshots.stop()
             self.stop()
 
     @property
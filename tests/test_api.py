@@ -0,0 +1,110 @@
+import http.client
+import json
+
+import pytest
+
+from api import APIServer, HTTPError, Request
+from utils.snapshot import SnapshotPublisher
+
+
+class FakeContainer(object):
+
+    def __init__(self, job_id, user):
+        self.job_id = job_id
+        self.user = user
+
+
+class FakeDoPQ(object):
+
+    def __init__(self):
+        self.paused = False
+        self.cancelled = []
+        self.enabled = []
+        self.containers = [FakeContainer('a1', 'alice')]
+        self.snapshots = SnapshotPublisher(lambda: {'status': {}, 'running': [], 'enqueued': [], 'history': [],
+                                                    'n_enqueued': 0, 'n_history': 0, 'users': []})
+
+    @property
+    def snapshot(self):
+        return self.snapshots.snapshot
+
+    def pause(self):
+        self.paused = True
+
+    def find_job(self, job_id):
+        for container in self.containers:
+            if container.job_id == job_id:
+                return container
+        return None
+
+    def cancel(self, job_id):
+        self.cancelled.append(job_id)
+        return 'removed'
+
+    def enable_gpu(self, minor):
+        self.enabled.append(minor)
+        return True
+
+
+def action(path, user, **params):
+    request = Request('POST', path, {}, None)
+    request.user = user
+    request.params = params
+    return request
+
+
+@pytest.fixture
+def server():
+    server = APIServer(FakeDoPQ(), port=0)
+    yield server
+
+
+def test_cancel_only_own_jobs(server):
+    with pytest.raises(HTTPError) as e:
+        server.post_cancel(action('/jobs/a1/cancel', 'bob', job_id='a1'))
+    assert e.value.status == 403
+    assert server.dopq.cancelled == []
+
+    assert server.post_cancel(action('/jobs/a1/cancel', 'alice', job_id='a1'))[0] == 200
+    assert server.post_cancel(action('/jobs/a1/cancel', 'root', job_id='a1'))[0] == 200
+    assert server.dopq.cancelled == ['a1', 'a1']
+
+
+def test_admin_actions(server):
+    for handler, path, params in ((server.post_pause, '/pause', {}),
+                                  (server.post_resume, '/resume', {}),
+                                  (server.post_reload, '/reload', {}),
+                                  (server.post_enable_gpu, '/gpus/1/enable', {'minor': '1'})):
+        with pytest.raises(HTTPError) as e:
+            handler(action(path, 'alice', **params))
+        assert e.value.status == 403
+
+    assert not server.dopq.paused
+    assert server.dopq.enabled == []
+    assert server.post_enable_gpu(action('/gpus/1/enable', 'root', minor='1'))[0] == 200
+    assert server.dopq.enabled == [1]
+
+
+def test_actions_over_tcp(server):
+    server.start()
+    try:
+        port = server.server.sockets[0].getsockname()[1]
+        for path in ('/pause', '/jobs/a1/cancel', '/gpus/1/enable', '/reload'):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.request('POST', path)
+            response = connection.getresponse()
+            assert response.status == 403
+            assert 'unix socket' in json.loads(response.read())['error']
+            connection.close()
+
+        # read requests are still answered
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        connection.request('GET', '/running')
+        assert connection.getresponse().status == 200
+        connection.close()
+    finally:
+        server.stop()
+
+    assert not server.dopq.paused
+    assert server.dopq.cancelled == []
+    assert server.dopq.enabled == []
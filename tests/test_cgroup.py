@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.cgroup import CgroupReader
+from utils.telemetry import TelemetrySampler
+
+
+CONTAINER_ID = 'f' * 64
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file_h:
+        file_h.write(content)
+
+
+def make_v2(root, usage_usec=1000, memory_max='max', systemd=True):
+    """
+    fake unified hierarchy with one container
+    """
+    write(os.path.join(root, 'cgroup.controllers'), 'cpu io memory pids\n')
+    if systemd:
+        path = os.path.join(root, 'system.slice', 'docker-{}.scope'.format(CONTAINER_ID))
+    else:
+        path = os.path.join(root, 'docker', CONTAINER_ID)
+    write(os.path.join(path, 'memory.current'), '1048576\n')
+    write(os.path.join(path, 'memory.max'), '{}\n'.format(memory_max))
+    write(os.path.join(path, 'cpu.stat'), 'usage_usec {}\nuser_usec 600\nsystem_usec 400\n'.format(usage_usec))
+    write(os.path.join(path, 'pids.current'), '7\n')
+    write(os.path.join(path, 'io.stat'), '8:0 rbytes=1024 wbytes=2048 rios=1 wios=2 dbytes=0 dios=0\n'
+                                         '8:16 rbytes=1 wbytes=2 rios=1 wios=1 dbytes=0 dios=0\n')
+    return path
+
+
+def make_v1(root, cpu_controller='cpu,cpuacct', systemd=False):
+    """
+    fake hierarchy with one directory per controller
+    """
+    def container_dir(controller):
+        if systemd:
+            return os.path.join(root, controller, 'system.slice', 'docker-{}.scope'.format(CONTAINER_ID))
+        return os.path.join(root, controller, 'docker', CONTAINER_ID)
+
+    write(os.path.join(container_dir('memory'), 'memory.usage_in_bytes'), '2097152\n')
+    write(os.path.join(container_dir('memory'), 'memory.limit_in_bytes'), '4194304\n')
+    write(os.path.join(container_dir(cpu_controller), 'cpuacct.usage'), '5000000\n')
+    write(os.path.join(container_dir('pids'), 'pids.current'), '3\n')
+    write(os.path.join(container_dir('blkio'), 'blkio.throttle.io_service_bytes_recursive'),
+          '8:0 Read 4096\n8:0 Write 512\n8:0 Sync 0\n8:0 Total 4608\nTotal 4608\n')
+
+
+@pytest.mark.parametrize('systemd', [True, False])
+def test_read_v2(tmp_path, systemd):
+    make_v2(str(tmp_path), systemd=systemd)
+    reader = CgroupReader(str(tmp_path))
+    reading = reader.read(CONTAINER_ID)
+
+    assert reader.version == 2
+    assert reading['memory'] == 1048576
+    assert np.isnan(reading['memory_limit'])
+    assert reading['cpu_usage'] == 1000 * 1000
+    assert reading['pids'] == 7
+    assert reading['blk_read'] == 1025
+    assert reading['blk_write'] == 2050
+    assert 'time' in reading
+
+
+@pytest.mark.parametrize('cpu_controller', ['cpu,cpuacct', 'cpuacct'])
+@pytest.mark.parametrize('systemd', [True, False])
+def test_read_v1(tmp_path, cpu_controller, systemd):
+    make_v1(str(tmp_path), cpu_controller=cpu_controller, systemd=systemd)
+    reader = CgroupReader(str(tmp_path))
+    reading = reader.read(CONTAINER_ID)
+
+    assert reader.version == 1
+    assert reading['memory'] == 2097152
+    assert reading['memory_limit'] == 4194304
+    assert reading['cpu_usage'] == 5000000
+    assert reading['pids'] == 3
+    assert reading['blk_read'] == 4096
+    assert reading['blk_write'] == 512
+
+
+def test_read_v1_without_optional_controllers(tmp_path):
+    make_v1(str(tmp_path))
+    for controller in ('pids', 'blkio'):
+        os.rename(os.path.join(str(tmp_path), controller), os.path.join(str(tmp_path), controller + '_gone'))
+
+    reading = CgroupReader(str(tmp_path)).read(CONTAINER_ID)
+    assert np.isnan(reading['pids'])
+    assert reading['blk_read'] == 0 and reading['blk_write'] == 0
+
+
+def test_missing_container(tmp_path):
+    make_v2(str(tmp_path))
+    with pytest.raises(IOError):
+        CgroupReader(str(tmp_path)).read('0' * 64)
+
+
+class FakeContainer(object):
+    container_id = CONTAINER_ID
+    job_id = 'job'
+    use_gpu = False
+
+
+def test_cpu_without_running_sampler(tmp_path):
+    path = make_v2(str(tmp_path), usage_usec=0)
+    sampler = TelemetrySampler(backend='cgroup', cgroup_root=str(tmp_path))
+
+    # the first reading has nothing to compare with
+    first = sampler.sample_container(FakeContainer())
+    assert np.isnan(first['cpu'])
+
+    # one core fully used in between
+    elapsed = 0.5
+    sampler.cpu_counters['job']['system'] -= elapsed * 1e9
+    write(os.path.join(path, 'cpu.stat'), 'usage_usec {}\n'.format(int(elapsed * 1e6)))
+    second = sampler.sample_container(FakeContainer())
+    assert 90 < second['cpu'] < 110
+
+
+def test_release_during_sample(tmp_path):
+    make_v2(str(tmp_path))
+    sampler = TelemetrySampler(backend='cgroup', cgroup_root=str(tmp_path))
+    running = [FakeContainer()]
+    sampler.containers_fn = lambda: running
+    sampler.sample()
+    assert 'job' in sampler.buffers
+
+    # the job finishes while its container is read
+    read = sampler.read
+
+    def read_and_release(container):
+        reading = read(container)
+        sampler.release(container.job_id)
+        return reading
+    sampler.read = read_and_release
+    sampler.sample()
+    assert 'job' not in sampler.buffers
+    assert 'job' not in sampler.totals
+    assert 'job' not in sampler.cpu_counters
+
+    # forgotten once the job has left the running containers
+    sampler.read = read
+    running.clear()
+    sampler.sample()
+    assert sampler.released == set()
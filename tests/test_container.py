@@ -0,0 +1,77 @@
+import pytest
+from docker.errors import APIError, NotFound
+
+from core import container as container_module
+from core.container import Container
+from core.containerconfig import ContainerConfig
+
+
+class FakeDockerContainer(object):
+
+    def __init__(self, status='running', exit_code=0):
+        self.name = 'happy_turing'
+        self.status = status
+        self.attrs = {'State': {'Status': status, 'ExitCode': exit_code, 'StartedAt': '2026-10-19T10:00:00Z',
+                                'FinishedAt': '0001-01-01T00:00:00Z'}, 'Created': '2026-10-19T10:00:00Z'}
+        self.error = None
+
+    def reload(self):
+        if self.error is not None:
+            raise self.error
+
+
+class UncachedStates(object):
+    # containers created before the job label are not in the state cache
+
+    def status(self, container_id):
+        return None
+
+    def attrs(self, container_id):
+        return None
+
+    def invalidate(self):
+        pass
+
+
+@pytest.fixture
+def job(monkeypatch):
+    monkeypatch.setattr(container_module, 'STATE_CACHE', UncachedStates())
+    config = ContainerConfig.from_dict({'name': 'train', 'executor_name': 'alice', 'num_gpus': 0})
+    job = Container(config, 'sha256:0')
+    job.container_id = 'abc'
+    job._container_obj = FakeDockerContainer()
+    return job
+
+
+def test_removed_container(job):
+    assert job.status == 'running'
+
+    job._container_obj.error = NotFound('no such container')
+    job.refresh()
+    assert job.status == 'removed'
+    assert job.exit_code is None
+    assert job.history_info()['status'] == 'removed'
+
+
+class FakeDockerClient(object):
+
+    def __init__(self):
+        self.containers = self
+
+    def get(self, container_id):
+        raise NotFound('no such container')
+
+
+def test_removed_before_inspected(job, monkeypatch):
+    monkeypatch.setattr(container_module, 'get_client', FakeDockerClient)
+    job._container_obj = None
+
+    assert job.status == 'removed'
+    assert job.history_info()['status'] == 'removed'
+
+
+def test_other_errors_keep_the_state(job):
+    job._container_obj.error = APIError('daemon busy')
+    job.refresh()
+    assert not job.removed
+    assert job.status == 'running'
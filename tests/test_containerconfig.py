@@ -0,0 +1,28 @@
+import pytest
+
+from core.containerconfig import ContainerConfig
+from image_collector import parse_size
+
+
+def config(required_memory):
+    return ContainerConfig.from_dict({'name': 'train', 'executor_name': 'alice', 'num_gpus': 0,
+                                      'required_memory': required_memory})
+
+
+@pytest.mark.parametrize('size, expected', [('512m', 512 * 1024 ** 2), ('1.5GiB', int(1.5 * 1024 ** 3)),
+                                            ('2gb', 2 * 1024 ** 3), ('256 MiB', 256 * 1024 ** 2), ('1024', 1024)])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize('required_memory, expected', [('512m', 512 * 1024 ** 2), ('1.5GiB', int(1.5 * 1024 ** 3)),
+                                                       ('32g', 32 * 1024 ** 3), (2, 2 * 1024 ** 3)])
+def test_required_memory_units(required_memory, expected):
+    container_config = config(required_memory)
+    assert container_config is not None
+    assert container_config.required_memory == required_memory
+    assert container_config.docker_params('image', True, [])['mem_limit'] == expected
+
+
+def test_invalid_required_memory():
+    assert config('lots') is None
@@ -0,0 +1,45 @@
+import errno
+import os
+
+import pytest
+
+from providerfuncs import fetch
+
+
+@pytest.fixture
+def submission(tmp_path):
+    share, local = tmp_path / 'share', tmp_path / 'local'
+    share.mkdir()
+    local.mkdir()
+    path = share / 'job.zip'
+    path.write_bytes(b'0' * 1024)
+    return str(path), str(local)
+
+
+def test_fetch(submission):
+    filename, local = submission
+    assert fetch.fetch(filename, local) == os.path.join(local, 'job.zip')
+    assert not os.path.exists(filename)
+
+
+def test_fetch_without_space(submission, monkeypatch):
+    filename, local = submission
+    monkeypatch.setattr(fetch, 'get_free_space', lambda path: (100, 0.0))
+    with pytest.raises(fetch.InsufficientSpaceError):
+        fetch.fetch(filename, local)
+    assert os.path.isfile(filename)
+
+
+def test_drive_fills_up_while_fetching(submission, monkeypatch):
+    filename, local = submission
+
+    def copy(source, target):
+        with open(target, 'wb') as file_h:
+            file_h.write(b'0' * 10)
+        raise OSError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(fetch.shutil, 'copy', copy)
+
+    with pytest.raises(fetch.InsufficientSpaceError):
+        fetch.fetch(filename, local)
+    assert os.path.isfile(filename)
+    assert os.listdir(local) == []
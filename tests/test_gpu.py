@@ -0,0 +1,175 @@
+import os
+
+import pytest
+
+from utils import gpu
+from utils.gpu import GPU_SAMPLER, FakeBackend, create_backend, get_gpu_infos, get_gpus_status
+from utils.gpuhealth import GPUHealth
+from utils.inventory import INVENTORY
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'fake_gpus.json')
+
+
+class FakeDockerContainer(object):
+
+    def __init__(self, visible_devices):
+        self.attrs = {'Config': {'Env': ['PATH=/usr/bin', 'NVIDIA_VISIBLE_DEVICES={}'.format(visible_devices)]}}
+
+
+class FakeDockerClient(object):
+
+    def __init__(self, *visible_devices):
+        self.containers = self
+        self._containers = [FakeDockerContainer(devices) for devices in visible_devices]
+
+    def list(self):
+        return self._containers
+
+
+@pytest.fixture
+def fake_gpus():
+    """
+    runs the shared gpu sampler on the fake backend of the fixture
+    """
+    old_backend, old_health = GPU_SAMPLER.backend, GPU_SAMPLER.health
+    GPU_SAMPLER.stop()
+    GPU_SAMPLER.set_backend(create_backend('fake', FIXTURE))
+    GPU_SAMPLER.health = None
+    INVENTORY.refresh()
+    yield GPU_SAMPLER.backend
+
+    GPU_SAMPLER.stop()
+    GPU_SAMPLER.set_backend(old_backend)
+    GPU_SAMPLER.health = old_health
+    INVENTORY.refreshed_at = None
+
+
+def test_fake_backend_replays_snapshots():
+    backend = FakeBackend(FIXTURE)
+    assert backend.minors() == [0, 1, 2]
+
+    first, second, third = backend.query(), backend.query(), backend.query()
+    assert first[1]['load'] == 0.5
+    assert second[1]['load'] == 0.9
+
+    # the last snapshot is repeated
+    assert third == second
+
+
+def test_fake_backend_single_snapshot():
+    backend = FakeBackend([{'id': 0, 'load': 0.1}, {'id': 3, 'load': 0.2}])
+    assert backend.minors() == [0, 3]
+    assert backend.query() == backend.query()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_backend('cuda')
+
+
+def test_inventory_and_infos(fake_gpus):
+    assert INVENTORY.gpus == [0, 1, 2]
+
+    GPU_SAMPLER.update()
+    infos = get_gpu_infos(['1'])
+    assert list(infos) == [1]
+    assert infos[1]['memoryUsed'] == 6144.0
+
+
+def test_infos_by_minor(fake_gpus):
+    # the index of the backend differs from the minor
+    GPU_SAMPLER.set_backend(FakeBackend([{'id': 0, 'minor': 3, 'load': 0.1, 'memoryUsed': 100.0},
+                                         {'id': 1, 'minor': 1, 'load': 0.2, 'memoryUsed': 200.0}]))
+    GPU_SAMPLER.update()
+    infos = get_gpu_infos(['3'])
+    assert list(infos) == [3]
+    assert infos[3]['memoryUsed'] == 100.0
+    assert sorted(get_gpu_infos()) == [1, 3]
+    assert get_gpu_infos(['0']) == {}
+
+
+def test_free_gpus(fake_gpus):
+    free, assigned = get_gpus_status(FakeDockerClient('1', 'none'))
+    assert free == [0, 2]
+    assert assigned == [1]
+
+    free, assigned = get_gpus_status(FakeDockerClient('all'))
+    assert free == []
+    assert sorted(assigned) == [0, 1, 2]
+
+
+def test_nvml_falls_back_without_pynvml(monkeypatch):
+    monkeypatch.setattr(gpu, 'pynvml', None)
+    assert create_backend('nvml').name == 'gputil'
+
+
+class FailingBackend(FakeBackend):
+
+    def query(self):
+        raise RuntimeError('nvml hiccup')
+
+
+def unhealthy_snapshots():
+    """
+    the snapshots of the fixture, minor 1 reports an uncorrected ecc error in the second one
+    """
+    first, second = FakeBackend(FIXTURE).snapshots
+    second = [dict(gpu_i) for gpu_i in second]
+    second[1]['ecc_errors'] = 1
+    return {'snapshots': [first, second]}
+
+
+def test_unhealthy_device_is_drained(fake_gpus, tmp_path):
+    GPU_SAMPLER.set_backend(FakeBackend(unhealthy_snapshots()))
+    GPU_SAMPLER.health = GPUHealth(str(tmp_path))
+
+    GPU_SAMPLER.update()
+    assert GPU_SAMPLER.health.drained == {}
+
+    GPU_SAMPLER.update()
+    assert list(GPU_SAMPLER.health.drained) == [1]
+    free, assigned = get_gpus_status(FakeDockerClient())
+    assert free == [0, 2]
+
+    # drained devices survive a restart until they are enabled again
+    assert GPUHealth(str(tmp_path)).is_drained(1)
+    assert GPU_SAMPLER.health.enable(1)
+    assert not GPUHealth(str(tmp_path)).is_drained(1)
+
+
+def test_failed_queries_do_not_drain(fake_gpus, tmp_path):
+    GPU_SAMPLER.set_backend(FailingBackend(FIXTURE))
+    GPU_SAMPLER.health = GPUHealth(str(tmp_path), query_failures=3)
+    for _ in range(5):
+        GPU_SAMPLER.update()
+    assert GPU_SAMPLER.health.drained == {}
+
+
+def test_missing_device_is_drained(fake_gpus, tmp_path):
+    first = FakeBackend(FIXTURE).snapshots[0]
+    GPU_SAMPLER.set_backend(FakeBackend([first[0], first[2]]))
+    GPU_SAMPLER.health = GPUHealth(str(tmp_path), query_failures=3)
+    for _ in range(3):
+        GPU_SAMPLER.update()
+    assert list(GPU_SAMPLER.health.drained) == [1]
+
+
+def test_job_failures(tmp_path):
+    health = GPUHealth(str(tmp_path), job_failures=3)
+
+    # the same job failing again and again and stopped jobs do not count
+    for _ in range(5):
+        health.record_job(['0'], 1, job=('alice', 'train'))
+        health.record_job(['0'], 137, job=('bob', 'train'))
+    health.record_job(['0'], 1, job=('bob', 'train'))
+    assert health.drained == {}
+
+    # a successful job resets the count
+    health.record_job(['0'], 0, job=('carol', 'eval'))
+    for user in ('alice', 'bob'):
+        health.record_job(['0', 'none'], 1, job=(user, 'train'))
+    assert health.drained == {}
+
+    health.record_job(['0'], 1, job=('carol', 'eval'))
+    assert list(health.drained) == [0]
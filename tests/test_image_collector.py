@@ -0,0 +1,52 @@
+import image_collector
+from core.statecache import JOB_LABEL
+from image_collector import ImageCollector
+
+
+MB = 1024 ** 2
+
+
+class FakeImages(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def prune(self, filters):
+        return {'SpaceReclaimed': 0}
+
+    def remove(self, image_id):
+        self.client.removed.append(image_id)
+        self.client.images_df = [image for image in self.client.images_df if image['Id'] != image_id]
+
+
+class FakeClient(object):
+
+    def __init__(self, images_df):
+        self.images_df = images_df
+        self.removed = []
+        self.images = FakeImages(self)
+
+    def df(self):
+        return {'LayersSize': sum(image['Size'] for image in self.images_df), 'Images': self.images_df}
+
+
+def image(image_id, labels=None, containers=0):
+    return {'Id': image_id, 'ParentId': '', 'Size': 100 * MB, 'SharedSize': 0, 'Containers': containers,
+            'Labels': labels}
+
+
+def test_evicts_unused_images_of_the_queue(monkeypatch):
+    client = FakeClient([image('old', {JOB_LABEL: ''}),  # job dropped out of the history
+                         image('finished'),  # built before the label was introduced
+                         image('recent', {JOB_LABEL: 'b2'}),
+                         image('running', {JOB_LABEL: 'c3'}),
+                         image('user')])  # not built by the queue
+    monkeypatch.setattr(image_collector, 'get_client', lambda: client)
+    job_images = {'queued': [], 'running': ['running'], 'finished': ['recent', 'finished']}
+    collector = ImageCollector({'disk_budget': '150m', 'interval': 600}, lambda: job_images)
+
+    # the image of a job that finished just now is the most recently used
+    collector.touch('finished')
+    collector.touch('recent')
+    collector.collect()
+    assert client.removed == ['old', 'finished', 'recent']
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from utils.interface import PageFetcher
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_pages_are_read_in_the_background():
+    release = threading.Event()
+    calls = []
+
+    def fetch(offset, count):
+        calls.append((offset, count))
+        release.wait(5)
+        return list(range(offset, offset + count))
+
+    pages = PageFetcher(fetch, max_age=60)
+
+    # the caller is not blocked by a slow read
+    started = time.time()
+    assert pages.get(40, 3) is None
+    assert time.time() - started < 1
+
+    release.set()
+    assert wait_for(lambda: pages.get(40, 3) == [40, 41, 42])
+    assert calls == [(40, 3)]
+
+
+def test_outdated_pages_are_shown_while_read_again():
+    values = [['old'], ['new']]
+    pages = PageFetcher(lambda offset, count: values.pop(0), max_age=0)
+    pages.get(0, 1)
+    assert wait_for(lambda: pages.pages.get((0, 1), (0, None))[1] == ['old'])
+
+    assert pages.get(0, 1) == ['old']
+    assert wait_for(lambda: pages.pages[(0, 1)][1] == ['new'])
@@ -0,0 +1,62 @@
+import os
+
+import log_collector
+from log_collector import LogCollector
+
+
+class FakeAPI(object):
+
+    def __init__(self, streams, states):
+        self.streams = list(streams)
+        self.states = list(states)
+        self.since = []
+
+    def logs(self, container_id, stream, follow, timestamps, since):
+        self.since.append(since)
+        return iter(self.streams.pop(0))
+
+    def inspect_container(self, container_id):
+        return {'State': {'Running': self.states.pop(0)}}
+
+
+class FakeClient(object):
+
+    def __init__(self, api):
+        self.api = api
+
+
+def line(second, text):
+    return '2026-10-19T10:00:{:02d}.000000000Z {}\n'.format(second, text).encode('utf-8')
+
+
+def test_stream_ends_while_running(tmp_path, monkeypatch):
+    # the stream ends on a daemon restart, the resumed stream repeats the lines of the last second
+    api = FakeAPI([[line(1, 'first'), line(2, 'second')[:20]],
+                   [line(2, 'second'), line(3, 'third')]], states=[True, False])
+    monkeypatch.setattr(log_collector, 'get_client', lambda: FakeClient(api))
+
+    finished = []
+    collector = LogCollector(str(tmp_path), archive=False, retry_delay=0)
+    collector.finished_callbacks.append(lambda job_id, path: finished.append(job_id))
+    collector.follow_id('abc', 'job', 'alice', 'train').result(timeout=10)
+
+    path = collector.log_path('alice', 'train', 'job')
+    with open(path, 'rb') as file_h:
+        text = file_h.read()
+    assert text.count(b'first') == 1 and text.count(b'second') == 1 and text.count(b'third') == 1
+    assert api.since[1] is not None
+    assert finished == ['job']
+    assert 'job' not in collector.positions
+
+
+def test_archive_once_exited(tmp_path, monkeypatch):
+    api = FakeAPI([[line(1, 'first')], [line(2, 'second')]], states=[True, False])
+    monkeypatch.setattr(log_collector, 'get_client', lambda: FakeClient(api))
+
+    collector = LogCollector(str(tmp_path), retry_delay=0)
+    collector.follow_id('abc', 'job', 'alice', 'train').result(timeout=10)
+
+    path = collector.log_path('alice', 'train', 'job')
+    assert not os.path.exists(path)
+    assert [name for name in os.listdir(os.path.dirname(path)) if name.startswith(os.path.basename(path))]
+    assert api.streams == [] and api.states == []
@@ -0,0 +1,38 @@
+from utils.logview import LogView
+
+
+def write_log(tmp_path, n_lines):
+    path = tmp_path / 'container.log'
+    path.write_bytes(b''.join('line {}\n'.format(index).encode('utf-8') for index in range(n_lines)))
+    return str(path)
+
+
+def test_find_indexed(tmp_path):
+    view = LogView(write_log(tmp_path, 1000), chunk_size=256)
+    view.index_all()
+    assert view.line_count == 1000
+    assert view.find('line 500') == 500
+    assert view.find('line 500', start_line=501) is None
+    assert view.find('line 50', start_line=600, backwards=True) == 509
+    assert view.lines(998, 5) == [b'line 998', b'line 999']
+    view.close()
+
+
+def test_find_before_indexing(tmp_path):
+    view = LogView(write_log(tmp_path, 100000), chunk_size=256)
+    assert view.line_count == 0
+    assert view.find('line 99999') == 99999
+    assert view.find('line 7', start_line=70000) == 70000
+    assert view.find('line 42', start_line=50000, backwards=True) == 42999
+    assert view.find('line 1', start_line=100000) is None
+    view.close()
+
+
+def test_find_while_indexing(tmp_path):
+    view = LogView(write_log(tmp_path, 100000), chunk_size=256)
+    for _ in range(4):
+        view.index_chunk()
+    assert 0 < view.line_count < 1000
+    assert view.find('line 5', start_line=view.line_count) == 500
+    assert view.find('line 99999', start_line=99999) == 99999
+    view.close()
@@ -0,0 +1,49 @@
+import pytest
+
+from utils.snapshot import SnapshotPublisher, apply_diff, event_id, parse_event_id
+
+
+def build_fn(n_enqueued):
+    def build():
+        return {'status': {'queue status': 'running'}, 'running': [], 'history': [], 'n_history': 0, 'users': [],
+                'enqueued': [{'job_id': str(index)} for index in range(n_enqueued[0])], 'n_enqueued': n_enqueued[0]}
+    return build
+
+
+def test_event_ids():
+    assert parse_event_id(event_id('18f3a2b1c00', 42)) == ('18f3a2b1c00', 42)
+    for value in ('42', 'run-', '-1'):
+        with pytest.raises(ValueError):
+            parse_event_id(value)
+
+
+def test_diffs_since():
+    n_enqueued = [1]
+    publisher = SnapshotPublisher(build_fn(n_enqueued))
+    first = publisher.publish()
+    n_enqueued[0] = 3
+    publisher.publish()
+    publisher.publish()
+
+    diffs = publisher.diffs_since(first.seq, first.run)
+    assert [diff['seq'] for diff in diffs] == [2, 3]
+    snapshot = first
+    for diff in diffs:
+        snapshot = apply_diff(snapshot, diff)
+    assert snapshot == publisher.snapshot._replace(time=snapshot.time)
+    assert publisher.diffs_since(3, first.run) == []
+
+
+def test_diffs_of_an_earlier_run():
+    n_enqueued = [1]
+    publisher = SnapshotPublisher(build_fn(n_enqueued))
+    for _ in range(3):
+        publisher.publish()
+
+    # the queue restarted, seq numbers start over
+    restarted = SnapshotPublisher(build_fn(n_enqueued))
+    restarted.run_id = publisher.run_id + '0'
+    for _ in range(5):
+        restarted.publish()
+    assert restarted.diffs_since(3, publisher.run_id) is None
+    assert restarted.diffs_since(5, publisher.run_id) is None
@@ -0,0 +1,49 @@
+import getpass
+import socket
+
+import pytest
+
+from api import peer_user
+from submitter import SubmissionError, Submitter
+
+
+CONFIG = {'paths': {}, 'fetcher': {'executors': ['alice', 'bob']}, 'docker': {}}
+
+
+class FakeWriter(object):
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def get_extra_info(self, name):
+        return self.sock if name == 'socket' else None
+
+
+def config_dict(executor_name):
+    return {'name': 'train', 'executor_name': executor_name, 'num_gpus': 0}
+
+
+def test_validate_user():
+    submitter = Submitter(CONFIG, channel=None)
+    assert submitter.validate(config_dict('alice'), 'alice').executor_name == 'alice'
+    assert submitter.validate(config_dict('alice'), 'root').executor_name == 'alice'
+
+    with pytest.raises(SubmissionError):
+        submitter.validate(config_dict('alice'), 'bob')
+    with pytest.raises(SubmissionError):
+        submitter.validate(config_dict('carol'), 'carol')
+
+
+def test_peer_user():
+    left, right = socket.socketpair(socket.AF_UNIX)
+    try:
+        assert peer_user(FakeWriter(left)) == getpass.getuser()
+    finally:
+        left.close()
+        right.close()
+
+    tcp = socket.socket(socket.AF_INET)
+    try:
+        assert peer_user(FakeWriter(tcp)) is None
+    finally:
+        tcp.close()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+accounting.py
+
+Records what finished jobs actually used and derives right-sizing recommendations from the history
+"""
+
+import math
+
+import numpy as np
+
+from image_collector import parse_size
+
+
+# telemetry fields that are accounted per job
+USAGE_FIELDS = ('memory', 'cpu', 'gpu_util', 'gpu_memory')
+
+# gpu utilization (%) below which a gpu is considered unused
+GPU_IDLE_UTIL = 5.0
+
+
+def job_usage(aggregates):
+    """
+    extracts the accounted values of a finished job from the telemetry aggregates
+    :param aggregates: dict as returned by TelemetrySampler.aggregate
+    :return: dict with 'peak_<field>' and 'mean_<field>' for every field in USAGE_FIELDS, None if there are no samples
+    """
+    if aggregates is None:
+        return None
+
+    usage = {}
+    for field in USAGE_FIELDS:
+        usage['peak_' + field] = aggregates[field]['max']
+        usage['mean_' + field] = aggregates[field]['mean']
+    return usage
+
+
+def nanmax(values):
+    """
+    :return: maximum of the values ignoring nan, nan if all values are nan
+    """
+    values = np.asarray(values, dtype=float)
+    return np.nan if np.all(np.isnan(values)) else float(np.nanmax(values))
+
+
+def memory_bytes(required_memory):
+    """
+    converts the memory requested in a container config to bytes. numbers without unit are GB (as for the mem_limit
+    of the container), values with unit are parsed like the sizes in the config.ini (e.g. '32g' or '512m')
+    :param required_memory: requested memory as given in the container config
+    :return: bytes, nan if the value can not be parsed (history entries from before the validation of the configs)
+    """
+    size = str(required_memory).strip().lower()
+    try:
+        if size[-1:].isdigit():
+            return int(float(size) * 1024 ** 3)
+        return parse_size(size)
+    except ValueError:
+        return np.nan
+
+
+def recommendations(history, headroom=1.25, min_jobs=1):
+    """
+    compares requested and used resources of the finished jobs per user and job name
+    :param history: list of finished Container objects, most recent first
+    :param headroom: factor applied to the peak memory of all jobs for the recommended memory
+    :param min_jobs: minimum number of accounted jobs for a recommendation
+    :return: dict mapping (user, job name) to a dict with the requested and used resources and the recommendations
+    """
+
+    # group the accounted jobs
+    groups = {}
+    for container in history:
+        if not container.usage or np.isnan(container.usage['peak_memory']):
+            continue
+        groups.setdefault((container.user, container.name), []).append(container)
+
+    result = {}
+    for key, containers in groups.items():
+        if len(containers) < min_jobs:
+            continue
+
+        # the most recent job represents the current request
+        config = containers[0].config
+        peak_memory = max(container.usage['peak_memory'] for container in containers)
+        mean_memory = float(np.mean([container.usage['mean_memory'] for container in containers]))
+        requested_memory = memory_bytes(config.required_memory)
+        recommended_memory = max(1, int(math.ceil(peak_memory * headroom / 1024 ** 3)))
+
+        peak_gpu_util = nanmax([container.usage['peak_gpu_util'] for container in containers])
+        gpu_idle = config.num_gpus > 0 and not np.isnan(peak_gpu_util) and peak_gpu_util < GPU_IDLE_UTIL
+
+        result[key] = {'jobs': len(containers),
+                       'requested_memory': requested_memory,
+                       'peak_memory': peak_memory,
+                       'mean_memory': mean_memory,
+                       'recommended_memory': '{}g'.format(recommended_memory),
+                       'memory_savings': (max(0, requested_memory - recommended_memory * 1024 ** 3)
+                                          if not np.isnan(requested_memory) else np.nan),
+                       'peak_cpu': nanmax([container.usage['peak_cpu'] for container in containers]),
+                       'num_gpus': config.num_gpus,
+                       'peak_gpu_util': peak_gpu_util,
+                       'recommended_gpus': 0 if gpu_idle else config.num_gpus}
+
+    return result
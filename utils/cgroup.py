@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+cgroup.py
+
+Reads resource counters of docker containers directly from the cgroup filesystem (v1 and v2), which is much cheaper
+than the stats endpoint of the docker daemon.
+"""
+
+import os
+import time
+
+import numpy as np
+
+
+class CgroupReader(object):
+
+    def __init__(self, root='/sys/fs/cgroup'):
+        """
+        reader for the cgroup counters of docker containers
+        :param root: mount point of the cgroup filesystem
+        """
+        self.root = root
+        self.version = 2 if os.path.isfile(os.path.join(root, 'cgroup.controllers')) else 1
+        self._paths = {}
+
+    def candidates(self, container_id, controller=None):
+        """
+        possible cgroup directories of a container for the cgroupfs and the systemd cgroup driver
+        :param container_id: full id of the docker container
+        :param controller: name of the controller directory (only cgroup v1)
+        :return: list of directories
+        """
+        base = self.root if controller is None else os.path.join(self.root, controller)
+        return [os.path.join(base, 'system.slice', 'docker-{}.scope'.format(container_id)),
+                os.path.join(base, 'docker', container_id)]
+
+    def path(self, container_id, controller=None):
+        """
+        finds the cgroup directory of a container
+        :param container_id: full id of the docker container
+        :param controller: name of the controller directory (only cgroup v1), alternatives can be given as tuple
+        :return: directory of the container
+        :raises IOError: if the container has no cgroup (e.g. because it is not running)
+        """
+        key = (container_id, controller)
+        cached = self._paths.get(key)
+        if cached is not None and os.path.isdir(cached):
+            return cached
+
+        controllers = controller if isinstance(controller, tuple) else (controller,)
+        for controller_i in controllers:
+            for candidate in self.candidates(container_id, controller_i):
+                if os.path.isdir(candidate):
+                    self._paths[key] = candidate
+                    return candidate
+
+        raise IOError('no cgroup found for container {}'.format(container_id))
+
+    @staticmethod
+    def read_value(file_path):
+        """
+        reads a single value file, 'max' (no limit) is returned as nan
+        """
+        with open(file_path, 'r') as file_h:
+            value = file_h.read().strip()
+        return np.nan if value == 'max' else int(value)
+
+    @staticmethod
+    def read_keyed(file_path):
+        """
+        reads a flat keyed file like cpu.stat or memory.stat
+        """
+        values = {}
+        with open(file_path, 'r') as file_h:
+            for line in file_h:
+                parts = line.split()
+                if len(parts) == 2:
+                    values[parts[0]] = int(parts[1])
+        return values
+
+    def read(self, container_id):
+        """
+        reads memory, cpu, pids and block io counters of a container
+        :param container_id: full id of the docker container
+        :return: dict with 'time' (s), 'memory', 'memory_limit', 'blk_read', 'blk_write' (bytes), 'cpu_usage' (ns)
+                 and 'pids'
+        :raises IOError: if the counters of the container can not be read
+        """
+        if self.version == 2:
+            reading = self.read_v2(container_id)
+        else:
+            reading = self.read_v1(container_id)
+        reading['time'] = time.time()
+        return reading
+
+    def read_v2(self, container_id):
+        path = self.path(container_id)
+
+        blk_read, blk_write = 0, 0
+        if os.path.isfile(os.path.join(path, 'io.stat')):
+            with open(os.path.join(path, 'io.stat'), 'r') as file_h:
+                for line in file_h:
+                    # e.g. 8:0 rbytes=1024 wbytes=2048 rios=1 wios=2 dbytes=0 dios=0
+                    fields = dict(field.split('=') for field in line.split()[1:] if '=' in field)
+                    blk_read += int(fields.get('rbytes', 0))
+                    blk_write += int(fields.get('wbytes', 0))
+
+        pids_file = os.path.join(path, 'pids.current')
+        return {'memory': self.read_value(os.path.join(path, 'memory.current')),
+                'memory_limit': self.read_value(os.path.join(path, 'memory.max')),
+                'cpu_usage': self.read_keyed(os.path.join(path, 'cpu.stat'))['usage_usec'] * 1000,
+                'pids': self.read_value(pids_file) if os.path.isfile(pids_file) else np.nan,
+                'blk_read': blk_read,
+                'blk_write': blk_write}
+
+    def read_v1(self, container_id):
+        memory_path = self.path(container_id, 'memory')
+        cpu_path = self.path(container_id, ('cpuacct', 'cpu,cpuacct'))
+
+        try:
+            pids = self.read_value(os.path.join(self.path(container_id, 'pids'), 'pids.current'))
+        except IOError:
+            pids = np.nan
+
+        blk_read, blk_write = 0, 0
+        try:
+            blkio_path = self.path(container_id, 'blkio')
+        except IOError:
+            blkio_path = None
+        if blkio_path is not None:
+            for file_name in ('blkio.throttle.io_service_bytes_recursive', 'blkio.io_service_bytes_recursive'):
+                file_path = os.path.join(blkio_path, file_name)
+                if not os.path.isfile(file_path):
+                    continue
+                with open(file_path, 'r') as file_h:
+                    for line in file_h:
+                        # e.g. 8:0 Read 1024
+                        parts = line.split()
+                        if len(parts) == 3 and parts[1] == 'Read':
+                            blk_read += int(parts[2])
+                        elif len(parts) == 3 and parts[1] == 'Write':
+                            blk_write += int(parts[2])
+                break
+
+        return {'memory': self.read_value(os.path.join(memory_path, 'memory.usage_in_bytes')),
+                'memory_limit': self.read_value(os.path.join(memory_path, 'memory.limit_in_bytes')),
+                'cpu_usage': self.read_value(os.path.join(cpu_path, 'cpuacct.usage')),
+                'pids': pids,
+                'blk_read': blk_read,
+                'blk_write': blk_write}
@@ -1,3 +1,4 @@
+import numpy as np
 import psutil
 import time
 
@@ -35,3 +36,28 @@ class CPU(object):
 
     def cpu_percent(self):
         return CPU.instance.cpu_percent()
+
+
+def container_cpu_percent(usage, prev_usage, system, prev_system, online_cpus):
+    """
+    computes the cpu usage of containers from two successive readings of their cgroup cpu counters, vectorized over
+    all containers. follows the convention of docker stats, i.e. 100% corresponds to one fully used core
+    :param usage: total cpu time used by each container (e.g. cpu_stats.cpu_usage.total_usage in ns)
+    :param prev_usage: cpu time used by each container at the previous reading
+    :param system: host cpu time summed over all cores (e.g. cpu_stats.system_cpu_usage in ns) at the current reading
+    :param prev_system: host cpu time at the previous reading
+    :param online_cpus: number of cores available to each container
+    :return: numpy array with the cpu usage percentage of each container, nan where no valid delta is available
+    """
+    usage, prev_usage = np.asarray(usage, dtype=float), np.asarray(prev_usage, dtype=float)
+    system, prev_system = np.asarray(system, dtype=float), np.asarray(prev_system, dtype=float)
+
+    usage_delta = usage - prev_usage
+    system_delta = system - prev_system
+
+    # counters are reset when a container restarts
+    valid = (system_delta > 0) & (usage_delta >= 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = usage_delta / system_delta * np.asarray(online_cpus, dtype=float) * 100.0
+
+    return np.where(valid, percent, np.nan)
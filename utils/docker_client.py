@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+docker_client.py
+
+Provides a shared docker API client, so that the connection pool of the client is reused instead of creating a new
+client (and connection) for every request.
+"""
+
+import os
+import threading
+
+import docker
+
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the docker client of the current process. Processes started by fork get their own client, since the
+    connections of the parent can not be shared.
+
+    :return: docker.DockerClient instance
+    """
+    global _client, _client_pid
+
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = docker.from_env()
+            _client_pid = os.getpid()
+
+    return _client
@@ -6,68 +6,343 @@ gpu.py
 Helpers for GPU information retrieval
 """
 
+import json
 import os
 import re
-import docker
 import GPUtil
 import time
 import threading
+import traceback
 
+from utils import log
+from utils.docker_client import get_client
+from utils.inventory import INVENTORY
 
-class GPU(object):
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+LOG = log.get_module_log(__name__)
 
-    @classmethod
-    def stop_hardware_monitor(cls):
-        if cls.instance is None:
-            pass
-        elif cls.instance.thread.isAlive():
-            cls.instance.thread._Thread__stop()
 
-    class __GPU(object):
+def list_device_minors(dev_dir='/dev'):
+    """
+    Lists the minors of the GPU device nodes (/dev/nvidia0, /dev/nvidia1, ..., but not /dev/nvidiactl etc.)
+    :param dev_dir: Directory of the device nodes.
+    :return: Sorted list of minors.
+    """
+    minors = []
+    for dev in os.listdir(dev_dir):
+        match_dt = re.match(r'^nvidia(\d+)$', dev)
+        if match_dt is not None:
+            minors.append(int(match_dt.group(1)))
+    return sorted(minors)
+
 
-        def __init__(self):
-            self.stats = 0
-            self._stats = 0
-            self.thread = threading.Thread(target=self.update_stats)
+class GPUtilBackend(object):
+    """
+    Queries the GPUs with GPUtil (which runs nvidia-smi).
+    """
 
-        def update_stats(self):
-            while True:
-                self.stats = GPUtil.getGPUs()
+    name = 'gputil'
 
-        def gpu_stats(self):
+    def query(self):
+        """
+        :return: list of dicts with the GPUtil attributes of every GPU ('id', 'load', 'memoryUsed', 'memoryTotal', ...)
+        """
+        return [dict(gpu_i.__dict__) for gpu_i in GPUtil.getGPUs()]
 
-            if not self.thread.isAlive():
-                self.thread = threading.Thread(target=self.update_stats)
-                self.thread.start()
+    def minors(self):
+        """
+        :return: minors of the GPUs on the system
+        """
+        return list_device_minors()
 
-            while self.stats == 0:
-                time.sleep(0.1)
 
-            return self.stats
+class NVMLBackend(object):
+    """
+    Queries the GPUs in-process through NVML (requires pynvml), which is much faster than running nvidia-smi.
+    """
 
-    instance = None
+    name = 'nvml'
 
     def __init__(self):
+        if pynvml is None:
+            raise ImportError('pynvml is required for the nvml gpu backend')
+        pynvml.nvmlInit()
+
+    @staticmethod
+    def _str(value):
+        # older versions of pynvml return bytes
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def query(self):
+        """
+        :return: list of dicts with the same keys as the GPUtil backend plus 'minor', 'power' (W), 'pids' and the
+                 health counters
+        """
+        gpus = []
+        for index in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            utilization = pynvml.nvmlDeviceGetUtilizationRates(handle)
+
+            # not every device supports power readings
+            try:
+                power = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000.0
+            except pynvml.NVMLError:
+                power = float('nan')
+
+            processes = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+            gpu_i = {'id': index,
+                     'minor': pynvml.nvmlDeviceGetMinorNumber(handle),
+                     'uuid': self._str(pynvml.nvmlDeviceGetUUID(handle)),
+                     'name': self._str(pynvml.nvmlDeviceGetName(handle)),
+                     'load': utilization.gpu / 100.0,
+                     'memoryUtil': float(memory.used) / memory.total if memory.total else 0.0,
+                     'memoryTotal': memory.total / 1024.0 ** 2,
+                     'memoryUsed': memory.used / 1024.0 ** 2,
+                     'memoryFree': memory.free / 1024.0 ** 2,
+                     'temperature': pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU),
+                     'power': power,
+                     'pids': [process.pid for process in processes]}
+            gpu_i.update(self.health(handle))
+            gpus.append(gpu_i)
+        return gpus
+
+    @staticmethod
+    def health(handle):
+        """
+        reads the health counters of a device, counters that are not supported by the device are None
+        :param handle: NVML device handle
+        :return: dict with 'ecc_errors' (uncorrected, since the driver was loaded), 'retired_pages' and
+                 'retired_pages_pending'
+        """
+        health = {'ecc_errors': None, 'retired_pages': None, 'retired_pages_pending': None}
+        try:
+            health['ecc_errors'] = pynvml.nvmlDeviceGetTotalEccErrors(handle, pynvml.NVML_MEMORY_ERROR_TYPE_UNCORRECTED,
+                                                                      pynvml.NVML_VOLATILE_ECC)
+        except pynvml.NVMLError:
+            pass
+        try:
+            health['retired_pages'] = len(pynvml.nvmlDeviceGetRetiredPages(
+                handle, pynvml.NVML_PAGE_RETIREMENT_CAUSE_DOUBLE_BIT_ECC_ERROR))
+            health['retired_pages_pending'] = bool(pynvml.nvmlDeviceGetRetiredPagesPendingStatus(handle))
+        except pynvml.NVMLError:
+            pass
+        return health
+
+    def minors(self):
+        """
+        :return: minors of the GPUs on the system
+        """
+        return sorted(pynvml.nvmlDeviceGetMinorNumber(pynvml.nvmlDeviceGetHandleByIndex(index))
+                      for index in range(pynvml.nvmlDeviceGetCount()))
+
+    def close(self):
+        pynvml.nvmlShutdown()
+
+
+class FakeBackend(object):
+    """
+    Deterministic backend driven by a fixture, for machines without GPUs. The fixture is either a list of GPU dicts
+    (returned by every query) or a dict with a list of 'snapshots', which are returned one per query (the last one
+    is repeated).
+    """
+
+    name = 'fake'
 
-        if GPU.instance is None:
-            GPU.instance = GPU.__GPU()
+    def __init__(self, fixture):
+        """
+        :param fixture: path of a json file or the already loaded fixture
+        """
+        if isinstance(fixture, str):
+            with open(fixture, 'r') as file_h:
+                fixture = json.load(file_h)
+        self.snapshots = fixture['snapshots'] if isinstance(fixture, dict) else [fixture]
+        self.index = 0
+
+    def query(self):
+        snapshot = self.snapshots[min(self.index, len(self.snapshots) - 1)]
+        self.index += 1
+        return [dict(gpu_i) for gpu_i in snapshot]
+
+    def minors(self):
+        return sorted(int(gpu_i.get('minor', gpu_i['id'])) for gpu_i in self.snapshots[0])
+
+
+BACKENDS = {'gputil': GPUtilBackend, 'nvml': NVMLBackend, 'fake': FakeBackend}
+
+
+def create_backend(name='gputil', fixture=''):
+    """
+    Creates a GPU backend, falls back to GPUtil if NVML is not available.
+
+    :param name: One of BACKENDS.
+    :param fixture: Fixture of the fake backend.
+    :return: Backend instance.
+    """
+    if name not in BACKENDS:
+        raise ValueError("unknown gpu backend '{}', use one of {}".format(name, sorted(BACKENDS)))
+
+    if name == 'fake':
+        return FakeBackend(fixture)
+
+    if name == 'nvml':
+        try:
+            return NVMLBackend()
+        except Exception as e:
+            LOG.warning('nvml gpu backend not available ({}), using gputil'.format(e))
+
+    return GPUtilBackend()
+
+
+class GPUSampler(object):
+
+    def __init__(self, backend=None, interval=2):
+        """
+        background thread that queries the GPUs at a fixed interval and keeps the latest snapshot, so that readers
+        never wait for the (slow) query itself
+        :param backend: object with a query() method returning a list of GPU dicts, GPUtil if None
+        :param interval: seconds between two queries
+        """
+        self.backend = backend if backend is not None else GPUtilBackend()
+        self.interval = interval
+        self.snapshot = None
+        self.timestamp = 0
+        self.health = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._stopped = False
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def set_backend(self, backend):
+        """
+        replaces the backend, the snapshot of the old backend is discarded
+        :param backend: backend used for the next queries
+        :return: None
+        """
+        old_backend, self.backend = self.backend, backend
+        with self._lock:
+            self.snapshot = None
+        self._ready.clear()
+        if old_backend is not backend and hasattr(old_backend, 'close'):
+            old_backend.close()
+
+    def start(self, interval=None, backend=None):
+        """
+        starts sampling, does nothing if the sampler is already running
+        :param interval: seconds between two queries
+        :param backend: backend used for the queries
+        :return: None
+        """
+        self.interval = interval if interval is not None else self.interval
+        if backend is not None and backend is not self.backend:
+            self.set_backend(backend)
+        self._stopped = False
+        if self.running:
+            return
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-GPU')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._stop_event.set()
+        if self.running:
+            self.thread.join()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.update()
+            self._stop_event.wait(self.interval)
+
+    def update(self):
+        """
+        queries the backend once and replaces the snapshot
+        :return: None
+        """
+        gpus = None
+        try:
+            gpus = self.backend.query()
+        except Exception:
+            LOG.error(traceback.format_exc())
+        else:
+            with self._lock:
+                self.snapshot = gpus
+                self.timestamp = time.time()
+        finally:
+            self._ready.set()
+
+        # a failed query is passed as None, only devices missing from a successful query count as not answering
+        if self.health is not None:
+            try:
+                self.health.check(gpus, get_system_gpus())
+            except Exception:
+                LOG.error(traceback.format_exc())
+
+    def gpu_stats(self, timeout=10):
+        """
+        provides the latest snapshot, the sampler is started on first use
+        :param timeout: seconds to wait for the first snapshot
+        :return: list of GPU dicts, empty if the GPUs could not be queried
+        """
+        if not self.running:
+            if self._stopped:
+                # do not restart the thread during shutdown, query directly instead
+                if self.snapshot is None:
+                    self.update()
+            else:
+                self.start()
+
+        self._ready.wait(timeout)
+        with self._lock:
+            return list(self.snapshot) if self.snapshot is not None else []
+
+
+GPU_SAMPLER = GPUSampler()
+
+# the inventory enumerates the gpus with the backend of the sampler
+INVENTORY.gpu_source = lambda: GPU_SAMPLER.backend.minors()
+
+
+class GPU(object):
+    """
+    Compatibility wrapper around the shared GPU_SAMPLER.
+    """
+
+    @classmethod
+    def stop_hardware_monitor(cls):
+        GPU_SAMPLER.stop()
 
     def gpu_stats(self):
-        return GPU.instance.gpu_stats()
+        return GPU_SAMPLER.gpu_stats()
 
 
 def get_system_gpus():
     """
-    Returns the GPU minors available on the system
+    Returns the GPU minors available on the system, as enumerated by the hardware inventory
     :return: GPU minors available on the system
     """
-    minors = []
-    for dev in os.listdir("/dev"):
-        match_dt = re.search(r'nvidia(\d+)', dev)
-        if match_dt is not None:
-            minor = int(match_dt.group(1))
-            minors.append(minor)
-    return minors
+    return INVENTORY.gpus
+
+
+def get_drained_gpus():
+    """
+    Returns the GPU minors that have been taken out of service by the health monitor
+    :return: Set of GPU minors
+    """
+    if GPU_SAMPLER.health is None:
+        return set()
+    return set(GPU_SAMPLER.health.drained)
 
 
 def get_assigned_gpus(client=None):
@@ -82,7 +357,7 @@ def get_assigned_gpus(client=None):
     if client is None:
 
         # get a client
-        client = docker.from_env()
+        client = get_client()
 
     # get system minors
     minors = get_system_gpus()
@@ -122,13 +397,14 @@ def get_gpus_status(client=None):
     """
 
     assigned_gpus = get_assigned_gpus(client)
+    drained_gpus = get_drained_gpus()
     free_gpus = []
 
-    # remove all assigned
+    # remove all assigned and drained
     for gpu_minor in get_system_gpus():
 
-        # only add unassigend ones
-        if gpu_minor not in assigned_gpus:
+        # only add unassigend and healthy ones
+        if gpu_minor not in assigned_gpus and gpu_minor not in drained_gpus:
             free_gpus.append(gpu_minor)
 
     return free_gpus, assigned_gpus
@@ -139,25 +415,22 @@ def get_gpu_infos(device_ids=None, interval=2):
     Provides a dictionary mapping each GPU minor (or requested) to all relevant information.
 
     :param device_ids: List or single GPU minor to include or None if all shall be shown.
-    :param interval: integer representing the seconds that GPU waits before fetching the data again
+    :param interval: unused, the query interval is set by GPU_SAMPLER
     :return: Dictionary mapping each GPU minor to its information.
     """
 
-    # cast to set if int
+    # cast to a set of strings
     if isinstance(device_ids, int):
-        device_ids = {device_ids}
-    elif isinstance(device_ids, str) or isinstance(device_ids, str):
-        if device_ids == 'all':
-            device_ids = None
-    elif isinstance(device_ids, list) and (isinstance(device_ids[0], str) or isinstance(device_ids[0], str)):
-        if device_ids == ['all']:
-            device_ids = None
-
-    gpu = GPU()
-    gpu_list = gpu.gpu_stats()
-    if device_ids is None:
-        gpu_dict = dict([(gpu_i.id, gpu_i.__dict__) for gpu_i in gpu_list])
-    else:
-        gpu_dict = dict([(gpu_i.id, gpu_i.__dict__) for gpu_i in gpu_list if str(gpu_i.id) in device_ids])
+        device_ids = {str(device_ids)}
+    elif isinstance(device_ids, str):
+        device_ids = None if device_ids == 'all' else {device_ids}
+    elif device_ids is not None:
+        device_ids = None if list(device_ids) == ['all'] else {str(device_id) for device_id in device_ids}
+
+    # 'id' is the index of the backend, which differs from the minor on some systems
+    gpu_list = GPU_SAMPLER.gpu_stats()
+    gpu_dict = dict([(int(gpu_i.get('minor', gpu_i['id'])), gpu_i) for gpu_i in gpu_list])
+    if device_ids is not None:
+        gpu_dict = dict([(minor, gpu_i) for minor, gpu_i in gpu_dict.items() if str(minor) in device_ids])
 
     return gpu_dict
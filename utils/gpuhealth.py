@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+gpuhealth.py
+
+Tracks the health of the GPUs and drains faulty devices, so that they are no longer handed out to jobs
+"""
+
+import json
+import os
+import threading
+import time
+
+from utils import log
+
+
+LOG = log.get_module_log(__name__)
+
+GPU_HEALTH_FILE = 'gpu_health.json'
+
+# exit codes of containers that were stopped or killed (docker stop, cancelled jobs, oom killer)
+KILLED_EXIT_CODES = (137, 143)
+
+
+class GPUHealth(object):
+
+    def __init__(self, state_dir, ecc_errors=1, query_failures=3, job_failures=3):
+        """
+        Health monitor fed with the snapshots of the GPU sampler and the results of the jobs. A device is drained if
+        it reports uncorrected ECC errors or pages pending retirement, if it is missing from repeated successful
+        queries or if several different jobs in a row failed on it. Drained devices stay drained (also across
+        restarts) until they are enabled again by an admin.
+
+        :param state_dir: Directory where the drained devices are stored.
+        :param ecc_errors: Number of uncorrected ECC errors at which a device is drained.
+        :param query_failures: Number of consecutive queries without an answer of the device at which it is drained.
+        :param job_failures: Number of different jobs failing in a row on a device at which it is drained, 0 to
+                             disable.
+        """
+        self.file_path = os.path.join(state_dir, GPU_HEALTH_FILE)
+        self.ecc_errors = ecc_errors
+        self.query_failures = query_failures
+        self.job_failures = job_failures
+        self.failed_queries = {}
+        self.failed_jobs = {}
+        self._lock = threading.Lock()
+        self.drained = self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path, 'r') as file_h:
+                return {int(minor): reason for minor, reason in json.load(file_h).items()}
+        except (IOError, ValueError):
+            return {}
+
+    def save(self):
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w') as file_h:
+            json.dump(self.drained, file_h)
+        os.replace(tmp_path, self.file_path)
+
+    def is_drained(self, minor):
+        return int(minor) in self.drained
+
+    def drain(self, minor, reason):
+        """
+        Takes a device out of service.
+
+        :param minor: Minor of the device.
+        :param reason: Description of the problem.
+        :return: None
+        """
+        with self._lock:
+            if int(minor) in self.drained:
+                return
+            self.drained[int(minor)] = {'reason': reason, 'since': time.time()}
+            self.save()
+        LOG.error('drained gpu {}: {}'.format(minor, reason))
+
+    def enable(self, minor):
+        """
+        Puts a drained device back into service and resets its counters.
+
+        :param minor: Minor of the device.
+        :return: True if the device was drained
+        """
+        minor = int(minor)
+        with self._lock:
+            self.failed_queries.pop(minor, None)
+            self.failed_jobs.pop(minor, None)
+            if self.drained.pop(minor, None) is None:
+                return False
+            self.save()
+        LOG.info('enabled gpu {}'.format(minor))
+        return True
+
+    def check(self, snapshot, minors):
+        """
+        Evaluates the health signals of a snapshot.
+
+        :param snapshot: List of GPU dicts as returned by a backend, None if the query failed.
+        :param minors: Minors of all devices that are expected to answer.
+        :return: None
+        """
+
+        # a failed query (e.g. a hiccup of nvml or nvidia-smi) says nothing about the single devices
+        if snapshot is None:
+            return
+
+        reported = {}
+        for gpu_i in snapshot:
+            reported[int(gpu_i.get('minor', gpu_i['id']))] = gpu_i
+
+        for minor in minors:
+            gpu_i = reported.get(minor)
+
+            # devices that fell off the bus do not show up in the query anymore
+            if gpu_i is None:
+                self.failed_queries[minor] = self.failed_queries.get(minor, 0) + 1
+                if self.failed_queries[minor] >= self.query_failures:
+                    self.drain(minor, 'no answer to {} queries'.format(self.failed_queries[minor]))
+                continue
+            self.failed_queries[minor] = 0
+
+            if (gpu_i.get('ecc_errors') or 0) >= self.ecc_errors > 0:
+                self.drain(minor, '{} uncorrected ecc errors'.format(gpu_i['ecc_errors']))
+            elif gpu_i.get('retired_pages_pending'):
+                self.drain(minor, 'pages pending retirement')
+
+    def record_job(self, minors, exit_code, job=None):
+        """
+        Counts the result of a job that ran on the given devices. Jobs that were stopped or killed do not count, and
+        a job that keeps failing (e.g. because it is resubmitted with the same bug) counts only once.
+
+        :param minors: Minors used by the job.
+        :param exit_code: Exit code of the job.
+        :param job: Identifies the job across resubmissions, e.g. (user, job name).
+        :return: None
+        """
+        if exit_code in KILLED_EXIT_CODES:
+            return
+
+        for minor in minors:
+            try:
+                minor = int(minor)
+            except ValueError:
+                # e.g. 'none' for jobs without gpu
+                continue
+
+            failed = self.failed_jobs.setdefault(minor, set())
+            if exit_code == 0:
+                failed.clear()
+                continue
+
+            failed.add(job)
+            if 0 < self.job_failures <= len(failed):
+                self.drain(minor, '{} different jobs failed in a row'.format(len(failed)))
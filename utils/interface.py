@@ -1,5 +1,6 @@
 import curses
 from curses import panel
+import threading
 import time
 from . import gpu
 from . import interface_funcs
@@ -310,8 +311,10 @@ class SubWindowAndPad(SubWindow):
         self.pad_height = self.height * pad_height_factor
         pad = curses.newpad(self.pad_height, self.width)
 
-        # define some variables with regard to refreshing the pad
+        # define some variables with regard to refreshing the pad. pad_line is the first displayed line of the whole
+        # content, the pad itself only holds the content from line pad_base on
         self.pad_line = 0
+        self.pad_base = 0
         self.top_left = [self.pos_y + 1 + self.pad_offset, self.pos_x + 1 + self.pad_indent]
         self.bottom_right = [self.pos_y + self.height - 2, self.pos_x + self.width - 1 - self.pad_indent]
         self.pad_display_coordinates = self.top_left + self.bottom_right
@@ -335,7 +338,7 @@ class SubWindowAndPad(SubWindow):
     def refresh(self):
         if self.pad_initialized:
             self.window.refresh()
-            self.screen.refresh(self.pad_line, 0, *self.pad_display_coordinates)
+            self.screen.refresh(max(0, self.pad_line - self.pad_base), 0, *self.pad_display_coordinates)
         else:
             self.screen.refresh()
 
@@ -359,9 +362,16 @@ class SubWindowAndPad(SubWindow):
 
     def scroll_up(self):
         self.pad_line -= 1 if self.pad_line > 0 else 0
+        self.scrolled()
 
     def scroll_down(self):
         self.pad_line += 1 if self.pad_line < self.scroll_limit else 0
+        self.scrolled()
+
+    def scrolled(self):
+        # virtualized lists render the rows that are scrolled into view right away
+        if isinstance(self.func, ScrollableList):
+            self.func.scrolled()
 
     def set_focus(self):
         border_chars = ['|'] * 2 + ['-'] * 2
@@ -514,7 +524,6 @@ class Interface(Window):
                                     x=self.indent + sub_width_left + horizontal_gap,
                                     offset=1,
                                     indent=4,
-                                    pad_height_factor=10,
                                     header='~~Enqueued Containers~~',
                                     func=ContainerList,
                                     mode='enqueued'),
@@ -525,7 +534,6 @@ class Interface(Window):
                                    x=self.indent + sub_width_left + horizontal_gap,
                                    offset=1,
                                    indent=4,
-                                   pad_height_factor=10,
                                    header='~~History~~',
                                    func=ContainerList,
                                    mode='history')
@@ -761,19 +769,7 @@ class Status(DisplayFunction):
         :return: None
         """
         # gather new information
-        information = {}
-        information['queue status'] = self.dopq.status
-        if information['queue status'] == 'running':
-            information['queue uptime'], information['queue starttime'] = self.dopq.uptime
-            information['provider status'] = self.dopq.provider.status
-            if information['provider status'] == 'running':
-                information['provider uptime'], information['provider starttime'] = self.dopq.provider.uptime
-            else:
-                information['provider uptime'], information['provider starttime'] = '', ''
-        else:
-            information['queue uptime'], information['queue starttime'] = '', ''
-            information['provider status'] = ''
-            information['provider uptime'], information['provider starttime'] = '', ''
+        information = dict(self.dopq.snapshot.status)
 
         # update displayed information
         for field, value in list(information.items()):
@@ -862,11 +858,11 @@ class Containers(DisplayFunction):
         :return: None
         """
 
-        # gather new information
+        # gather new information (copies, the snapshot must not be modified)
         information = []
-        containers = copy.copy(self.dopq.running_containers)
-        for container in self.dopq.running_containers:
-            information.append(container.container_stats())
+        for container_information in self.dopq.snapshot.running:
+            information.append(dict(container_information))
+            information[-1].pop('job_id', None)
 
             # reformat gpu info
             gpu_info = information[-1].pop('gpu', False)
@@ -881,13 +877,13 @@ class Containers(DisplayFunction):
         # check if the containers are the same
         rewrite_all = False
         if len(information) != len(self.displayed_information):
-            self.write_template(containers)
+            self.write_template(information)
             rewrite_all = True
         else:
-            for index, container in enumerate(self.dopq.running_containers):
-                if container.name != self.displayed_information[index]['name']:
+            for index, container_information in enumerate(information):
+                if container_information['name'] != self.displayed_information[index]['name']:
                     # rewrite template because gpu settings of the changed container may be different from the previously displayed
-                    self.write_template()
+                    self.write_template(information)
                     rewrite_all = True
                     break
 
@@ -914,6 +910,7 @@ class Containers(DisplayFunction):
     def write_template(self, containers=[]):
         """
         write the form template to the screen and get fields
+        :param containers: list of container information dicts, containers with gpus carry the gpu 'id' field
         :return: None
         """
         # clear screen
@@ -922,7 +919,7 @@ class Containers(DisplayFunction):
         # combine parts of the template according to number and gpu settings of containers
         templates, use_gpu = [], []
         for container in containers:
-                if container.use_gpu:
+                if 'id' in container:
                     template = copy.deepcopy(self.template['base'])
                     template.append(self.template['gpu'])
                     templates.append(template)
@@ -961,235 +958,322 @@ class Containers(DisplayFunction):
         self.first_call = False
 
 
-class UserStats(DisplayFunction):
+class ScrollableList(DisplayFunction):
 
     def __init__(self, subwindow, dopq):
         """
-        initialize fields, displayed information and form template
+        list of entries in a SubWindowAndPad that only renders the entries in view plus a margin, so that the cost of
+        an update does not depend on the length of the list. subclasses set self.template and self.height and
+        implement total(), fetch() and get_fields()
         :param subwindow: instance of SubWindowAndPad
         :param dopq: instance of DopQ
         """
 
-        super(UserStats, self).__init__(subwindow, dopq)
+        super(ScrollableList, self).__init__(subwindow, dopq)
+        self.displayed_information = []
+        self.first = 0
+        self.height = 1
 
-        width = self.screen.size[1]
-        width_unit = width // 8
+    def total(self):
+        """
+        :return: number of entries in the whole list
+        """
+        raise NotImplementedError('abstract method')
 
-        # init fields dict
-        self.fields = [{'user': '',
-                        'containers run': '',
-                        'penalty': '',
-                        'containers enqueued': ''}]
+    def fetch(self, offset, count):
+        """
+        :param offset: index of the first entry
+        :param count: number of entries
+        :return: list of information dicts of the entries
+        """
+        raise NotImplementedError('abstract method')
 
-        # init information dict
-        self.displayed_information = copy.deepcopy(self.fields)
+    def get_fields(self, coordinates):
+        """
+        :param coordinates: coordinates of the template as returned by Window.addmultiline
+        :return: dict mapping the fields to their coordinates
+        """
+        raise NotImplementedError('abstract method')
 
-        # init template
-        self.template = [['user:  '],
-                         ['-' * (width - 2 * self.screen.pad_indent)],  # hline
-                         [pad_with_spaces('penalty:  ', width_unit, 'prepend'),
-                          pad_with_spaces('containers run:  ', 3 * width_unit, 'prepend'),
-                          pad_with_spaces('containers enqueued:  ', 3 * width_unit, 'prepend')]]
+    def visible_range(self):
+        """
+        calculates which entries have to be rendered for the current scroll position
+        :return: tuple(index of the first entry, number of entries, total number of entries)
+        """
+        total = self.total()
+        capacity = max(1, (self.screen.pad_height - self.screen.offset) // self.height)
+        visible = self.screen.height // self.height + 1
+        margin = max(0, (capacity - visible) // 2)
 
-        self.height = len(self.template) + 2
+        first = self.screen.pad_line // self.height - margin
+        first = max(0, min(first, total - capacity))
+        return first, max(0, min(capacity, total - first)), total
 
-    def update(self):
+    def scrolled(self):
         """
-        obtains new information and prints the fields that changed
-        :return: NOne
+        called after scrolling, renders the list again if the rendered entries do not cover the view anymore
+        :return: None
         """
+        first, count, _ = self.visible_range()
+        if first != self.first or count != len(self.displayed_information):
+            self.update()
 
-        # get new information from queue
-        user_stats = self.dopq.users_stats
+    def update(self):
+        """
+        gets the entries in view and updates the fields that have changed
+        :return: None
+        """
 
-        # check if length of the user list has changed, if yes, redraw everything
+        # gather new information (copies, the snapshot must not be modified)
+        first, count, total = self.visible_range()
+        information = [dict(entry) for entry in self.fetch(first, count)] if count else []
+        for index, entry in enumerate(information):
+            entry.pop('job_id', None)
+            self.prepare(first + index, entry)
 
-        if len(user_stats) != len(self.displayed_information):
-            self.write_template()
-            self.rewrite_all = True
-
-        # cycle users and print their stats if they have changed or if redraw_all
-        for index, user in enumerate(user_stats):
-            for field, value in list(user.items()):
-                if self.rewrite_all or value != self.displayed_information[index][field]:
-                    attrs = self.screen.BOLD if 'user' in field else 0
-                    self.update_field(value, self.fields[index][field], attrs)
-                else:
-                    continue
+        # render the templates again if other entries are in view
+        rewrite_all = False
+        if first != self.first or len(information) != len(self.displayed_information):
+            self.write_template(first, len(information))
+            rewrite_all = True
 
         # update displayed information
-        self.displayed_information = user_stats
+        for index, entry in enumerate(information):
+            for field, value in list(entry.items()):
 
-        self.rewrite_all = False
+                # only rewrite field if it has changed
+                if rewrite_all or value != self.displayed_information[index].get(field):
+                    if field in self.fields[index]:
+                        self.update_field(value, self.fields[index][field], self.attributes(field, value))
 
-    def write_template(self):
+        # update stored information
+        self.displayed_information = information
+
+        # limit scrolling, so that it stops on the last entry
+        self.screen.scroll_limit = max(0, (total - 2) * self.height + self.screen.offset)
+
+    def prepare(self, index, entry):
         """
-        write form template to the screen and get fields
+        adds or reformats the information of an entry before it is displayed
+        :param index: position of the entry in the whole list
+        :param entry: information dict
         :return: None
         """
+        pass
 
-        # combine parts of the template according to number and gpu settings of containers
-        templates = [self.template] * len(self.dopq.user_list)
+    def attributes(self, field, value):
+        """
+        :return: formatting of a field
+        """
+        return 0
+
+    def write_template(self, first=0, n_entries=0):
+        """
+        write the form template of the entries to the pad and get their fields
+        :param first: index of the first entry
+        :param n_entries: number of entries
+        :return: None
+        """
+
+        # clear the pad, the border is drawn in the window behind it
+        self.screen.erase()
+
+        # the pad starts at the first entry, all fields have to be written again
+        self.first = first
+        self.displayed_information = []
+        self.screen.pad_base = first * self.height
 
         # write the template to the display and get fields
-        lines = [self.screen.offset + i * self.height for i, _ in enumerate(templates)]  # starting line for each template
         fields_list = []
-        for index, (line, template) in enumerate(zip(lines, templates)):
-            self.screen.navigate(y=line, x=self.screen.indent)
-            coordinates = self.screen.addmultiline(template)
-            fields = {'user': coordinates[0][0],
-                      'penalty': coordinates[2][0],
-                      'containers run': coordinates[2][1],
-                      'containers enqueued': coordinates[2][2]}
+        for index in range(n_entries):
+            self.screen.navigate(y=self.screen.offset + index * self.height, x=self.screen.indent)
+            coordinates = self.screen.addmultiline(self.template)
 
             def sort_fn(item):
                 return item[1]['beginning']['y'], item[1]['beginning']['x']
 
-            fields = OrderedDict(sorted(list(fields.items()), key=sort_fn))
+            # sort the fields by their y coordinate first and x coordinate second
+            fields = OrderedDict(sorted(list(self.get_fields(coordinates).items()), key=sort_fn))
             fields_list.append(self.calculate_field_properties(fields))
 
         self.fields = fields_list
         self.first_call = False
 
-        # limit scrolling, so that it stops on the last displayed container
-        self.screen.scroll_limit = lines[-2]
-
 
-class ContainerList(DisplayFunction):
+class UserStats(ScrollableList):
 
-    def __init__(self, subwindow, dopq, mode):
+    def __init__(self, subwindow, dopq):
+        """
+        initialize fields, displayed information and form template
+        :param subwindow: instance of SubWindowAndPad
+        :param dopq: instance of DopQ
         """
-                initializes fields, displayed_information and form template
-                :param subwindow: instance of SubWindowAndPad
-                :param dopq: instance of DopQ
-                """
-
-        super(ContainerList, self).__init__(subwindow, dopq)
 
-        # store which list to fetch on update
-        self.mode = mode
+        super(UserStats, self).__init__(subwindow, dopq)
 
         width = self.screen.size[1]
         width_unit = width // 8
 
-        # init fields dict
-        self.fields = [{'position': '',
-                        'name': '',
-                        'status': '',
-                        'docker name': '',
-                        'executor': '',
-                        'run time': '',
-                        'created': ''}]
-
-        # init information dict
-        self.displayed_information = []
-
         # init template
-        self.template = [['', '  ', # position
-                          ' name:  ',  # name
-                          pad_with_spaces('status:  ', 5 * width_unit, 'prepend')],  # end of first line
-                         ['-' * (width - 2 * self.screen.indent -1 )],  # hline
-                         [pad_with_spaces('docker name:  ', 2 * width_unit, 'prepend'),
-                          pad_with_spaces('executor:  ', 3 * width_unit, 'prepend')],  # end of second line
-                         [pad_with_spaces('uptime:  ', 2 * width_unit, 'prepend'),
-                          pad_with_spaces('created:  ', 3 * width_unit, 'prepend')]]  # end of third line
+        self.template = [['user:  '],
+                         ['-' * (width - 2 * self.screen.pad_indent)],  # hline
+                         [pad_with_spaces('penalty:  ', width_unit, 'prepend'),
+                          pad_with_spaces('containers run:  ', 3 * width_unit, 'prepend'),
+                          pad_with_spaces('containers enqueued:  ', 3 * width_unit, 'prepend')]]
 
         self.height = len(self.template) + 2
-        self.max_containers = self.screen.height // self.height
 
-    def get_list(self):
-        """
-        obtains the relevant container list from the queue depending on the set mode
-        :return: list of Container objects
-        """
+    def total(self):
+        return len(self.dopq.snapshot.users)
 
-        if self.mode == 'history':
-            container_list = self.dopq.history
-        elif self.mode == 'enqueued':
-            container_list = self.dopq.container_list
-        else:
-            raise ValueError('invalid mode of operation: {}'.format(self.mode))
+    def fetch(self, offset, count):
+        return self.dopq.snapshot.users[offset:offset + count]
 
-        if len(container_list) > self.max_containers:
-            container_list = container_list[:self.max_containers]
+    def get_fields(self, coordinates):
+        return {'user': coordinates[0][0],
+                'penalty': coordinates[2][0],
+                'containers run': coordinates[2][1],
+                'containers enqueued': coordinates[2][2]}
 
-        return container_list
+    def attributes(self, field, value):
+        return self.screen.BOLD if 'user' in field else 0
 
-    def update(self):
+
+class PageFetcher(object):
+
+    def __init__(self, fetch_fn, max_age=2, max_pages=8):
         """
-        gets new information from the queue and updates the fields that have changed
-        :return: None
+        reads pages of a list in a background thread, so that slow reads (e.g. requests to a remote queue) do not block
+        the interface. pages are cached and read again once they are older than max_age
+        :param fetch_fn: function(offset, count) returning the entries of a page
+        :param max_age: seconds after which a cached page is read again
+        :param max_pages: number of cached pages
         """
+        self.fetch_fn = fetch_fn
+        self.max_age = max_age
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.requested = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.thread = None
 
-        # gather new information
-        container_list = self.get_list()
-        information = [container.history_info() for container in container_list]
-        # check if the container list length is the same
-        rewrite_all = False
-        if len(information) != len(self.displayed_information):
-            self.write_template(len(container_list))
-            rewrite_all = True
+    def get(self, offset, count):
+        """
+        :param offset: index of the first entry
+        :param count: number of entries
+        :return: the cached entries of the page (possibly outdated), None if the page has not been read yet
+        """
+        key = (offset, count)
+        with self._lock:
+            read_at, page = self.pages.get(key, (0, None))
+            if time.time() - read_at < self.max_age:
+                return page
 
-        # update displayed information
-        for index, container_information in enumerate(information):
-            container_information['position'] = index
-            for field, value in list(container_information.items()):
+            # only the latest request is read, pages scrolled past in the meantime are skipped
+            self.requested = key
 
-                # only rewrite field if it has changed
-                if rewrite_all or value != self.displayed_information[index][field]:
-                    attrs = 0
-                    if 'status' in field:
-                        attrs = pick_color(value) | self.screen.BOLD
-                    elif 'name' in field or 'position' in field:
-                        attrs = self.screen.BOLD
-                    self.update_field(value, self.fields[index][field], attrs)
-                else:
-                    continue
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='DoPQ-Pages')
+            self.thread.daemon = True
+            self.thread.start()
+        self._wake.set()
+        return page
 
-        # update stored information
-        self.displayed_information = information
+    def run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                key, self.requested = self.requested, None
+            if key is None:
+                continue
 
-    def write_template(self, n_containers=0):
+            try:
+                page = self.fetch_fn(*key)
+            except Exception:
+                LOG.error(traceback.format_exc())
+                continue
+
+            with self._lock:
+                self.pages.pop(key, None)
+                self.pages[key] = (time.time(), page)
+                while len(self.pages) > self.max_pages:
+                    self.pages.popitem(last=False)
+
+
+class ContainerList(ScrollableList):
+
+    def __init__(self, subwindow, dopq, mode):
         """
-        write the form template to the screen and get fields
-        :return: None
+        initializes form template
+        :param subwindow: instance of SubWindowAndPad
+        :param dopq: instance of DopQ
+        :param mode: 'enqueued' or 'history'
         """
 
-        # clear screen
-        self.screen.redraw()
+        super(ContainerList, self).__init__(subwindow, dopq)
 
-        # update number of max containers on display
-        self.max_containers = self.screen.pad_height // self.height
+        if mode not in ('enqueued', 'history'):
+            raise ValueError('invalid mode of operation: {}'.format(mode))
 
-        # combine templates according to number of containers in the list
-        templates = [self.template] * n_containers
+        # store which list to fetch on update
+        self.mode = mode
 
-        # write the template to the display and get fields
-        lines = [self.screen.offset + i * self.height for i, _ in enumerate(templates)]
-        fields_list = []
-        for index, (line, template) in enumerate(zip(lines, templates)):
-            self.screen.navigate(y=line, x=self.screen.indent)
-            coordinates = self.screen.addmultiline(template)
-            fields = {'position': coordinates[0][0],
-                      'name': coordinates[0][2],
-                      'status': coordinates[0][3],
-                      'docker name': coordinates[2][0],
-                      'executor': coordinates[2][1],
-                      'run_time': coordinates[3][0],
-                      'created': coordinates[3][1]}
+        # pages beyond the snapshot may come from a remote queue
+        self.pages = PageFetcher(self.dopq.history_page if mode == 'history' else self.dopq.enqueued_page)
 
-            def sort_fn(item):
-                return item[1]['beginning']['y'], item[1]['beginning']['x']
+        width = self.screen.size[1]
+        width_unit = width // 8
 
-            # sort the fields by their y coordinate first and x coordinate second
-            fields = OrderedDict(sorted(list(fields.items()), key=sort_fn))
-            fields_list.append(self.calculate_field_properties(fields))
+        # init template
+        self.template = [['', '  ', # position
+                          ' name:  ',  # name
+                          pad_with_spaces('status:  ', 5 * width_unit, 'prepend')],  # end of first line
+                         ['-' * (width - 2 * self.screen.indent -1 )],  # hline
+                         [pad_with_spaces('docker name:  ', 2 * width_unit, 'prepend'),
+                          pad_with_spaces('executor:  ', 3 * width_unit, 'prepend')],  # end of second line
+                         [pad_with_spaces('uptime:  ', 2 * width_unit, 'prepend'),
+                          pad_with_spaces('created:  ', 3 * width_unit, 'prepend')]]  # end of third line
 
-        self.fields = fields_list if fields_list else self.fields
-        self.first_call = False
+        self.height = len(self.template) + 2
 
-        # limit scrolling, so that it stops on the last displayed container
-        self.screen.scroll_limit = lines[-2] if isinstance(lines, list) and len(lines) >= 2 else self.height
+    def total(self):
+        snapshot = self.dopq.snapshot
+        return snapshot.n_history if self.mode == 'history' else snapshot.n_enqueued
+
+    def fetch(self, offset, count):
+        """
+        entries in view are taken from the snapshot, entries further down are paged in from the queue in the
+        background. placeholders are shown until they have arrived
+        """
+        snapshot_list = self.dopq.snapshot.history if self.mode == 'history' else self.dopq.snapshot.enqueued
+        if offset + count <= len(snapshot_list):
+            return snapshot_list[offset:offset + count]
+
+        page = self.pages.get(offset, count)
+        if page is None:
+            return [{'name': 'loading...'} for _ in range(count)]
+        return page
+
+    def get_fields(self, coordinates):
+        return {'position': coordinates[0][0],
+                'name': coordinates[0][2],
+                'status': coordinates[0][3],
+                'docker name': coordinates[2][0],
+                'executor': coordinates[2][1],
+                'run_time': coordinates[3][0],
+                'created': coordinates[3][1]}
+
+    def prepare(self, index, entry):
+        entry['position'] = index
+
+    def attributes(self, field, value):
+        if 'status' in field:
+            return pick_color(value) | self.screen.BOLD
+        elif 'name' in field or 'position' in field:
+            return self.screen.BOLD
+        return 0
 
 
 def pad_with_spaces(string, total_length, mode='append'):
@@ -1242,6 +1326,8 @@ def pick_color(status):
         return curses.color_pair(5)
     elif status == 'dead':
         return curses.color_pair(5)
+    elif status == 'removed':
+        return curses.color_pair(5)
     else:
         return 0
 
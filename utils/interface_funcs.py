@@ -2,6 +2,9 @@ import curses
 import time
 import os
 
+from utils import logview
+from utils.logarchive import split_timestamp
+
 X_L = 2
 Y_T = 4
 
@@ -39,11 +42,18 @@ def shutdown_queue(screen, dopq):
 def display_commands(screen, *args):
     screen.indent = 10
     screen.navigate(x=screen.indent)
-    help_str = [['\tl:\tread container logs'],
+    help_str = [['\tl:\tread queue log'],
+                ['\tc:\tread container logs'],
                 ['\tr:\treload config'],
                 ['\ts:\tshutdown queue']]
     screen.addstr('possible commands:', newline=2)
     screen.addmultiline(help_str)
+    screen.nextline(newline=2)
+    screen.addstr('in the log viewer:', newline=2)
+    screen.addmultiline([['\tup/down, pgup/pgdn:\tscroll'],
+                         ['\tg/G:\tjump to start/end'],
+                         ['\tf:\tfollow the end of the log'],
+                         ['\t/, n/N:\tsearch, next/previous match']])
     screen.nextline(newline=3)
     screen.addstr('press q to return to the interface', screen.BOLD)
 
@@ -54,25 +64,207 @@ def display_commands(screen, *args):
         time.sleep(0.1)
 
 
+def wait_for_q(screen):
+    screen.nextline(newline=2)
+    screen.addstr('press q to return to the interface', screen.BOLD)
+    screen.refresh()
+    key = 0
+    while key != ord('q'):
+        key = screen.getch()
+        time.sleep(0.1)
+
+
+def read_pattern(screen, y):
+    """
+    reads a search pattern in the status line
+    :return: pattern as bytes, empty if the input was aborted
+    """
+    window = screen.screen
+    window.move(y, 0)
+    window.clrtoeol()
+    window.addstr(y, 0, '/', curses.A_BOLD)
+    window.timeout(-1)
+    curses.echo()
+    try:
+        curses.curs_set(1)
+    except curses.error:
+        pass
+    try:
+        pattern = window.getstr(y, 1, 200)
+    finally:
+        curses.noecho()
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+    return pattern.strip(b'\n')
+
+
+def view_log(screen, view, title, transform=None):
+    """
+    pager for (large) log files. only the lines on the screen are read, so it starts immediately and the file is
+    indexed in the background
+    :param screen: Window to display the log in
+    :param view: logview.LogView or logview.ArchiveView
+    :param title: title that is shown above the log
+    :param transform: function applied to every line before it is shown, e.g. to remove timestamps
+    :return: None
+    """
+    window = screen.screen
+    window.keypad(True)
+    window.timeout(200)
+
+    # start at the end of the log and follow it
+    top, follow = 0, True
+    pattern, message = b'', ''
+    while True:
+        height, width = screen.size
+        first_row = screen.offset
+        n_rows = max(1, height - first_row - 2)
+        line_count = view.line_count
+        if follow:
+            view.refresh()
+            line_count = view.line_count
+            top = line_count - n_rows
+        top = max(0, min(top, line_count - n_rows))
+
+        # draw title, lines and status
+        for y in range(first_row - 1, height):
+            window.move(y, 0)
+            window.clrtoeol()
+        try:
+            window.addnstr(first_row - 1, 0, title, width - 1, curses.A_BOLD)
+            for row, line in enumerate(view.lines(top, n_rows)):
+                if transform is not None:
+                    line = transform(line)
+                line = line.decode('utf-8', 'replace').expandtabs().replace('\r', ' ')
+                window.addnstr(first_row + row, 0, line, width - 1)
+
+            status = 'lines {}-{} of {}{}{}  (q: quit, f: follow, /: search, n/N: next/previous)'.format(
+                min(top + 1, line_count), min(top + n_rows, line_count), line_count,
+                ' (indexing...)' if view.indexing else '', ' [follow]' if follow else '')
+            window.addnstr(height - 1, 0, message or status, width - 1, curses.A_REVERSE)
+        except curses.error:
+            pass
+        window.refresh()
+
+        # messages are shown until the next key is pressed
+        key = window.getch()
+        if key == -1:
+            continue
+        message = ''
+        if key == ord('q'):
+            break
+
+        if key in (curses.KEY_UP, ord('k'), ord('+')):
+            top, follow = top - 1, False
+        elif key in (curses.KEY_DOWN, ord('j'), ord('#')):
+            top += 1
+        elif key in (curses.KEY_PPAGE, ord('b')):
+            top, follow = top - n_rows, False
+        elif key in (curses.KEY_NPAGE, ord(' ')):
+            top += n_rows
+        elif key in (curses.KEY_HOME, ord('g')):
+            top, follow = 0, False
+        elif key in (curses.KEY_END, ord('G')):
+            view.refresh()
+            top = view.line_count
+        elif key == ord('f'):
+            follow = not follow
+        elif key in (ord('/'), ord('n'), ord('N')):
+            if key == ord('/'):
+                pattern = read_pattern(screen, height - 1)
+                window.timeout(200)
+            if not pattern:
+                continue
+
+            # searching backwards skips the top line, searching forward starts below it
+            backwards = key == ord('N')
+            match = view.find(pattern, top if backwards else top + 1, backwards=backwards)
+            if match is None:
+                message = "pattern '{}' not found".format(pattern.decode('utf-8', 'replace'))
+            else:
+                top, follow = match, False
+
+
 def show_container_logs(screen, dopq):
 
-    screen.addstr('reading container logs is not implemented yet....soon!', curses.A_BOLD)
+    # running containers first, then the most recently finished ones
+    snapshot = dopq.snapshot
+    jobs = list(snapshot.running) + list(snapshot.history) if snapshot is not None else []
+    if not jobs:
+        screen.addstr('there are no running or finished containers', curses.A_BOLD)
+        wait_for_q(screen)
+        return
 
+    window = screen.screen
+    window.keypad(True)
+    first_row = screen.offset
+    selected, top = 0, 0
+    while True:
 
-def show_queue_log(screen, dopq):
+        # choose a container
+        height, width = screen.size
+        n_rows = max(1, height - first_row - 2)
+        top = min(max(top, selected - n_rows + 1), selected)
+        for y in range(first_row - 1, height):
+            window.move(y, 0)
+            window.clrtoeol()
+        try:
+            window.addnstr(first_row - 1, 0, 'select a container (enter: show logs, q: quit)', width - 1,
+                           curses.A_BOLD)
+            for row, info in enumerate(jobs[top:top + n_rows]):
+                line = '{:<30} {:<20} {:<12} {}'.format(info.get('name', ''), info.get('executor', ''),
+                                                         info.get('status', ''), info.get('job_id', ''))
+                window.addnstr(first_row + row, 0, line, width - 1,
+                               curses.A_REVERSE if top + row == selected else 0)
+        except curses.error:
+            pass
+        window.refresh()
 
-    logfile = dopq.logfile
-    with open(logfile, 'r') as logfile:
-        n_lines = len(logfile.readline())
+        key = window.getch()
+        if key == ord('q'):
+            break
+        if key in (curses.KEY_UP, ord('k'), ord('+')):
+            selected = max(0, selected - 1)
+        elif key in (curses.KEY_DOWN, ord('j'), ord('#')):
+            selected = min(len(jobs) - 1, selected + 1)
+        elif key in (curses.KEY_ENTER, ord('\n'), ord('\r')):
+            info = jobs[selected]
+            path = dopq.log_file(info.get('job_id'))
+            view = logview.open_log(path) if path is not None else None
+            if view is None:
+                window.addnstr(height - 1, 0, 'no collected logs for {}'.format(info.get('name', '')), width - 1,
+                               curses.A_REVERSE)
+                window.refresh()
+                time.sleep(2)
+                continue
+            try:
+                # the collected lines start with the docker timestamp
+                view_log(screen, view, 'logs of {} ({})'.format(info.get('name', ''), path),
+                         transform=lambda line: split_timestamp(line)[1])
+            finally:
+                view.close()
+            window.timeout(-1)
 
-        # set up scrollable pad in window
-        pass
 
+def show_queue_log(screen, dopq):
 
+    if not os.path.isfile(dopq.logfile):
+        screen.addstr('queue log {} does not exist'.format(dopq.logfile), curses.A_BOLD)
+        wait_for_q(screen)
+        return
 
+    view = logview.LogView(dopq.logfile)
+    view.start()
+    try:
+        view_log(screen, view, 'queue log ({})'.format(os.path.abspath(dopq.logfile)))
+    finally:
+        view.close()
 
 
 FUNCTIONS = {ord('l'): show_queue_log,
+                 ord('c'): show_container_logs,
                  ord('r'): reload_config,
                  ord('s'): shutdown_queue,
                  ord('h'): display_commands}
\ No newline at end of file
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+inventory.py
+
+Inventory of the hardware of the host (GPUs, CPUs, NUMA nodes and memory). It is read once and only refreshed on
+demand, so that hot paths like config validation and gpu allocation do not scan the system again and again.
+"""
+
+import os
+import re
+import threading
+import time
+
+import psutil
+
+
+NODE_DIR = '/sys/devices/system/node'
+
+
+def parse_cpulist(cpulist):
+    """
+    parses a cpu list as used by sysfs
+    :param cpulist: e.g. '0-3,8,10-11'
+    :return: list of cpu ids
+    """
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def read_numa_nodes(node_dir=NODE_DIR):
+    """
+    :param node_dir: sysfs directory of the NUMA nodes
+    :return: dict mapping each NUMA node to the list of its cpus, empty if the system does not expose NUMA nodes
+    """
+    nodes = {}
+    if not os.path.isdir(node_dir):
+        return nodes
+
+    for entry in os.listdir(node_dir):
+        match_dt = re.match(r'^node(\d+)$', entry)
+        if match_dt is None:
+            continue
+        try:
+            with open(os.path.join(node_dir, entry, 'cpulist'), 'r') as file_h:
+                nodes[int(match_dt.group(1))] = parse_cpulist(file_h.read())
+        except IOError:
+            continue
+    return nodes
+
+
+class HardwareInventory(object):
+
+    def __init__(self, gpu_source=None):
+        """
+        lazily loaded inventory of the host hardware
+        :param gpu_source: function returning the gpu minors of the system
+        """
+        self.gpu_source = gpu_source
+        self.refreshed_at = None
+        self._gpus = []
+        self._cpus = 0
+        self._physical_cpus = 0
+        self._numa_nodes = {}
+        self._memory = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        enumerates the hardware again, e.g. after a config reload or on SIGHUP
+        :return: None
+        """
+        gpus = sorted(self.gpu_source()) if self.gpu_source is not None else []
+        cpus = psutil.cpu_count(logical=True) or 0
+        physical_cpus = psutil.cpu_count(logical=False) or cpus
+        numa_nodes = read_numa_nodes()
+        memory = psutil.virtual_memory().total
+
+        with self._lock:
+            self._gpus = gpus
+            self._cpus = cpus
+            self._physical_cpus = physical_cpus
+            self._numa_nodes = numa_nodes
+            self._memory = memory
+            self.refreshed_at = time.time()
+
+    def _ensure(self):
+        if self.refreshed_at is None:
+            self.refresh()
+
+    @property
+    def gpus(self):
+        """
+        :return: list of the gpu minors of the system
+        """
+        self._ensure()
+        return list(self._gpus)
+
+    @property
+    def cpus(self):
+        """
+        :return: number of logical cpus
+        """
+        self._ensure()
+        return self._cpus
+
+    @property
+    def physical_cpus(self):
+        """
+        :return: number of physical cores
+        """
+        self._ensure()
+        return self._physical_cpus
+
+    @property
+    def numa_nodes(self):
+        """
+        :return: dict mapping each NUMA node to the list of its cpus
+        """
+        self._ensure()
+        return dict(self._numa_nodes)
+
+    @property
+    def memory(self):
+        """
+        :return: total memory in bytes
+        """
+        self._ensure()
+        return self._memory
+
+    def to_dict(self):
+        """
+        :return: the whole inventory as dictionary
+        """
+        self._ensure()
+        return {'gpus': self.gpus, 'cpus': self.cpus, 'physical_cpus': self.physical_cpus,
+                'numa_nodes': self.numa_nodes, 'memory': self.memory, 'refreshed_at': self.refreshed_at}
+
+
+INVENTORY = HardwareInventory()
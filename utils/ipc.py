@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ipc.py
+
+Batched message channel between the provider process and the queue thread
+"""
+
+from pathos.helpers import mp
+
+
+class JobChannel(object):
+    """
+    Queue for job records (plain dictionaries) with a pipe based notification. Every batch that is put into the queue
+    is announced by exactly one notification byte, so the receiver knows how many batches it can get without relying
+    on Queue.empty(), and can block on the pipe until new jobs arrive.
+    """
+
+    def __init__(self):
+        self.queue = mp.Queue()
+        self._reader, self._writer = mp.Pipe(duplex=False)
+
+    def put_many(self, records):
+        """
+        sends several job records as a single message
+        :param records: list of job record dictionaries
+        :return: None
+        """
+        records = list(records)
+        if not records:
+            return
+
+        self.queue.put(records)
+        self._writer.send_bytes(b'\x00')
+
+    def put(self, record):
+        self.put_many([record])
+
+    def wake(self):
+        """
+        wakes up a receiver that is waiting for records, by announcing an empty batch
+        :return: None
+        """
+        self.queue.put([])
+        self._writer.send_bytes(b'\x00')
+
+    def wait(self, timeout=None):
+        """
+        blocks until new records are available or the timeout has passed
+        :param timeout: maximum waiting time in seconds, None waits forever
+        :return: True if records are available
+        """
+        return self._reader.poll(timeout)
+
+    def get_many(self, timeout=0):
+        """
+        receives all batches that have been announced so far
+        :param timeout: seconds to wait for the first batch
+        :return: list of job record dictionaries
+        """
+        records = []
+        if not self._reader.poll(timeout):
+            return records
+
+        # each notification belongs to one batch that has been put before it
+        while self._reader.poll():
+            self._reader.recv_bytes()
+            records.extend(self.queue.get())
+
+        return records
+
+    def close(self):
+        """
+        releases the queue and both ends of the notification pipe, the channel can not be used afterwards
+        :return: None
+        """
+        self.queue.close()
+        self._reader.close()
+        self._writer.close()
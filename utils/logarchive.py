@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+logarchive.py
+
+Block compressed archive for the logs of finished jobs. The archive is a sequence of independent gzip members (so it
+can still be read with zcat) and comes with a small json index of the offset, first line and first timestamp of every
+block, which allows to tail, seek and search a log without decompressing all of it.
+"""
+
+import bisect
+import calendar
+import gzip
+import json
+import os
+import re
+import time
+
+
+# uncompressed size of a block
+BLOCK_SIZE = 1024 ** 2
+
+ARCHIVE_SUFFIX = '.gz'
+INDEX_SUFFIX = '.idx'
+
+TIMESTAMP_PATTERN = re.compile(rb'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z ')
+
+
+def job_log_path(log_dir, user, name, job_id):
+    """
+    :return: path of the (live) log file of a job
+    """
+    return os.path.join(log_dir, user, '{}_{}.log'.format(name, job_id))
+
+
+def parse_timestamp(timestamp):
+    """
+    converts a docker log timestamp (RFC3339 with up to nanosecond precision) to nanoseconds since the epoch, docker
+    trims trailing zeros of the fraction, so the strings can not be compared directly
+    :param timestamp: timestamp string, e.g. 2019-07-18T10:11:12.1234Z
+    :return: integer nanoseconds
+    """
+    timestamp = timestamp.rstrip('Z')
+    seconds, _, fraction = timestamp.partition('.')
+    epoch = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+    return epoch * 10 ** 9 + int((fraction + '0' * 9)[:9])
+
+
+def split_timestamp(line):
+    """
+    splits the docker timestamp off a log line
+    :param line: log line (bytes)
+    :return: tuple of (timestamp in nanoseconds or None, text of the line)
+    """
+    match = TIMESTAMP_PATTERN.match(line)
+    if match is None:
+        return None, line
+    return parse_timestamp(line[:match.end() - 1].decode('ascii')), line[match.end():]
+
+
+def rotated_files(path):
+    """
+    :param path: path of a log file written by log_collector.RotatingFile
+    :return: list of the existing rotated files and the file itself, oldest first
+    """
+    backups = []
+    index = 1
+    while os.path.isfile('{}.{}'.format(path, index)):
+        backups.append('{}.{}'.format(path, index))
+        index += 1
+    files = backups[::-1]
+    if os.path.isfile(path):
+        files.append(path)
+    return files
+
+
+def tail_file(path, lines, chunk_size=64 * 1024):
+    """
+    reads the last lines of a plain text file by reading backwards from its end
+    :param path: path of the file
+    :param lines: number of lines
+    :param chunk_size: number of bytes read at once
+    :return: list of lines (bytes, without newline)
+    """
+    with open(path, 'rb') as file_h:
+        file_h.seek(0, os.SEEK_END)
+        position = file_h.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= lines:
+            read_size = min(chunk_size, position)
+            position -= read_size
+            file_h.seek(position)
+            data = file_h.read(read_size) + data
+
+    result = data.split(b'\n')
+    if result and not result[-1]:
+        result.pop()
+    return result[-lines:] if lines > 0 else []
+
+
+def write_archive(sources, archive_path, block_size=BLOCK_SIZE, level=6):
+    """
+    compresses log files into a block archive with index
+    :param sources: list of plain log files, concatenated in the given order
+    :param archive_path: path of the archive, the index is written to archive_path + INDEX_SUFFIX
+    :param block_size: uncompressed size after which a new block is started
+    :param level: gzip compression level
+    :return: the index
+    """
+    index = {'lines': 0, 'blocks': []}
+    tmp_path = archive_path + '.tmp'
+
+    with open(tmp_path, 'wb') as out_h:
+
+        block, block_bytes, first_time = [], 0, None
+
+        def flush():
+            compressed = gzip.compress(b''.join(block), level)
+            index['blocks'].append({'offset': out_h.tell(), 'length': len(compressed),
+                                    'first_line': index['lines'], 'lines': len(block), 'first_time': first_time})
+            out_h.write(compressed)
+            index['lines'] += len(block)
+
+        for source in sources:
+            with open(source, 'rb') as in_h:
+                for line in in_h:
+                    if not line.endswith(b'\n'):
+                        line += b'\n'
+                    if first_time is None:
+                        first_time = split_timestamp(line)[0]
+                    block.append(line)
+                    block_bytes += len(line)
+
+                    if block_bytes >= block_size:
+                        flush()
+                        block, block_bytes, first_time = [], 0, None
+
+        if block:
+            flush()
+
+    # the archive is only visible once its index exists
+    with open(archive_path + INDEX_SUFFIX + '.tmp', 'w') as file_h:
+        json.dump(index, file_h)
+    os.replace(archive_path + INDEX_SUFFIX + '.tmp', archive_path + INDEX_SUFFIX)
+    os.replace(tmp_path, archive_path)
+
+    return index
+
+
+def archive_log(path, remove=True):
+    """
+    compresses a log file and its rotated files into a block archive
+    :param path: path of the log file
+    :param remove: remove the plain files afterwards
+    :return: path of the archive
+    """
+    sources = rotated_files(path)
+    archive_path = path + ARCHIVE_SUFFIX
+    write_archive(sources, archive_path)
+    if remove:
+        for source in sources:
+            os.remove(source)
+    return archive_path
+
+
+class LogArchive(object):
+
+    def __init__(self, path):
+        """
+        read access to a block archive
+        :param path: path of the archive
+        """
+        self.path = path
+        with open(path + INDEX_SUFFIX, 'r') as file_h:
+            self.index = json.load(file_h)
+        self.blocks = self.index['blocks']
+        self.first_lines = [block['first_line'] for block in self.blocks]
+
+        # blocks without timestamp inherit the one of the previous block, so that the list stays sorted
+        self.first_times, last_time = [], 0
+        for block in self.blocks:
+            last_time = block['first_time'] if block['first_time'] is not None else last_time
+            self.first_times.append(last_time)
+
+    @property
+    def line_count(self):
+        return self.index['lines']
+
+    def read_block(self, block_index):
+        """
+        decompresses a single block
+        :param block_index: index of the block
+        :return: list of lines (bytes, without newline)
+        """
+        block = self.blocks[block_index]
+        with open(self.path, 'rb') as file_h:
+            file_h.seek(block['offset'])
+            data = file_h.read(block['length'])
+        # every line ends with a newline, carriage returns (e.g. of progress bars) do not start a new line
+        return gzip.decompress(data).split(b'\n')[:-1]
+
+    def lines(self, start, count):
+        """
+        reads a range of lines, only the blocks containing them are decompressed
+        :param start: number of the first line (0-based)
+        :param count: number of lines
+        :return: list of lines (bytes, without newline)
+        """
+        start = max(0, start)
+        end = min(start + count, self.line_count)
+        result = []
+        block_index = bisect.bisect_right(self.first_lines, start) - 1
+        while block_index < len(self.blocks) and start < end:
+            block = self.blocks[block_index]
+            block_lines = self.read_block(block_index)
+            offset = start - block['first_line']
+            taken = block_lines[offset:offset + end - start]
+            result.extend(taken)
+            start += len(taken)
+            block_index += 1
+        return result
+
+    def tail(self, count):
+        """
+        :param count: number of lines
+        :return: the last count lines
+        """
+        return self.lines(self.line_count - count, count)
+
+    def seek_time(self, timestamp):
+        """
+        finds the first line logged at or after a point in time
+        :param timestamp: docker timestamp string or nanoseconds since the epoch
+        :return: line number, line_count if all lines are older
+        """
+        if isinstance(timestamp, str):
+            timestamp = parse_timestamp(timestamp)
+
+        block_index = max(0, bisect.bisect_left(self.first_times, timestamp) - 1)
+        for block_index in range(block_index, len(self.blocks)):
+            for offset, line in enumerate(self.read_block(block_index)):
+                line_time = split_timestamp(line)[0]
+                if line_time is not None and line_time >= timestamp:
+                    return self.blocks[block_index]['first_line'] + offset
+
+        return self.line_count
+
+    def grep(self, pattern, max_results=None):
+        """
+        searches the archive block by block
+        :param pattern: substring (bytes) or compiled regular expression (bytes pattern)
+        :param max_results: stop after this many matches
+        :return: generator of (line number, line)
+        """
+        if isinstance(pattern, bytes):
+            match = lambda line: pattern in line
+        else:
+            match = lambda line: pattern.search(line) is not None
+
+        found = 0
+        for block_index, block in enumerate(self.blocks):
+            for offset, line in enumerate(self.read_block(block_index)):
+                if match(line):
+                    yield block['first_line'] + offset, line
+                    found += 1
+                    if max_results is not None and found >= max_results:
+                        return
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+logview.py
+
+Random access to large and growing log files for the log viewer of the interface. The file is memory mapped and the
+offsets of its lines are indexed in the background, so opening, paging and searching never read the whole file into
+python objects.
+"""
+
+import bisect
+import mmap
+import os
+import threading
+
+import numpy as np
+
+from utils.logarchive import ARCHIVE_SUFFIX, LogArchive
+
+
+# bytes that are scanned for line breaks at once
+CHUNK_SIZE = 4 * 1024 ** 2
+
+NEWLINE = ord('\n')
+
+
+class LogView(object):
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        """
+        memory mapped view of a (growing) text file with a lazily built index of the line offsets
+        :param path: path of the file
+        :param chunk_size: bytes scanned for line breaks at once
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file_h = None
+        self._mm = None
+        self._inode = None
+        self._size = 0
+        self._offsets = np.zeros(1024, dtype=np.uint64)
+        self._n_offsets = 1
+        self._indexed = 0
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self.thread = None
+        self.open()
+
+    def open(self):
+        """
+        (re)maps the file and resets the index
+        :return: None
+        """
+        with self._lock:
+            self._unmap()
+            if self._file_h is not None:
+                self._file_h.close()
+            self._file_h = open(self.path, 'rb')
+            self._inode = os.fstat(self._file_h.fileno()).st_ino
+            self._offsets[0] = 0
+            self._n_offsets = 1
+            self._indexed = 0
+            self._map()
+
+    def _map(self):
+        self._size = os.fstat(self._file_h.fileno()).st_size
+
+        # empty files can not be mapped
+        self._mm = mmap.mmap(self._file_h.fileno(), self._size, access=mmap.ACCESS_READ) if self._size else None
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._unmap()
+            if self._file_h is not None:
+                self._file_h.close()
+                self._file_h = None
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def indexing(self):
+        """
+        :return: True while parts of the file have not been indexed yet
+        """
+        return self._indexed < self._size
+
+    @property
+    def line_count(self):
+        """
+        :return: number of indexed lines, a last line without line break counts as line once it is indexed
+        """
+        with self._lock:
+            n_lines = self._n_offsets
+            if self._offsets[n_lines - 1] >= self._indexed:
+                n_lines -= 1
+            return n_lines
+
+    def refresh(self):
+        """
+        picks up appended data, starts over if the file has been truncated or replaced (e.g. by log rotation)
+        :return: True if the file has changed
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+
+        with self._lock:
+            if stat.st_ino != self._inode or stat.st_size < self._indexed:
+                self.open()
+            elif stat.st_size != self._size:
+                self._unmap()
+                self._map()
+            else:
+                return False
+
+        # index the new data
+        if self.thread is not None and not self.running:
+            self.start()
+        return True
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """
+        indexes the file in a background thread
+        :return: None
+        """
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-LogView')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.running:
+            self.thread.join()
+
+    def run(self):
+        while not self._stop_event.is_set() and self.index_chunk():
+            pass
+
+    def index_chunk(self):
+        """
+        indexes the line breaks of the next chunk of the file
+        :return: False if the file has been indexed completely
+        """
+        with self._lock:
+            if self._indexed >= self._size:
+                return False
+
+            start = self._indexed
+            count = min(self.chunk_size, self._size - start)
+
+            # the buffer of the mapping is used directly, nothing is copied
+            chunk = np.frombuffer(self._mm, dtype=np.uint8, count=count, offset=start)
+            starts = np.flatnonzero(chunk == NEWLINE).astype(np.uint64) + np.uint64(start + 1)
+            del chunk
+
+            # grow the index
+            required = self._n_offsets + len(starts)
+            if required > len(self._offsets):
+                offsets = np.zeros(max(required, 2 * len(self._offsets)), dtype=np.uint64)
+                offsets[:self._n_offsets] = self._offsets[:self._n_offsets]
+                self._offsets = offsets
+            self._offsets[self._n_offsets:required] = starts
+            self._n_offsets = required
+            self._indexed = start + count
+            return True
+
+    def index_all(self):
+        """
+        indexes the whole file in the calling thread
+        :return: None
+        """
+        while self.index_chunk():
+            pass
+
+    def _line_end(self, index):
+        if index + 1 < self._n_offsets:
+            return int(self._offsets[index + 1]) - 1
+        end = self._mm.find(b'\n', int(self._offsets[index]))
+        return end if end != -1 else self._size
+
+    def lines(self, start, count):
+        """
+        reads a range of lines
+        :param start: number of the first line (0-based)
+        :param count: number of lines
+        :return: list of lines (bytes, without line break)
+        """
+        with self._lock:
+            end = min(start + count, self.line_count)
+            return [self._mm[int(self._offsets[index]):self._line_end(index)] for index in range(max(0, start), end)]
+
+    def line_of(self, offset):
+        """
+        :param offset: byte offset in the file
+        :return: number of the line that contains the offset
+        """
+        with self._lock:
+            offsets = self._offsets[:self._n_offsets]
+            line = int(np.searchsorted(offsets, offset, side='right')) - 1
+
+            # the offset has not been indexed yet, count the line breaks in between
+            if offset >= self._indexed:
+                chunk = np.frombuffer(self._mm, dtype=np.uint8, count=offset - self._indexed, offset=self._indexed)
+                line += int(np.count_nonzero(chunk == NEWLINE))
+                del chunk
+            return line
+
+    def _line_offset(self, line):
+        """
+        :param line: number of a line (0-based)
+        :return: byte offset where the line starts, also beyond the indexed part of the file. None if the file has
+                 fewer lines
+        """
+        if line < self._n_offsets:
+            offset = int(self._offsets[line])
+            return offset if offset < self._size else None
+
+        # skip the line breaks that have not been indexed yet
+        offset, remaining = self._indexed, line - self._n_offsets + 1
+        while offset < self._size:
+            count = min(self.chunk_size, self._size - offset)
+            chunk = np.frombuffer(self._mm, dtype=np.uint8, count=count, offset=offset)
+            breaks = np.flatnonzero(chunk == NEWLINE)
+            del chunk
+            if len(breaks) >= remaining:
+                offset += int(breaks[remaining - 1]) + 1
+                return offset if offset < self._size else None
+            remaining -= len(breaks)
+            offset += count
+        return None
+
+    def find(self, pattern, start_line=0, backwards=False):
+        """
+        searches a substring, also in the part of the file that has not been indexed yet
+        :param pattern: substring (bytes or str)
+        :param start_line: line where the search begins, it is excluded when searching backwards
+        :param backwards: search towards the beginning of the file
+        :return: number of the first line containing the pattern, None if there is none
+        """
+        if isinstance(pattern, str):
+            pattern = pattern.encode('utf-8')
+
+        with self._lock:
+            if self._mm is None or not pattern:
+                return None
+
+            start = self._line_offset(max(0, start_line))
+            if backwards:
+                if start_line <= 0:
+                    return None
+                position = self._mm.rfind(pattern, 0, start if start is not None else self._size)
+            else:
+                if start is None:
+                    return None
+                position = self._mm.find(pattern, start)
+
+            return self.line_of(position) if position != -1 else None
+
+
+class ArchiveView(object):
+
+    def __init__(self, path):
+        """
+        the interface of LogView for the block archive of a finished job (see logarchive.py)
+        :param path: path of the archive
+        """
+        self.path = path
+        self.archive = LogArchive(path)
+        self.indexing = False
+        self.size = os.path.getsize(path)
+
+    @property
+    def line_count(self):
+        return self.archive.line_count
+
+    def lines(self, start, count):
+        return self.archive.lines(start, count)
+
+    def refresh(self):
+        return False
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def find(self, pattern, start_line=0, backwards=False):
+        """
+        searches a substring, only the blocks in search direction are decompressed
+        """
+        if isinstance(pattern, str):
+            pattern = pattern.encode('utf-8')
+        if not pattern:
+            return None
+
+        first_lines = self.archive.first_lines
+        block_index = max(0, bisect.bisect_right(first_lines, start_line) - 1)
+        block_indices = range(block_index, -1, -1) if backwards else range(block_index, len(first_lines))
+        for block_index in block_indices:
+            lines = self.archive.read_block(block_index)
+            numbers = range(first_lines[block_index], first_lines[block_index] + len(lines))
+            candidates = list(zip(numbers, lines))
+            for number, line in (reversed(candidates) if backwards else candidates):
+                if (number < start_line if backwards else number >= start_line) and pattern in line:
+                    return number
+        return None
+
+
+def open_log(path):
+    """
+    opens the archive of a log file or, as long as the job has not been archived, the live log file
+    :param path: path of the log file
+    :return: ArchiveView or LogView (indexing in the background), None if neither exists
+    """
+    if os.path.isfile(path + ARCHIVE_SUFFIX):
+        return ArchiveView(path + ARCHIVE_SUFFIX)
+    if os.path.isfile(path):
+        view = LogView(path)
+        view.start()
+        return view
+    return None
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+metrics.py
+
+Registry of counters, gauges and histograms of the queue, rendered in the OpenMetrics text format
+"""
+
+import bisect
+import math
+import threading
+import traceback
+
+from utils import log
+
+
+LOG = log.get_module_log(__name__)
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# seconds, from a fast scheduler cycle to a docker build
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in labels) + '}'
+
+
+class Metric(object):
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), unit=''):
+        """
+        base class of the metrics, values are kept per combination of label values
+        :param name: name of the metric family
+        :param documentation: help text
+        :param labelnames: names of the labels
+        :param unit: unit of the metric, has to be the suffix of the name
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.unit = unit
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        """
+        :param labels: dict with a value for every label name
+        :return: tuple of the label values
+        :raises ValueError: if labels are missing or unknown
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} expects the labels {}, got {}'.format(self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        :return: list of (sample name, list of (label name, value) pairs, value)
+        """
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, list(zip(self.labelnames, key)), value) for key, value in sorted(values)]
+
+    def render(self):
+        lines = ['# TYPE {} {}'.format(self.name, self.type)]
+        if self.unit:
+            lines.append('# UNIT {} {}'.format(self.name, self.unit))
+        lines.append('# HELP {} {}'.format(self.name, escape(self.documentation)))
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('counters can only be increased')
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        return [(name + '_total', labels, value) for name, labels, value in super(Counter, self).samples()]
+
+
+class Gauge(Metric):
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), unit=''):
+        super(Gauge, self).__init__(name, documentation, labelnames, unit)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """
+        computes the values when the metrics are rendered instead
+        :param function: returns the value, or a dict mapping tuples of label values to values for labelled gauges
+        :return: None
+        """
+        self.function = function
+
+    def samples(self):
+        if self.function is None:
+            return super(Gauge, self).samples()
+
+        try:
+            values = self.function()
+        except Exception:
+            LOG.error('could not compute {}: {}'.format(self.name, traceback.format_exc()))
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, list(zip(self.labelnames, [str(label) for label in key])), value)
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), unit='', buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames, unit)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+
+        samples = []
+        for key, (counts, total) in sorted(values):
+            labels = list(zip(self.labelnames, key))
+
+            # buckets are cumulative
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + [('le', format_value(float(bound)))], cumulative))
+            samples.append((self.name + '_count', labels, cumulative))
+            samples.append((self.name + '_sum', labels, total))
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        adds a metric, a metric of the same name and type that has been registered before is returned instead
+        :param metric: Counter, Gauge or Histogram
+        :return: the registered metric
+        """
+        with self._lock:
+            registered = self.metrics.setdefault(metric.name, metric)
+        if type(registered) is not type(metric):
+            raise ValueError('{} is already registered as {}'.format(metric.name, registered.type))
+        return registered
+
+    def counter(self, name, documentation, labelnames=(), unit=''):
+        return self.register(Counter(name, documentation, labelnames, unit))
+
+    def gauge(self, name, documentation, labelnames=(), unit=''):
+        return self.register(Gauge(name, documentation, labelnames, unit))
+
+    def histogram(self, name, documentation, labelnames=(), unit='', buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, unit, buckets))
+
+    def render(self):
+        """
+        :return: all metrics in the OpenMetrics text format
+        """
+        with self._lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+snapshot.py
+
+Immutable snapshots of the queue state, published at a fixed rate so that viewers never access docker themselves.
+Consecutive snapshots are compared to incremental diffs, which are pushed to remote viewers.
+"""
+
+import math
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque, namedtuple
+
+from utils import log
+
+
+LOG = log.get_module_log(__name__)
+
+# state of the queue at one point in time, the contained lists and dicts must not be modified by readers
+Snapshot = namedtuple('Snapshot', ['run',  # id of the publisher, seq starts over with every run of the queue
+                                   'seq',  # number of the snapshot, increases with every publication
+                                   'time',  # time of the publication
+                                   'status',  # dict with queue and provider status, uptime and starttime
+                                   'running',  # list of container_stats() dicts of the running containers
+                                   'enqueued',  # list of history_info() dicts of the first enqueued containers
+                                   'history',  # list of history_info() dicts of the most recent finished containers
+                                   'n_enqueued',  # total number of enqueued containers
+                                   'n_history',  # total number of finished containers
+                                   'users'])  # list of users_stats dicts
+
+# lists of a snapshot whose entries are identified by their 'job_id', and the event of a job entering them
+JOB_LISTS = OrderedDict([('enqueued', 'added'), ('running', 'started'), ('history', 'finished')])
+
+
+def event_id(run, seq):
+    """
+    id of a snapshot or diff in the event stream, unique across restarts of the queue
+    :param run: id of the publisher run
+    :param seq: seq of the snapshot
+    :return: id as str
+    """
+    return '{}-{}'.format(run, seq)
+
+
+def parse_event_id(value):
+    """
+    :param value: id as returned by event_id
+    :return: tuple of run and seq
+    :raises ValueError: if the id is malformed
+    """
+    run, _, seq = str(value).rpartition('-')
+    if not run:
+        raise ValueError('invalid event id {}'.format(value))
+    return run, int(seq)
+
+
+def _equal(value_a, value_b):
+    # nan of missing telemetry would otherwise show up as change in every diff
+    if isinstance(value_a, float) and isinstance(value_b, float) and math.isnan(value_a) and math.isnan(value_b):
+        return True
+    return value_a == value_b
+
+
+def diff_list(old, new):
+    """
+    compares two versions of a job list
+    :param old: list of job dicts with 'job_id'
+    :param new: list of job dicts with 'job_id'
+    :return: dict with the 'added' entries, the 'changed' fields of the other entries (including their 'job_id'), the
+             'removed' job ids and the new 'order' of the job ids if it differs. keys without content are omitted
+    """
+    old_entries = {entry['job_id']: entry for entry in old}
+    new_order = [entry['job_id'] for entry in new]
+
+    added, changed = [], []
+    for entry in new:
+        previous = old_entries.get(entry['job_id'])
+        if previous is None:
+            added.append(entry)
+            continue
+        fields = {key: value for key, value in entry.items() if key not in previous or not _equal(previous[key], value)}
+        if fields:
+            fields['job_id'] = entry['job_id']
+            changed.append(fields)
+
+    new_ids = set(new_order)
+    removed = [job_id for job_id in old_entries if job_id not in new_ids]
+
+    diff = {}
+    if added:
+        diff['added'] = added
+    if changed:
+        diff['changed'] = changed
+    if removed:
+        diff['removed'] = removed
+    if new_order != [entry['job_id'] for entry in old]:
+        diff['order'] = new_order
+    return diff
+
+
+def diff_snapshots(old, new):
+    """
+    incremental changes between two snapshots
+    :param old: Snapshot
+    :param new: Snapshot published after old
+    :return: dict with 'run', 'seq', 'prev' (seq of old), 'time' and 'events' (list of jobs that were added, started or
+             finished), plus the changed parts of the snapshot. job lists are given as diff_list() dicts, the changed
+             fields of running jobs are the telemetry deltas
+    """
+    diff = {'run': new.run, 'seq': new.seq, 'prev': old.seq, 'time': new.time, 'events': []}
+
+    for field in ('status', 'users', 'n_enqueued', 'n_history'):
+        if getattr(old, field) != getattr(new, field):
+            diff[field] = getattr(new, field)
+
+    for field, event in JOB_LISTS.items():
+        list_diff = diff_list(getattr(old, field), getattr(new, field))
+        if list_diff:
+            diff[field] = list_diff
+        for entry in list_diff.get('added', []):
+            diff['events'].append({'type': event, 'job_id': entry['job_id']})
+
+    return diff
+
+
+def apply_diff(snapshot, diff):
+    """
+    applies a diff to the snapshot it was computed from
+    :param snapshot: Snapshot of the same run with seq == diff['prev']
+    :param diff: dict as returned by diff_snapshots
+    :return: the new Snapshot
+    """
+    fields = snapshot._asdict()
+    fields['seq'], fields['time'] = diff['seq'], diff['time']
+
+    for field in ('status', 'users', 'n_enqueued', 'n_history'):
+        if field in diff:
+            fields[field] = diff[field]
+
+    for field in JOB_LISTS:
+        if field not in diff:
+            continue
+        list_diff = diff[field]
+        entries = {entry['job_id']: entry for entry in fields[field]}
+        for job_id in list_diff.get('removed', []):
+            entries.pop(job_id, None)
+        for changes in list_diff.get('changed', []):
+            entries[changes['job_id']] = dict(entries[changes['job_id']], **changes)
+        for entry in list_diff.get('added', []):
+            entries[entry['job_id']] = entry
+        order = list_diff.get('order', [entry['job_id'] for entry in fields[field]])
+        fields[field] = [entries[job_id] for job_id in order]
+
+    return Snapshot(**fields)
+
+
+class SnapshotPublisher(object):
+
+    def __init__(self, build_fn, interval=1.0, backlog=300):
+        """
+        background thread that builds a new snapshot every interval seconds and replaces the published one
+        :param build_fn: function returning the fields of a Snapshot (except seq and time) as dict
+        :param interval: seconds between two snapshots
+        :param backlog: number of recent diffs that are kept for clients resuming their subscription
+        """
+        self.build_fn = build_fn
+        self.interval = interval
+
+        # seq starts over with every run, clients of an earlier run are told apart by the run id
+        self.run_id = '{:x}'.format(int(time.time() * 1000))
+        self.seq = 0
+        self.diffs = deque(maxlen=backlog)
+        self.listeners = []
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    @property
+    def snapshot(self):
+        """
+        :return: the latest snapshot, built on the spot if none has been published yet
+        """
+        if self._snapshot is None:
+            self.publish()
+        return self._snapshot
+
+    def publish(self):
+        """
+        builds a snapshot and publishes it
+        :return: the new snapshot
+        """
+        fields = self.build_fn()
+        with self._lock:
+            self.seq += 1
+            snapshot = Snapshot(run=self.run_id, seq=self.seq, time=time.time(), **fields)
+            diff = diff_snapshots(self._snapshot, snapshot) if self._snapshot is not None else None
+            if diff is not None:
+                self.diffs.append(diff)
+
+            # readers only ever see complete snapshots, since replacing the reference is atomic
+            self._snapshot = snapshot
+
+        # notify subscribers, e.g. the event stream of the api
+        for listener in list(self.listeners):
+            try:
+                listener(snapshot, diff)
+            except Exception:
+                LOG.error(traceback.format_exc())
+
+        return snapshot
+
+    def diffs_since(self, seq, run):
+        """
+        diffs that lead from an older snapshot to the current one
+        :param seq: seq of the snapshot the client has
+        :param run: run id of the snapshot the client has
+        :return: list of diffs (empty if the client is up to date), None if they are not available anymore or the
+                 snapshot is from an earlier run of the queue
+        """
+        with self._lock:
+            if run != self.run_id:
+                return None
+            if seq == self.seq:
+                return []
+            diffs = [diff for diff in self.diffs if diff['seq'] > seq]
+            if not diffs or diffs[0]['prev'] != seq:
+                return None
+            return diffs
+
+    def start(self):
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-Snapshot')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.running:
+            self.thread.join()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.publish()
+            except Exception:
+                LOG.error(traceback.format_exc())
+            self._stop_event.wait(self.interval)
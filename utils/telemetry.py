@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+telemetry.py
+
+Central sampler for the resource usage of all running containers
+"""
+
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import log
+from utils.cgroup import CgroupReader
+from utils.cpu import container_cpu_percent
+from utils.docker_client import get_client
+from utils.gpu import get_gpu_infos
+from utils.metrics import REGISTRY
+
+
+LOG = log.get_module_log(__name__)
+
+SAMPLE_TIME = REGISTRY.histogram('dopq_telemetry_sample_seconds', 'time to sample all running containers',
+                                 unit='seconds')
+SAMPLED_CONTAINERS = REGISTRY.gauge('dopq_telemetry_containers', 'containers in the latest sample')
+CONTAINER_CPU = REGISTRY.gauge('dopq_containers_cpu_percent', 'cpu usage of all running containers (100 = one core)',
+                               unit='percent')
+CONTAINER_MEMORY = REGISTRY.gauge('dopq_containers_memory_bytes', 'memory usage of all running containers',
+                                  unit='bytes')
+
+# columns of the ring buffers
+FIELDS = ('time', 'cpu', 'memory', 'memory_limit', 'net_rx', 'net_tx', 'blk_read', 'blk_write', 'pids', 'gpu_util',
+          'gpu_memory')
+
+
+class RingBuffer(object):
+
+    def __init__(self, capacity):
+        """
+        fixed size time series of samples, old samples are overwritten once the buffer is full
+        :param capacity: maximum number of samples
+        """
+        self.data = np.full((capacity, len(FIELDS)), np.nan)
+        self.index = 0
+        self.count = 0
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    def append(self, sample):
+        """
+        stores a sample
+        :param sample: dict mapping (a subset of) FIELDS to values, missing fields are stored as nan
+        :return: None
+        """
+        self.data[self.index] = [sample.get(field, np.nan) for field in FIELDS]
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def values(self):
+        """
+        :return: array with all stored samples in chronological order, shape (count, len(FIELDS))
+        """
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return np.roll(self.data, -self.index, axis=0)
+
+    def latest(self):
+        """
+        :return: dict with the most recent sample, None if the buffer is empty
+        """
+        if self.count == 0:
+            return None
+        return dict(zip(FIELDS, self.data[(self.index - 1) % self.capacity].tolist()))
+
+
+def parse_docker_stats(stats_dict):
+    """
+    extracts memory, network and block io counters from a (non-streaming) docker stats response
+    :param stats_dict: dict as returned by the docker stats endpoint
+    :return: sample dict
+    """
+    mem_stats = stats_dict.get('memory_stats') or {}
+    networks = stats_dict.get('networks') or {}
+    blkio = (stats_dict.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+
+    return {'memory': mem_stats.get('usage', np.nan),
+            'memory_limit': mem_stats.get('limit', np.nan),
+            'net_rx': sum(net.get('rx_bytes', 0) for net in networks.values()),
+            'net_tx': sum(net.get('tx_bytes', 0) for net in networks.values()),
+            'blk_read': sum(entry['value'] for entry in blkio if entry.get('op', '').lower() == 'read'),
+            'blk_write': sum(entry['value'] for entry in blkio if entry.get('op', '').lower() == 'write'),
+            'pids': (stats_dict.get('pids_stats') or {}).get('current', np.nan)}
+
+
+def parse_cpu_counters(stats_dict):
+    """
+    extracts the cpu counters of the current and the previous reading from a docker stats response
+    :param stats_dict: dict as returned by the docker stats endpoint
+    :return: tuple of (counters, previous counters), each a dict with 'usage', 'system' and 'online_cpus'
+    """
+    def counters(cpu_stats):
+        cpu_usage = cpu_stats.get('cpu_usage') or {}
+        online_cpus = cpu_stats.get('online_cpus') or len(cpu_usage.get('percpu_usage') or []) or 1
+        return {'usage': cpu_usage.get('total_usage', np.nan),
+                'system': cpu_stats.get('system_cpu_usage', np.nan),
+                'online_cpus': online_cpus,
+                'backend': 'docker'}
+
+    return counters(stats_dict.get('cpu_stats') or {}), counters(stats_dict.get('precpu_stats') or {})
+
+
+class TelemetrySampler(object):
+
+    def __init__(self, interval=2, capacity=1800, backend='cgroup', cgroup_root='/sys/fs/cgroup', workers=8):
+        """
+        background thread that samples the resource usage of all running containers and keeps a history per job
+        :param interval: seconds between two samples
+        :param capacity: number of samples kept per job
+        :param backend: 'cgroup' to read the counters from the cgroup filesystem, 'docker' to use the stats endpoint
+        :param cgroup_root: mount point of the cgroup filesystem
+        :param workers: number of containers that are read at the same time
+        """
+        self.interval = interval
+        self.capacity = capacity
+        self.backend = backend
+        self.workers = workers
+        self.pool = None
+        self.cgroups = CgroupReader(cgroup_root)
+        self.buffers = {}
+        self.totals = {}
+        self.cpu_counters = {}
+
+        # jobs released while they may still be sampled, their samples are dropped
+        self.released = set()
+        self.containers_fn = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, containers_fn, interval=None, capacity=None, backend=None, cgroup_root=None, workers=None):
+        """
+        starts sampling
+        :param containers_fn: function returning the list of running Container objects
+        :param interval: seconds between two samples
+        :param capacity: number of samples kept per job
+        :param backend: 'cgroup' or 'docker'
+        :param cgroup_root: mount point of the cgroup filesystem
+        :param workers: number of containers that are read at the same time
+        :return: None
+        """
+        self.containers_fn = containers_fn
+        self.interval = interval if interval is not None else self.interval
+        self.capacity = capacity if capacity is not None else self.capacity
+        self.backend = backend if backend is not None else self.backend
+        self.workers = workers if workers is not None else self.workers
+        if cgroup_root is not None:
+            self.cgroups = CgroupReader(cgroup_root)
+
+        # a docker stats request takes one to two seconds, the containers are read in parallel
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='DoPQ-Telemetry')
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='DoPQ-Telemetry')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.running:
+            self.thread.join()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except Exception:
+                LOG.error(traceback.format_exc())
+            self._stop_event.wait(self.interval)
+
+    def read(self, container):
+        """
+        reads the counters of a single container from the configured backend, falls back to the docker stats
+        endpoint if the cgroup of the container can not be read
+        :param container: Container object
+        :return: tuple of (sample dict, cpu counters, previous cpu counters included in the reading or None)
+        """
+        if self.backend == 'cgroup':
+            try:
+                reading = self.cgroups.read(container.container_id)
+            except (IOError, OSError, ValueError, KeyError):
+                LOG.debug('\tcould not read cgroup of {}, using docker stats'.format(container.container_id))
+            else:
+                # the wall clock serves as reference, so that 100% again corresponds to one core
+                counters = {'usage': reading.pop('cpu_usage'), 'system': reading['time'] * 1e9, 'online_cpus': 1,
+                            'backend': 'cgroup'}
+                return reading, counters, None
+
+        stats_dict = get_client().api.stats(container.container_id, stream=False)
+        counters, precpu_counters = parse_cpu_counters(stats_dict)
+        sample = parse_docker_stats(stats_dict)
+        sample['time'] = time.time()
+        return sample, counters, precpu_counters
+
+    def last_counters(self, job_id, counters, precpu_counters=None):
+        """
+        remembers the cpu counters of a reading and returns the ones it has to be compared with
+        :param job_id: job id of the container
+        :param counters: cpu counters of the current reading
+        :param precpu_counters: previous cpu counters included in the reading, used for the first reading of a job
+        :return: cpu counters of the last reading of the job, nan counters if there is no comparable one
+        """
+        with self._lock:
+            last_counters = self.cpu_counters.get(job_id, precpu_counters)
+            self.cpu_counters[job_id] = counters
+        if last_counters is None or last_counters['backend'] != counters['backend']:
+            last_counters = {'usage': np.nan, 'system': np.nan}
+        return last_counters
+
+    def sample_container(self, container):
+        """
+        reads a single container outside of the sampling thread, e.g. while the sampler is not running. the cpu
+        usage is computed against the previous reading of the container
+        :param container: Container object
+        :return: sample dict including 'cpu' (nan for the first cgroup reading)
+        """
+        sample, counters, precpu_counters = self.read(container)
+        last_counters = self.last_counters(container.job_id, counters, precpu_counters)
+        sample['cpu'] = round(float(container_cpu_percent(counters['usage'], last_counters['usage'],
+                                                          counters['system'], last_counters['system'],
+                                                          counters['online_cpus'])), 1)
+        return sample
+
+    def sample(self):
+        """
+        takes one sample of every running container
+        :return: None
+        """
+        def read(container):
+            try:
+                return self.read(container)
+            except Exception:
+                # the container may have exited in the meantime
+                return None
+
+        sample_start = time.time()
+        containers = [container for container in list(self.containers_fn()) if container.container_id is not None]
+        if self.pool is not None:
+            readings = list(self.pool.map(read, containers))
+        else:
+            readings = [read(container) for container in containers]
+
+        samples, counters, previous = {}, [], []
+        for container, reading in zip(containers, readings):
+
+            if reading is None:
+                continue
+            sample, current_counters, precpu_counters = reading
+
+            counters.append(current_counters)
+            previous.append(self.last_counters(container.job_id, current_counters, precpu_counters))
+
+            if container.use_gpu:
+                gpu_info = list(get_gpu_infos(container.gpu_minors).values())
+                if gpu_info:
+                    sample['gpu_util'] = np.mean([gpu_dt['load'] * 100.0 for gpu_dt in gpu_info])
+                    sample['gpu_memory'] = np.sum([gpu_dt['memoryUsed'] for gpu_dt in gpu_info])
+
+            samples[container.job_id] = sample
+
+        # cpu usage of all containers at once
+        if samples:
+            cpu = container_cpu_percent([c['usage'] for c in counters], [p['usage'] for p in previous],
+                                        [c['system'] for c in counters], [p['system'] for p in previous],
+                                        [c['online_cpus'] for c in counters])
+            for sample, cpu_i in zip(samples.values(), cpu):
+                sample['cpu'] = round(float(cpu_i), 1)
+
+        with self._lock:
+            for job_id, sample in samples.items():
+
+                # the job has finished while it was sampled
+                if job_id in self.released:
+                    self.cpu_counters.pop(job_id, None)
+                    continue
+
+                if job_id not in self.buffers:
+                    self.buffers[job_id] = RingBuffer(self.capacity)
+                self.buffers[job_id].append(sample)
+
+                # running peak, sum and count over the whole lifetime of the job, the ring buffer only keeps the
+                # most recent samples
+                values = np.array([sample.get(field, np.nan) for field in FIELDS], dtype=float)
+                totals = self.totals.setdefault(job_id, {'max': np.full(len(FIELDS), np.nan),
+                                                         'sum': np.zeros(len(FIELDS)),
+                                                         'count': np.zeros(len(FIELDS))})
+                totals['max'] = np.fmax(totals['max'], values)
+                totals['sum'] += np.nan_to_num(values)
+                totals['count'] += ~np.isnan(values)
+
+            # released jobs that have left the running containers can not be sampled anymore
+            self.released &= set(container.job_id for container in containers)
+
+        SAMPLE_TIME.observe(time.time() - sample_start)
+        SAMPLED_CONTAINERS.set(len(samples))
+        CONTAINER_CPU.set(float(np.nansum([sample.get('cpu', np.nan) for sample in samples.values()])))
+        CONTAINER_MEMORY.set(float(np.nansum([sample.get('memory', np.nan) for sample in samples.values()])))
+
+    def latest(self, job_id):
+        """
+        :param job_id: job id of the container
+        :return: dict with the most recent sample of the job, None if there is none
+        """
+        with self._lock:
+            buffer = self.buffers.get(job_id)
+            return buffer.latest() if buffer is not None else None
+
+    def series(self, job_id):
+        """
+        :param job_id: job id of the container
+        :return: array with all samples of the job in chronological order (columns as in FIELDS), None if unknown
+        """
+        with self._lock:
+            buffer = self.buffers.get(job_id)
+            return buffer.values().copy() if buffer is not None else None
+
+    def aggregate(self, job_id, window=None):
+        """
+        computes rolling aggregates of a job
+        :param job_id: job id of the container
+        :param window: only use samples of the last window seconds, the whole lifetime of the job if None
+        :return: dict mapping each field (except time) to a dict with 'mean' and 'max', None if there are no samples
+        """
+        if window is None:
+            with self._lock:
+                totals = self.totals.get(job_id)
+                if totals is None:
+                    return None
+                maxima, sums, counts = totals['max'].copy(), totals['sum'].copy(), totals['count'].copy()
+
+            aggregates = {}
+            for column, field in enumerate(FIELDS[1:], start=1):
+                if counts[column] == 0:
+                    aggregates[field] = {'mean': np.nan, 'max': np.nan}
+                else:
+                    aggregates[field] = {'mean': float(sums[column] / counts[column]),
+                                         'max': float(maxima[column])}
+            return aggregates
+
+        values = self.series(job_id)
+        if values is None or len(values) == 0:
+            return None
+
+        values = values[values[:, 0] >= time.time() - window]
+        if len(values) == 0:
+            return None
+
+        aggregates = {}
+        for column, field in enumerate(FIELDS[1:], start=1):
+            column_values = values[:, column]
+            if np.all(np.isnan(column_values)):
+                aggregates[field] = {'mean': np.nan, 'max': np.nan}
+            else:
+                aggregates[field] = {'mean': float(np.nanmean(column_values)),
+                                     'max': float(np.nanmax(column_values))}
+
+        return aggregates
+
+    def release(self, job_id):
+        """
+        removes the history of a job, e.g. after it has finished
+        :param job_id: job id of the container
+        :return: the removed RingBuffer or None
+        """
+        with self._lock:
+            self.released.add(job_id)
+            self.cpu_counters.pop(job_id, None)
+            self.totals.pop(job_id, None)
+            return self.buffers.pop(job_id, None)
+
+
+SAMPLER = TelemetrySampler()